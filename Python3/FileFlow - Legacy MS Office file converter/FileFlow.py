@@ -1,190 +1,22 @@
 # Version 2.1 20240721
-import os
-import time
 import logging
-import colorlog
 from datetime import datetime, timedelta
-import xlwings as xw
-import win32com.client as win32
 import customtkinter as ctk
 from tkinter import filedialog, messagebox, Text
 import threading
+from converters import default_backend
+from scheduler import DEFAULT_CONVERSION_WORKERS
+from engine import configure_logging, detect_files, convert_files, INDEX_FILE, LOG_DIRECTORY
+from log_sink import TextWidgetSink
 
-# Function to create the log directory if it doesn't exist
-def ensure_log_directory_exists(log_directory):
-    if not os.path.exists(log_directory):
-        os.makedirs(log_directory)
-
-# Function to format the log file name and ensure log directory exists
-def get_log_file_name(log_directory, suffix=''):
-    ensure_log_directory_exists(log_directory)
-    date_str = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
-    log_file_name = os.path.join(log_directory, f'{date_str}{suffix}.log')
-    return log_file_name
-
-# Configure logging
-def configure_logging(directory, suffix='', text_widget=None):
-    log_directory = r'C:\temp\FileFlowLogs'
-    log_file_name = get_log_file_name(log_directory, suffix)
-    log_formatter = colorlog.ColoredFormatter(
-        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-        reset=True,
-        log_colors={
-            'DEBUG': 'cyan',
-            'INFO': 'green',
-            'WARNING': 'yellow',
-            'ERROR': 'red',
-            'CRITICAL': 'bold_red',
-        }
-    )
-
-    file_formatter = logging.Formatter(
-        '%(asctime)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
-    # Remove previous handlers
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    # Console handler with color
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(log_formatter)
-    logger.addHandler(console_handler)
-
-    # File handler
-    file_handler = logging.FileHandler(log_file_name, mode='w')
-    file_handler.setFormatter(file_formatter)
-    logger.addHandler(file_handler)
-
-    # Text widget handler
-    if text_widget:
-        text_handler = TextHandler(text_widget, app)  # Pass the main application window to the handler
-        text_handler.setFormatter(file_formatter)  # Use file formatter to avoid color codes
-        logger.addHandler(text_handler)
-
-class TextHandler(logging.Handler):
-    def __init__(self, text_widget, root):
-        super().__init__()
-        self.text_widget = text_widget
-        self.root = root  # Store a reference to the main application window
-
-        # Create tags for different log levels
-        self.text_widget.tag_configure("DEBUG", foreground="cyan")
-        self.text_widget.tag_configure("INFO", foreground="green")
-        self.text_widget.tag_configure("WARNING", foreground="yellow")
-        self.text_widget.tag_configure("ERROR", foreground="red")
-        self.text_widget.tag_configure("CRITICAL", foreground="red", font=('Helvetica', '12', 'bold'))
-
-    def emit(self, record):
-        msg = self.format(record)
-        level = record.levelname
-
-        def append_text():
-            self.text_widget.configure(state='normal')
-            self.text_widget.insert('end', msg + '\n\n', level)  # Add blank line after each log entry and apply tag
-            self.text_widget.configure(state='disabled')
-            self.text_widget.yview('end')
-        self.root.after(0, append_text)  # Call after on the main application window
-
-def detect_files(directory, cutoff_date, file_types=['.xls', '.doc']):
-    logger = logging.getLogger()
-    logger.info(f"Starting detection in directory: {directory}")
-    logger.info(f"Cutoff date for file modification: {cutoff_date.strftime('%Y-%m-%d')}")
-
-    total_files_checked = 0
-    files_to_check = []
-
-    try:
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                total_files_checked += 1
-                file_path = os.path.join(root, file)
-                last_modified_date = datetime.fromtimestamp(os.path.getmtime(file_path))
-                logger.debug(f"Checking file: {file_path}, Last Modified: {last_modified_date}")
-
-                if any(file.lower().endswith(ft.lower()) for ft in file_types):
-                    if last_modified_date > cutoff_date:
-                        files_to_check.append(file_path)
-                        logger.info(f"Detected file: {file_path}")
-                    else:
-                        logger.debug(f"File {file_path} skipped, last modified date {last_modified_date} is before cutoff {cutoff_date}")
-                else:
-                    logger.debug(f"File {file_path} does not match the file types {file_types}")
-
-    except Exception as e:
-        logger.error(f"Error during detection: {e}")
-
-    logger.info(f"Detection completed. Total files checked: {total_files_checked}, Files detected: {len(files_to_check)}")
-    return files_to_check
-
-def convert_files(directory, cutoff_date, delay=2, file_types=['.xls', '.doc'], delete_originals=False):
-    logger = logging.getLogger()
-    logger.info(f"Starting conversion in directory: {directory}")
-    logger.info(f"Cutoff date for file modification: {cutoff_date.strftime('%Y-%m-%d')}")
-
-    total_files_checked = 0
-    total_files_converted = 0
-
-    app = xw.App(visible=False)
-    app.display_alerts = False
-    app.screen_updating = False
-
-    word = win32.Dispatch("Word.Application")
-    word.Visible = False
-
-    files_to_convert = detect_files(directory, cutoff_date, file_types)
-
-    try:
-        for file_path in files_to_convert:
-            total_files_checked += 1
-            logger.info(f"Processing file: {file_path}")
-
-            try:
-                if file_path.lower().endswith('.xls'):
-                    wb = app.books.open(os.path.abspath(file_path))
-                    logger.info(f"Opened file: {file_path}")
-
-                    new_file_path = os.path.abspath(file_path.rsplit('.', 1)[0] + '.xlsx')
-                    logger.info(f"Converting to: {new_file_path}")
+# Backends offered in the GUI ('fake' is only for testing)
+GUI_BACKENDS = ['office', 'libreoffice', 'native']
 
-                    wb.save(new_file_path)
-                    logger.info(f"Saved file as: {new_file_path}")
+# Levels the log window can show; the log file always gets everything
+GUI_LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
 
-                    wb.close()
-                    logger.info(f"Closed file: {file_path}")
-
-                elif file_path.lower().endswith('.doc'):
-                    doc = word.Documents.Open(os.path.abspath(file_path))
-                    logger.info(f"Opened file: {file_path}")
-
-                    new_file_path = os.path.abspath(file_path.rsplit('.', 1)[0] + '.docx')
-                    logger.info(f"Converting to: {new_file_path}")
-
-                    doc.SaveAs(new_file_path, FileFormat=16)
-                    doc.Close()
-                    logger.info(f"Saved file as: {new_file_path}")
-
-                if delete_originals:
-                    os.remove(os.path.abspath(file_path))
-                    logger.info(f"Deleted original file: {file_path}")
-
-                total_files_converted += 1
-
-            except Exception as e:
-                logger.error(f"Error processing file {file_path}: {e}")
-
-            time.sleep(delay)
-
-    finally:
-        app.quit()
-        word.Quit()
-
-    logger.info(f"Conversion completed. Total files checked: {total_files_checked}, Files converted: {total_files_converted}")
+# Number of log entries kept in the log window
+GUI_LOG_LINES = 5000
 
 # GUI Application
 class Application(ctk.CTk):
@@ -214,10 +46,23 @@ class Application(ctk.CTk):
         self.entry_days = ctk.CTkEntry(self, width=100)
         self.entry_days.grid(row=1, column=1, padx=10, pady=5, sticky="w")
 
-        self.label_delay = ctk.CTkLabel(self, text="Processing Time per File (seconds):")
-        self.label_delay.grid(row=2, column=0, padx=10, pady=5, sticky="w")
-        self.entry_delay = ctk.CTkEntry(self, width=100)
-        self.entry_delay.grid(row=2, column=1, padx=10, pady=5, sticky="w")
+        self.label_log_level = ctk.CTkLabel(self, text="Window Log Level:")
+        self.label_log_level.grid(row=1, column=2, padx=10, pady=5, sticky="w")
+        self.var_log_level = ctk.StringVar(value='INFO')
+        self.option_log_level = ctk.CTkOptionMenu(self, variable=self.var_log_level, values=GUI_LOG_LEVELS)
+        self.option_log_level.grid(row=1, column=3, padx=5, pady=5, sticky="w")
+
+        self.label_workers = ctk.CTkLabel(self, text="Conversion Workers:")
+        self.label_workers.grid(row=2, column=0, padx=10, pady=5, sticky="w")
+        self.entry_workers = ctk.CTkEntry(self, width=100)
+        self.entry_workers.insert(0, str(DEFAULT_CONVERSION_WORKERS))
+        self.entry_workers.grid(row=2, column=1, padx=10, pady=5, sticky="w")
+
+        self.label_backend = ctk.CTkLabel(self, text="Conversion Backend:")
+        self.label_backend.grid(row=2, column=2, padx=10, pady=5, sticky="w")
+        self.var_backend = ctk.StringVar(value=default_backend())
+        self.option_backend = ctk.CTkOptionMenu(self, variable=self.var_backend, values=GUI_BACKENDS)
+        self.option_backend.grid(row=2, column=3, padx=5, pady=5, sticky="w")
 
         self.label_file_types = ctk.CTkLabel(self, text="File Types:")
         self.label_file_types.grid(row=3, column=0, padx=10, pady=5, sticky="w")
@@ -240,6 +85,10 @@ class Application(ctk.CTk):
         self.check_delete_originals = ctk.CTkCheckBox(self, text="Delete original files after conversion", variable=self.var_delete_originals)
         self.check_delete_originals.grid(row=4, column=3, padx=5, pady=5, sticky="w")
 
+        self.var_use_index = ctk.BooleanVar()
+        self.check_use_index = ctk.CTkCheckBox(self, text="Use scan index (only rescan changed folders)", variable=self.var_use_index)
+        self.check_use_index.grid(row=3, column=3, padx=5, pady=5, sticky="w")
+
         self.button_run = ctk.CTkButton(self, text="Run", command=self.run_operation)
         self.button_run.grid(row=5, column=0, columnspan=4, padx=10, pady=20)
 
@@ -250,6 +99,21 @@ class Application(ctk.CTk):
         self.text_log.grid(row=6, column=0, columnspan=4, padx=10, pady=5, sticky="nsew")
         self.text_log.configure(bg="black", fg="white")
 
+        # Log records are queued by the worker threads and added to the window in batches
+        self.log_sink = TextWidgetSink(self.text_log, self, max_lines=GUI_LOG_LINES)
+        self.log_sink.start()
+
+        self.var_sniff = ctk.BooleanVar(value=True)
+        self.check_sniff = ctk.CTkCheckBox(self, text="Check file contents", variable=self.var_sniff)
+        self.check_sniff.grid(row=7, column=0, padx=10, pady=5, sticky="w")
+
+        self.label_progress = ctk.CTkLabel(self, text="")
+        self.label_progress.grid(row=7, column=1, columnspan=3, padx=10, pady=5, sticky="w")
+
+        self.var_dedup = ctk.BooleanVar(value=True)
+        self.check_dedup = ctk.CTkCheckBox(self, text="Convert identical files once", variable=self.var_dedup)
+        self.check_dedup.grid(row=8, column=0, padx=10, pady=5, sticky="w")
+
     def browse_directory(self):
         directory = filedialog.askdirectory()
         if directory:
@@ -269,9 +133,11 @@ class Application(ctk.CTk):
             return
 
         try:
-            delay = int(self.entry_delay.get().strip())
+            workers = int(self.entry_workers.get().strip())
+            if workers < 1:
+                raise ValueError
         except ValueError:
-            messagebox.showerror("Error", "Please enter a valid processing time per file.")
+            messagebox.showerror("Error", "Please enter a valid number of conversion workers.")
             return
 
         cutoff_date = datetime.now() - timedelta(days=days)
@@ -286,52 +152,73 @@ class Application(ctk.CTk):
 
         operation = self.var_operation.get()
         delete_originals = self.var_delete_originals.get()
+        backend = self.var_backend.get()
+        index_path = INDEX_FILE if self.var_use_index.get() else None
+        sniff = self.var_sniff.get()
+        dedup = self.var_dedup.get()
 
-        configure_logging(directory, f' - {operation.capitalize()}', self.text_log)
+        self.log_sink.clear()
+        self.log_sink.setLevel(self.var_log_level.get())
+        configure_logging(directory, f' - {operation.capitalize()}', [self.log_sink])
 
         if operation == 'check':
-            threading.Thread(target=self.run_check, args=(directory, cutoff_date, file_types)).start()
+            threading.Thread(target=self.run_check, args=(directory, cutoff_date, file_types, index_path, sniff)).start()
         elif operation == 'convert':
-            self.run_conversion_thread(directory, cutoff_date, delay, file_types, delete_originals)
+            self.run_conversion_thread(directory, cutoff_date, workers, file_types, delete_originals, index_path, backend, sniff,
+                                       dedup)
         else:
             messagebox.showerror("Error", "Invalid operation. Please select 'check' or 'convert'.")
 
-    def run_check(self, directory, cutoff_date, file_types):
-        detect_files(directory, cutoff_date, file_types)
+    def run_check(self, directory, cutoff_date, file_types, index_path=None, sniff=True):
+        detect_files(directory, cutoff_date, file_types, index_path=index_path, sniff=sniff)
         self.show_completion_message()
 
-    def run_conversion_thread(self, directory, cutoff_date, delay, file_types, delete_originals):
+    def run_conversion_thread(self, directory, cutoff_date, workers, file_types, delete_originals, index_path=None, backend=None,
+                              sniff=True, dedup=True):
         def conversion_wrapper():
-            convert_files(directory, cutoff_date, delay, file_types, delete_originals)
+            convert_files(directory, cutoff_date, workers, file_types, delete_originals, index_path, backend,
+                          on_progress=self.show_progress, sniff=sniff, dedup=dedup)
             self.show_completion_message()
 
         threading.Thread(target=conversion_wrapper).start()
 
+    # Called from the conversion thread, hands the update to the Tk main loop
+    def show_progress(self, discovered, converted, failed, skipped, final):
+        status = "Finished" if final else "Converting"
+        text = f"{status}: {discovered} files discovered, {converted} converted, {failed} failed, {skipped} skipped"
+        self.after(0, lambda: self.label_progress.configure(text=text))
+
     def show_completion_message(self):
-        log_directory = r'C:\temp\FileFlowLogs'
-        completion_message = f"Operation completed successfully.\n\nLogs can be found in:\n{log_directory}"
+        completion_message = f"Operation completed successfully.\n\nLogs can be found in:\n{LOG_DIRECTORY}"
         self.after(0, lambda: messagebox.showinfo("Completed", completion_message))
 
     def show_help(self):
         help_window = ctk.CTkToplevel(self)
         help_window.title("Help")
-        help_window.geometry("650x300")
+        help_window.geometry("650x360")
         help_text = """
         Usage Examples:
 
         1. Check Files:
         - Select the target directory using the 'Browse' button.
         - Enter the number of days for the cutoff date.
+        - Pick the window log level (DEBUG also lists every file skipped).
         - Select the file types you want to check (*.doc, *.xls).
         - Choose the 'Check' operation.
+        - Tick 'Use scan index' to only rescan folders changed since the last run.
         - Click 'Run' to start checking the files.
 
         2. Convert Files:
         - Select the target directory using the 'Browse' button.
         - Enter the number of days for the cutoff date.
-        - Enter the processing time per file in seconds.
+        - Enter the number of conversion workers (each runs its own Word/Excel).
+        - Pick the conversion backend: 'office' (Word/Excel), 'libreoffice' (headless) or 'native'
+          (.xls without Office, other files through Office).
         - Select the file types you want to convert (*.doc, *.xls).
         - Choose the 'Convert' operation.
+        - Leave 'Check file contents' ticked to skip files that are not really Word/Excel 97-2003.
+        - Leave 'Convert identical files once' ticked to copy the output of byte-identical files
+          instead of converting each copy.
         - Check the 'Delete original files after conversion' if you want to delete the original files after conversion.
         - Click 'Run' to start converting the files.
         """
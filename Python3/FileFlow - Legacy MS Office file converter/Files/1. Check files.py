@@ -1,8 +1,14 @@
 import os
+import sys
+import argparse
 import logging
 import colorlog
 from datetime import datetime, timedelta
 
+# The FileFlow engine lives next to FileFlow.py in the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import detect_files
+
 # Function to get the script directory
 def get_script_directory():
     return os.path.dirname(os.path.abspath(__file__))
@@ -52,33 +58,16 @@ def configure_logging(directory, suffix=' - Check'):
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
 
-def detect_files(directory, cutoff_date, file_types=['.xls', '.doc']):
-    logger = logging.getLogger()
-    logger.info(f"Starting detection in directory: {directory}")
-    logger.info(f"Cutoff date for file modification: {cutoff_date.strftime('%Y-%m-%d')}")
-
-    try:
-        # Collect all specified file types in the directory
-        files_to_check = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if any(file.endswith(ft) for ft in file_types):
-                    file_path = os.path.join(root, file)
-                    # Check if the file was modified after the cutoff date
-                    last_modified_date = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    if last_modified_date > cutoff_date:
-                        files_to_check.append(file_path)
-                        logger.info(f"Detected file: {file_path}")
-
-    except Exception as e:
-        logger.error(f"Error during detection: {e}")
-
-    logger.info("Detection completed.")
+# Example usage:
+#   python "1. Check files.py" C:\Temp\Target\Attempt4 --days 60
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='List legacy .doc/.xls files modified after the cutoff date')
+    parser.add_argument('directory', help='directory to check')
+    parser.add_argument('--days', type=int, default=60, help='cutoff date for file modification, in days ago')
+    args = parser.parse_args()
 
-# Example usage
-directory = r'C:\Temp\Target\Attempt4'  # Replace with your directory
-file_types = ['.xls', '.doc']  # Specify the file types to detect
-cutoff_date = datetime.now() - timedelta(days=60)  # Set the cutoff date for file modification
+    file_types = ['.xls', '.doc']  # Specify the file types to detect
+    cutoff_date = datetime.now() - timedelta(days=args.days)  # Set the cutoff date for file modification
 
-configure_logging(directory, ' - Check')
-detect_files(directory, cutoff_date, file_types)
+    configure_logging(args.directory, ' - Check')
+    detect_files(args.directory, cutoff_date, file_types)
@@ -1,12 +1,16 @@
 import os
-import time
-import xlwings as xw
+import sys
+import argparse
 import logging
 import colorlog
 from tqdm import tqdm
 from datetime import datetime, timedelta
-from docx import Document
-import win32com.client as win32
+
+# The FileFlow engine lives next to FileFlow.py in the parent folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import convert_files
+from converters import BACKENDS, default_backend
+from scheduler import DEFAULT_CONVERSION_WORKERS
 
 # Function to get the script directory
 def get_script_directory():
@@ -57,88 +61,31 @@ def configure_logging(directory, suffix=' - Convert'):
     file_handler.setFormatter(file_formatter)
     logger.addHandler(file_handler)
 
-def convert_files(directory, cutoff_date, delay=2, file_types=['.xls', '.doc']):
-    logger = logging.getLogger()
-    logger.info(f"Starting conversion in directory: {directory}")
-    logger.info(f"Cutoff date for file modification: {cutoff_date.strftime('%Y-%m-%d')}")
-
-    # Create an instance of the Excel application
-    app = xw.App(visible=False)
-    app.display_alerts = False
-    app.screen_updating = False
-
-    word = win32.Dispatch("Word.Application")
-    word.Visible = False
-
-    try:
-        # Collect all specified file types in the directory
-        files_to_convert = []
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                if any(file.endswith(ft) for ft in file_types):
-                    file_path = os.path.join(root, file)
-                    # Check if the file was modified within the last 2 months
-                    last_modified_date = datetime.fromtimestamp(os.path.getmtime(file_path))
-                    if last_modified_date > cutoff_date:
-                        files_to_convert.append(file_path)
-        
-        # Create a progress bar
-        for file_path in tqdm(files_to_convert, desc="Processing files", unit="file"):
-            logger.info(f"Processing file: {file_path}")
-
-            try:
-                if file_path.endswith('.xls'):
-                    # Open the .xls file with xlwings
-                    wb = app.books.open(file_path)
-                    logger.info(f"Opened file: {file_path}")
-
-                    # Create the new file path with .xlsx extension
-                    new_file_path = file_path.rsplit('.', 1)[0] + '.xlsx'
-                    logger.info(f"Converting to: {new_file_path}")
+# Example usage:
+#   python "2. Convert files.py" C:\Temp\Target\Attempt4 --days 60 --workers 4
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert legacy .doc/.xls files to .docx/.xlsx')
+    parser.add_argument('directory', help='directory to convert')
+    parser.add_argument('--days', type=int, default=60, help='cutoff date for file modification, in days ago')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default=default_backend(), help='conversion backend')
+    parser.add_argument('--workers', type=int, default=DEFAULT_CONVERSION_WORKERS, help='number of conversion workers')
+    parser.add_argument('--keep-originals', action='store_true', help='do not delete the old .xls or .doc files')
+    args = parser.parse_args()
 
-                    # Save the workbook with the .xlsx extension
-                    wb.save(new_file_path)
-                    logger.info(f"Saved file as: {new_file_path}")
+    file_types = ['.xls', '.doc']  # Specify the file types to convert
+    cutoff_date = datetime.now() - timedelta(days=args.days)  # Set the cutoff date for file modification
 
-                    # Close the workbook
-                    wb.close()
-                    logger.info(f"Closed file: {file_path}")
+    configure_logging(args.directory, ' - Convert')
 
-                elif file_path.endswith('.doc'):
-                    # Open the .doc file with pywin32
-                    doc = word.Documents.Open(file_path)
-                    logger.info(f"Opened file: {file_path}")
+    # Progress bar, ticked as files finish (the total is unknown while the scan is running)
+    progress = tqdm(desc="Processing files", unit="file")
 
-                    # Create the new file path with .docx extension
-                    new_file_path = file_path.rsplit('.', 1)[0] + '.docx'
-                    logger.info(f"Converting to: {new_file_path}")
-
-                    # Save the document with the .docx extension
-                    doc.SaveAs(new_file_path, FileFormat=16)  # 16 corresponds to the wdFormatXMLDocument file format
-                    doc.Close()
-                    logger.info(f"Saved file as: {new_file_path}")
-
-                # Optionally, you can delete the old .xls or .doc file
-                os.remove(file_path)
-                logger.info(f"Deleted original file: {file_path}")
-
-            except Exception as e:
-                logger.error(f"Error processing file {file_path}: {e}")
-
-            # Wait for the specified delay before processing the next file
-            time.sleep(delay)
+    def update_progress(event):
+        if event['event'] in ('converted', 'deduplicated', 'failed', 'skipped'):
+            progress.update(1)
 
+    try:
+        convert_files(args.directory, cutoff_date, workers=args.workers, file_types=file_types,
+                      delete_originals=not args.keep_originals, backend=args.backend, on_event=update_progress)
     finally:
-        app.quit()
-        word.Quit()
-
-    logger.info("Conversion completed.")
-
-# Example usage
-directory = r'C:\Temp\Target\Attempt4'  # Replace with your directory
-file_types = ['.xls', '.doc']  # Specify the file types to convert
-cutoff_date = datetime.now() - timedelta(days=60)  # Set the cutoff date for file modification
-delay_seconds = 0.5  # Delay in seconds between processing files
-
-configure_logging(directory, ' - Convert')
-convert_files(directory, cutoff_date, delay=delay_seconds, file_types=file_types)
+        progress.close()
@@ -1,20 +1,59 @@
 import os
+import sys
+import logging
+import argparse
 import tkinter as tk
 from tkinter import filedialog, messagebox
 
-def delete_docx_files(directory):
-    deleted_files = 0
-    for root, dirs, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith('.docx'):
-                file_path = os.path.join(root, file)
-                try:
-                    os.remove(file_path)
-                    deleted_files += 1
-                    print(f"Deleted: {file_path}")
-                except Exception as e:
-                    print(f"Error deleting file {file_path}: {e}")
-    print(f"Total .docx files deleted: {deleted_files}")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from delete_plan import (plan_deletion, execute_deletion, write_manifest, default_manifest_path, default_quarantine_root,
+                         new_quarantine_run, restore_quarantine, purge_quarantine, DeletionResult, DEFAULT_DELETE_WORKERS,
+                         DEFAULT_UNDO_DAYS)
+
+# Function to print progress on one line, rewritten in place, instead of a line per file
+def print_progress(removed, failed, total, final):
+    print(f"\rDeleted {removed} of {total} files, {failed} failed", end='\n' if final else '', flush=True)
+
+# Function to describe a plan for review: totals and the folders with the most to delete
+def describe_plan(plan, folders=5):
+    lines = [plan.summary()]
+    for folder, count, size in plan.largest_directories(folders):
+        lines.append(f"  {count} files, {size / 1024 / 1024:,.1f} MB in {folder}")
+    return '\n'.join(lines)
+
+# Function to delete every .docx file under directory, from a reviewed plan (see
+# delete_plan.py). With quarantine the files are moved to a quarantine folder in the
+# directory instead, where they can be restored for keep_days; older quarantine runs are
+# purged first. With dry_run only the manifest of the plan is written. The manifest is
+# written even when the deletion is interrupted, listing what was removed.
+# Returns (plan, result or None, manifest path).
+def delete_docx_files(directory, quarantine=False, workers=DEFAULT_DELETE_WORKERS, manifest_path=None, dry_run=False,
+                      keep_days=DEFAULT_UNDO_DAYS, plan=None, on_progress=print_progress):
+    if plan is None:
+        plan = plan_deletion(directory)
+        print(describe_plan(plan))
+    quarantine_directory = None
+    if quarantine and not dry_run:
+        quarantine_root = default_quarantine_root(plan.directory)
+        for folder in purge_quarantine(quarantine_root, keep_days):
+            print(f"Purged quarantine run older than {keep_days} days: {folder}")
+        quarantine_directory = new_quarantine_run(quarantine_root)
+    manifest_path = manifest_path or default_manifest_path(plan.directory, quarantine_directory)
+    if dry_run:
+        write_manifest(manifest_path, plan)
+        print(f"Manifest written to {manifest_path}")
+        return plan, None, manifest_path
+    result = DeletionResult(len(plan.files), quarantine_directory)
+    try:
+        execute_deletion(plan, workers=workers, quarantine_directory=quarantine_directory, on_progress=on_progress,
+                         result=result)
+        print(f"Total .docx files deleted: {len(result.removed)} ({result.summary()})")
+    finally:
+        write_manifest(manifest_path, plan, result)
+        if result.interrupted is not None:
+            print(f"Interrupted after {len(result.removed)} of {result.total} files: {result.interrupted}")
+        print(f"Manifest written to {manifest_path}")
+    return plan, result, manifest_path
 
 def browse_directory():
     directory = filedialog.askdirectory()
@@ -26,11 +65,64 @@ def browse_directory():
 
 def run_deletion():
     directory = browse_directory()
-    if directory:
-        delete_docx_files(directory)
+    if not directory:
+        return
+    plan = plan_deletion(directory)
+    if not plan.files:
+        messagebox.showinfo("Nothing to delete", f"No .docx files found in {directory}.")
+        return
+    review_path = write_manifest(default_manifest_path(plan.directory), plan)
+    if not messagebox.askyesno("Confirm deletion", f"{describe_plan(plan)}\n\nThe full list is in {review_path}\n\n"
+                                                   f"Delete these files?"):
+        return
+    quarantine = messagebox.askyesno("Quarantine", f"Move the files to a quarantine folder instead, so they can be "
+                                                   f"restored for {DEFAULT_UNDO_DAYS} days?")
+    _, result, manifest_path = delete_docx_files(directory, quarantine=quarantine, plan=plan)
+    if result.failed:
+        messagebox.showwarning("Completed with errors", f"{len(result.removed)} files deleted, {len(result.failed)} failed.\n\n"
+                                                       f"Details are in {manifest_path}")
+    elif quarantine:
+        messagebox.showinfo("Completed", f"{len(result.removed)} files moved to {result.quarantine_directory}.\n\n"
+                                         f"To undo, run this script with --restore and that folder.")
+    else:
         messagebox.showinfo("Completed", "Deletion operation completed successfully.")
 
+# Without arguments the directory is chosen in a dialog; with them it runs without a window
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Delete all .docx files in a directory tree')
+    parser.add_argument('directory', nargs='?', help='directory to delete the .docx files from, subfolders included')
+    parser.add_argument('--dry-run', action='store_true', help='only write the manifest of what would be deleted')
+    parser.add_argument('--quarantine', action='store_true',
+                        help=f'move the files to {os.path.basename(default_quarantine_root("."))} in the directory, '
+                             'so they can be restored')
+    parser.add_argument('--keep-days', type=int, default=DEFAULT_UNDO_DAYS,
+                        help='days a quarantine run can be restored before it is purged (default %(default)s)')
+    parser.add_argument('--restore', metavar='QUARANTINE_RUN', help='put the files of a quarantine run back')
+    parser.add_argument('--workers', type=int, default=DEFAULT_DELETE_WORKERS, help='threads deleting files')
+    parser.add_argument('--manifest', help='where to write the JSON manifest')
+    parser.add_argument('--yes', action='store_true', help='do not ask before deleting')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+
+    if args.restore:
+        restored, failed = restore_quarantine(args.restore, workers=args.workers)
+        print(f"Restored {restored} files, {failed} failed")
+        return 1 if failed else 0
+    if not args.directory:
+        parser.error("a directory (or --restore) is required")
+
+    plan = plan_deletion(args.directory)
+    print(describe_plan(plan))
+    if not args.dry_run and not args.yes:
+        if input(f"{'Quarantine' if args.quarantine else 'Delete'} {len(plan.files)} files? [y/N] ").strip().lower() != 'y':
+            return 1
+    _, result, _ = delete_docx_files(args.directory, quarantine=args.quarantine, workers=args.workers,
+                                     manifest_path=args.manifest, dry_run=args.dry_run, keep_days=args.keep_days, plan=plan)
+    return 1 if result is not None and result.failed else 0
+
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
     root = tk.Tk()
     root.withdraw()  # Hide the root window
     run_deletion()
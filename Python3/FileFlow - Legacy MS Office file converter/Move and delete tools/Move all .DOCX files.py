@@ -1,22 +1,43 @@
 import os
-import shutil
+import sys
+import logging
+import argparse
 import tkinter as tk
 from tkinter import filedialog, messagebox
 
-def move_docx_files(source_directory, target_directory):
-    moved_files = 0
-    for root, dirs, files in os.walk(source_directory):
-        for file in files:
-            if file.lower().endswith('.docx'):
-                source_file_path = os.path.join(root, file)
-                target_file_path = os.path.join(target_directory, file)
-                try:
-                    shutil.move(source_file_path, target_file_path)
-                    moved_files += 1
-                    print(f"Moved: {source_file_path} to {target_file_path}")
-                except Exception as e:
-                    print(f"Error moving file {source_file_path}: {e}")
-    print(f"Total .docx files moved: {moved_files}")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from move_plan import (plan_moves, execute_moves, write_manifest, default_manifest_path, MoveResult, LAYOUTS, AUTO,
+                       DEFAULT_MOVE_WORKERS)
+
+# Function to print progress on one line, rewritten in place, instead of a line per file
+def print_progress(moved, failed, total, final):
+    print(f"\rMoved {moved} of {total} files, {failed} failed", end='\n' if final else '', flush=True)
+
+# Function to move every .docx file under source_directory into target_directory.
+# The moves are planned first (see move_plan.py): with the auto layout the files go
+# straight into the target directory unless two of them share a name, in which case the
+# subfolders are kept. With dry_run only the manifest of the plan is written. The
+# manifest is written even when the moves are interrupted, listing what was moved.
+# Returns (plan, result or None, manifest path).
+def move_docx_files(source_directory, target_directory, layout=AUTO, workers=DEFAULT_MOVE_WORKERS, manifest_path=None,
+                    dry_run=False, plan=None, on_progress=print_progress):
+    plan = plan or plan_moves(source_directory, target_directory, layout=layout)
+    print(plan.summary())
+    manifest_path = manifest_path or default_manifest_path(plan.target_directory)
+    if dry_run:
+        write_manifest(manifest_path, plan)
+        print(f"Manifest written to {manifest_path}")
+        return plan, None, manifest_path
+    result = MoveResult(len(plan.moves))
+    try:
+        execute_moves(plan, workers=workers, on_progress=on_progress, result=result)
+        print(f"Total .docx files moved: {len(result.moved)} ({result.summary()})")
+    finally:
+        write_manifest(manifest_path, plan, result)
+        if result.interrupted is not None:
+            print(f"Interrupted after {len(result.moved)} of {result.total} files: {result.interrupted}")
+        print(f"Manifest written to {manifest_path}")
+    return plan, result, manifest_path
 
 def browse_directory(prompt):
     directory = filedialog.askdirectory(title=prompt)
@@ -33,15 +54,51 @@ def run_move_operation():
     target_directory = browse_directory("Select Target Directory")
     if not target_directory:
         return
-    
-    if source_directory == target_directory:
+
+    if os.path.normcase(os.path.abspath(source_directory)) == os.path.normcase(os.path.abspath(target_directory)):
         messagebox.showerror("Error", "Source and target directories cannot be the same.")
         return
 
-    move_docx_files(source_directory, target_directory)
-    messagebox.showinfo("Completed", "Move operation completed successfully.")
+    plan = plan_moves(source_directory, target_directory)
+    if not plan.moves:
+        messagebox.showinfo("Nothing to move", f"No .docx files found in {source_directory}.")
+        return
+    layout = ("Some files share a name, so the subfolders are kept in the target directory."
+              if plan.collisions else "The files go straight into the target directory.")
+    if not messagebox.askyesno("Confirm move", f"Move {len(plan.moves)} .docx files?\n\n{layout}"):
+        return
+
+    _, result, manifest_path = move_docx_files(source_directory, target_directory, plan=plan)
+    if result.failed:
+        messagebox.showwarning("Completed with errors", f"{len(result.moved)} files moved, {len(result.failed)} failed.\n\n"
+                                                       f"Details are in {manifest_path}")
+    else:
+        messagebox.showinfo("Completed", f"Move operation completed successfully.\n\n{len(result.moved)} files moved, "
+                                         f"manifest in {manifest_path}")
+
+# Without arguments the directories are chosen in dialogs; with them it runs without a window
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Move all .docx files from a directory tree into a target directory')
+    parser.add_argument('source', help='directory to move the .docx files from, subfolders included')
+    parser.add_argument('target', help='directory to move them to')
+    parser.add_argument('--layout', choices=LAYOUTS, default=AUTO,
+                        help='flat: all in the target directory, preserve: keep the subfolders, '
+                             'auto: flat unless names collide (default)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_MOVE_WORKERS, help='threads moving files')
+    parser.add_argument('--manifest', help='where to write the JSON manifest (default: in the target directory)')
+    parser.add_argument('--dry-run', action='store_true', help='only plan the move and write the manifest')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(message)s')
+    try:
+        _, result, _ = move_docx_files(args.source, args.target, layout=args.layout, workers=args.workers,
+                                       manifest_path=args.manifest, dry_run=args.dry_run)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if result is not None and result.failed else 0
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main())
     root = tk.Tk()
     root.withdraw()  # Hide the root window
     run_move_operation()
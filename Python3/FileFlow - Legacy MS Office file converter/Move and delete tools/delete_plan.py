@@ -0,0 +1,320 @@
+# Deletion planner and executor behind "Delete all .DOCX files.py".
+#
+# plan_deletion() scans the tree (with FileFlow's parallel scanner) and lists every file
+# that would go, with size totals and counts per folder, so the deletion can be reviewed
+# in its manifest before anything is removed. execute_deletion() then deletes the files
+# in batches on a bounded thread pool, or with a quarantine folder moves them there by
+# renaming instead, which restore_quarantine() undoes just as quickly. Quarantine runs
+# older than the undo window are purged by purge_quarantine().
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import logging
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scanner import iter_files, ScanResult, DEFAULT_SCAN_WORKERS
+from move_plan import run_batches, write_json, DEFAULT_MOVE_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Files handed to a thread at a time. The plan is sorted, so a batch is mostly one
+# folder's files, which a file server handles best.
+DELETE_BATCH = 128
+
+# Deletes are single round trips on a network share, so like the scanner we use more
+# threads than cores; each thread has at most two batches queued
+DEFAULT_DELETE_WORKERS = DEFAULT_MOVE_WORKERS
+
+# Quarantine folder created in the directory being cleaned (so it is on the same drive
+# and a rename is enough), with one timestamped folder per run
+QUARANTINE_FOLDER = '.docx-quarantine'
+RUN_FOLDER_FORMAT = '%Y%m%d-%H%M%S'
+QUARANTINE_MANIFEST = 'manifest.json'
+
+# Days a quarantine run can be restored before it is purged
+DEFAULT_UNDO_DAYS = 7
+
+# How often progress is reported, instead of a line per file
+PROGRESS_SECONDS = 1.0
+PROGRESS_LOG_SECONDS = 10
+
+# What to delete: files is a list of (path, size) in path order and directories holds
+# [files, bytes] per folder
+class DeletionPlan:
+    def __init__(self, directory, file_types):
+        self.directory = directory
+        self.file_types = list(file_types)
+        self.files = []
+        self.total_bytes = 0
+        self.directories = {}
+        self.scan = ScanResult()
+
+    # Function to list the (folder, files, bytes) with the most bytes to delete
+    def largest_directories(self, count=10):
+        ranked = sorted(self.directories.items(), key=lambda item: (-item[1][1], item[0]))
+        return [(folder, files, size) for folder, (files, size) in ranked[:count]]
+
+    def summary(self):
+        return (f"{len(self.files)} files to delete, {self.total_bytes / 1024 / 1024:,.1f} MB in "
+                f"{len(self.directories)} folders; {self.scan.files_checked} files in "
+                f"{self.scan.directories_scanned} folders checked")
+
+# Outcome of execute_deletion: removed holds (path, size, quarantined as or None) and
+# failed (path, size, error) for the manifest. interrupted is the error that stopped the
+# run part way, or None.
+class DeletionResult:
+    def __init__(self, total, quarantine_directory=None):
+        self.total = total
+        self.quarantine_directory = quarantine_directory
+        self.removed = []
+        self.failed = []
+        self.interrupted = None
+        self.bytes_removed = 0
+        self.seconds = 0.0
+
+    @property
+    def files_per_second(self):
+        return len(self.removed) / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        action = f"moved to {self.quarantine_directory}" if self.quarantine_directory else "deleted"
+        return (f"{len(self.removed)} of {self.total} files {action} ({self.bytes_removed / 1024 / 1024:,.1f} MB), "
+                f"{len(self.failed)} failed, {self.seconds:.1f}s ({self.files_per_second:,.0f} files/s)")
+
+# Function to give the quarantine folder used for a directory
+def default_quarantine_root(directory):
+    return os.path.join(os.path.abspath(directory), QUARANTINE_FOLDER)
+
+# Function to plan deleting every file of file_types under directory. Nothing is deleted.
+# Files already in the quarantine folder are left out: they are the undo copy of an
+# earlier run, and only go when purged.
+def plan_deletion(directory, file_types=('.docx',), workers=DEFAULT_SCAN_WORKERS, quarantine_root=None):
+    directory = os.path.abspath(directory)
+    plan = DeletionPlan(directory, file_types)
+    skip = os.path.normcase(os.path.join(os.path.abspath(quarantine_root or default_quarantine_root(directory)), ''))
+    files = []
+    for path, stat in iter_files(directory, None, file_types, workers=workers, stats=plan.scan, with_stats=True):
+        if not os.path.normcase(path).startswith(skip):
+            files.append((path, stat.st_size))
+    files.sort()
+    plan.files = files
+    for path, size in files:
+        plan.total_bytes += size
+        totals = plan.directories.setdefault(os.path.dirname(path), [0, 0])
+        totals[0] += 1
+        totals[1] += size
+    logger.info("Deletion plan: %s", plan.summary())
+    return plan
+
+# Function run on a delete thread for a batch of (path, size) pairs. With a quarantine
+# folder each file is renamed to the same relative path under it, otherwise removed.
+# Returns a list of (path, size, quarantined as or None, error).
+def delete_batch(batch, directory, quarantine_directory):
+    outcomes = []
+    # Every planned path starts with the directory, so the relative path is a slice
+    start = len(os.path.join(directory, ''))
+    for path, size in batch:
+        try:
+            if quarantine_directory is None:
+                os.remove(path)
+                outcomes.append((path, size, None, None))
+                continue
+            target = os.path.join(quarantine_directory, path[start:])
+            # os.rename replaces an existing file on POSIX; on Windows it refuses by itself
+            if os.name != 'nt' and os.path.lexists(target):
+                raise FileExistsError(errno.EEXIST, "Already in quarantine", target)
+            os.rename(path, target)
+            outcomes.append((path, size, target, None))
+        except OSError as e:
+            outcomes.append((path, size, None, e))
+    return outcomes
+
+# Function to carry out a DeletionPlan and return a DeletionResult. The files are deleted
+# in batches of DELETE_BATCH on workers threads, with only a couple of batches per thread
+# queued at once. With quarantine_directory (a folder on the same drive, see
+# new_quarantine_run) they are renamed into it instead, keeping their relative paths.
+# on_progress(removed, failed, total, final) is called at most every PROGRESS_SECONDS.
+# Pass in result (a DeletionResult) to keep what was removed when the run is interrupted:
+# the error is recorded in result.interrupted and raised again.
+def execute_deletion(plan, workers=DEFAULT_DELETE_WORKERS, quarantine_directory=None, on_progress=None, result=None):
+    started = time.monotonic()
+    result = result if result is not None else DeletionResult(len(plan.files), quarantine_directory)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    reported = {'callback': 0.0, 'log': started}
+
+    def report(final=False):
+        now = time.monotonic()
+        if on_progress and (final or now - reported['callback'] >= PROGRESS_SECONDS):
+            reported['callback'] = now
+            on_progress(len(result.removed), len(result.failed), result.total, final)
+        if final or now - reported['log'] >= PROGRESS_LOG_SECONDS:
+            reported['log'] = now
+            logger.info("Progress: %d of %d files removed, %d failed", len(result.removed), result.total, len(result.failed))
+
+    def record(outcomes):
+        for path, size, target, error in outcomes:
+            if error is not None:
+                logger.error("Error deleting file %s: %s", path, error)
+                result.failed.append((path, size, str(error)))
+                continue
+            if debug:
+                logger.debug("Deleted %s%s", path, f" (quarantined as {target})" if target else "")
+            result.removed.append((path, size, target))
+            result.bytes_removed += size
+        report()
+
+    try:
+        if quarantine_directory is not None:
+            os.makedirs(quarantine_directory, exist_ok=True)
+            if os.stat(quarantine_directory).st_dev != os.stat(plan.directory).st_dev:
+                raise ValueError(f"The quarantine folder {quarantine_directory} is not on the same drive as {plan.directory}")
+            for folder in sorted(plan.directories):
+                os.makedirs(os.path.join(quarantine_directory, os.path.relpath(folder, plan.directory)), exist_ok=True)
+        logger.info("%s %d files, %d threads", "Quarantining" if quarantine_directory else "Deleting", len(plan.files), workers)
+
+        files = plan.files
+        batches = ((files[i:i + DELETE_BATCH], plan.directory, quarantine_directory)
+                   for i in range(0, len(files), DELETE_BATCH))
+        run_batches(delete_batch, batches, workers, record, 'delete')
+    except BaseException as e:
+        result.interrupted = str(e) or type(e).__name__
+        logger.error("Deletion interrupted after %d of %d files: %s", len(result.removed), result.total, result.interrupted)
+        raise
+    finally:
+        result.seconds = time.monotonic() - started
+        report(final=True)
+    logger.info("Deletion completed: %s", result.summary())
+    return result
+
+# Function to give the folder for a new quarantine run under quarantine_root
+def new_quarantine_run(quarantine_root):
+    return os.path.join(quarantine_root, datetime.now().strftime(RUN_FOLDER_FORMAT))
+
+# Function to give the default manifest path of a deletion: inside the quarantine run,
+# where restore_quarantine looks for it, or a timestamped file in the directory
+def default_manifest_path(directory, quarantine_directory=None):
+    if quarantine_directory is not None:
+        return os.path.join(quarantine_directory, QUARANTINE_MANIFEST)
+    return os.path.join(directory, f"delete-manifest-{datetime.now().strftime(RUN_FOLDER_FORMAT)}.json")
+
+# Function to write the JSON manifest of a plan, with totals per folder for review, and
+# once it ran its DeletionResult: one entry per file with its path, size and status
+# (planned, deleted, quarantined or failed; after an interrupted run, not deleted for the
+# rest of the plan)
+def write_manifest(path, plan, result=None):
+    if result is None:
+        files = [{'path': file_path, 'size': size, 'status': 'planned'} for file_path, size in plan.files]
+    else:
+        files = [{'path': file_path, 'size': size, 'status': 'quarantined', 'quarantined_as': target} if target
+                 else {'path': file_path, 'size': size, 'status': 'deleted'}
+                 for file_path, size, target in result.removed]
+        files += [{'path': file_path, 'size': size, 'status': 'failed', 'error': error}
+                  for file_path, size, error in result.failed]
+        if result.interrupted is not None:
+            # The rest of the plan was never attempted; the files are still in place
+            done = {entry['path'] for entry in files}
+            files += [{'path': file_path, 'size': size, 'status': 'not deleted'}
+                      for file_path, size in plan.files if file_path not in done]
+    manifest = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'directory': plan.directory,
+        'file_types': plan.file_types,
+        'planned': len(plan.files),
+        'total_bytes': plan.total_bytes,
+        'dry_run': result is None,
+        'quarantine_directory': result.quarantine_directory if result is not None else None,
+    }
+    if result is not None:
+        manifest.update({'removed': len(result.removed), 'failed': len(result.failed),
+                         'bytes_removed': result.bytes_removed, 'seconds': round(result.seconds, 3),
+                         'interrupted': result.interrupted})
+    manifest['directories'] = [{'path': folder, 'files': count, 'bytes': size}
+                               for folder, count, size in plan.largest_directories(len(plan.directories))]
+    manifest['files'] = files
+    return write_json(path, manifest)
+
+# Function run on a restore thread for a batch of manifest entries: each quarantined file
+# is renamed back, unless a file has appeared at its old path since.
+# Returns a list of (entry, error or None).
+def restore_batch(entries):
+    outcomes = []
+    for entry in entries:
+        try:
+            if os.name != 'nt' and os.path.lexists(entry['path']):
+                raise FileExistsError(errno.EEXIST, "A file with this name exists again", entry['path'])
+            os.rename(entry['quarantined_as'], entry['path'])
+            outcomes.append((entry, None))
+        except OSError as e:
+            outcomes.append((entry, e))
+    return outcomes
+
+# Function to undo a quarantine run: every file in its manifest is renamed back to where
+# it was, in batches on a pool of workers threads. Folders deleted since are created again
+# first. The manifest is updated (restored entries get the status restored) and the
+# emptied folders of the run are removed.
+# Returns (files restored, files that could not be).
+def restore_quarantine(quarantine_directory, workers=DEFAULT_DELETE_WORKERS):
+    manifest_path = os.path.join(quarantine_directory, QUARANTINE_MANIFEST)
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    entries = [entry for entry in manifest['files'] if entry['status'] == 'quarantined']
+    counts = {'restored': 0, 'failed': 0}
+    for folder in sorted({os.path.dirname(entry['path']) for entry in entries}):
+        try:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as e:
+            logger.error("Unable to create folder %s: %s", folder, e)
+
+    def record(outcomes):
+        for entry, error in outcomes:
+            if error is None:
+                entry['status'] = 'restored'
+                counts['restored'] += 1
+            else:
+                logger.error("Unable to restore %s: %s", entry['path'], error)
+                entry['restore_error'] = str(error)
+                counts['failed'] += 1
+
+    batches = ((entries[i:i + DELETE_BATCH],) for i in range(0, len(entries), DELETE_BATCH))
+    run_batches(restore_batch, batches, workers, record, 'restore')
+    manifest['restored'] = datetime.now().isoformat(timespec='seconds')
+    write_json(manifest_path, manifest)
+
+    # Empty folders left behind, deepest first; the manifest keeps the run folder itself
+    for folder, _, _ in sorted(os.walk(quarantine_directory), key=lambda item: -len(item[0])):
+        if folder != quarantine_directory:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                pass
+    logger.info("Restored %d files from %s, %d failed", counts['restored'], quarantine_directory, counts['failed'])
+    return counts['restored'], counts['failed']
+
+# Function to delete the quarantine runs under quarantine_root older than keep_days,
+# ending their undo window. Returns the folders removed.
+def purge_quarantine(quarantine_root, keep_days=DEFAULT_UNDO_DAYS):
+    cutoff = datetime.now() - timedelta(days=keep_days)
+    purged = []
+    try:
+        names = sorted(os.listdir(quarantine_root))
+    except FileNotFoundError:
+        return purged
+    for name in names:
+        try:
+            created = datetime.strptime(name, RUN_FOLDER_FORMAT)
+        except ValueError:
+            continue
+        if created < cutoff:
+            folder = os.path.join(quarantine_root, name)
+            try:
+                shutil.rmtree(folder)
+            except OSError as e:
+                logger.error("Unable to purge %s: %s", folder, e)
+                continue
+            logger.info("Purged quarantine run %s", folder)
+            purged.append(folder)
+    return purged
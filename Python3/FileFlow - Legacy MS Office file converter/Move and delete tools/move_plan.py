@@ -0,0 +1,360 @@
+# Move planner and executor behind "Move all .DOCX files.py".
+#
+# A move runs in two steps. plan_moves() scans the source tree (with FileFlow's parallel
+# scanner), works out every file's destination and settles name collisions before
+# anything is touched. execute_moves() then carries the plan out: a rename where source
+# and target are on the same device, otherwise a copy, fsync and delete, in a thread pool
+# either way. Everything that moved (or failed) is written to a JSON manifest.
+import os
+import sys
+import json
+import time
+import errno
+import shutil
+import logging
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scanner import iter_files, ScanResult, DEFAULT_SCAN_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Where files go in the target directory:
+#   flat     - straight into the target directory, like the original script; a name that
+#              is already taken gets a number, "report (2).docx"
+#   preserve - into the same subfolders as in the source directory
+#   auto     - flat when no two files (or a file already in the target) share a name,
+#              preserve otherwise
+FLAT = 'flat'
+PRESERVE = 'preserve'
+AUTO = 'auto'
+LAYOUTS = (AUTO, FLAT, PRESERVE)
+
+# How a file was moved
+RENAME = 'rename'
+COPY = 'copy'
+
+# Renames and copies are I/O bound (round trips on a network share), so like the scanner
+# we use more threads than cores
+DEFAULT_MOVE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Files handed to a thread at a time. A rename is a single call, so many go together to
+# keep the pool's overhead down; copies take longer and are spread more thinly.
+RENAME_BATCH = 256
+COPY_BATCH = 4
+
+COPY_BUFFER_BYTES = 1024 * 1024
+
+# How often progress is reported, instead of a line per file
+PROGRESS_SECONDS = 1.0
+PROGRESS_LOG_SECONDS = 10
+
+# What to move where: moves is a list of (source, target) pairs in source order and
+# folders the target folders they need. collisions counts the files whose name clashes
+# when flattened into the target directory, renamed the files given a numbered name in
+# the layout used.
+class MovePlan:
+    def __init__(self, source_directory, target_directory, layout, file_types):
+        self.source_directory = source_directory
+        self.target_directory = target_directory
+        self.layout = layout
+        self.file_types = list(file_types)
+        self.moves = []
+        self.folders = set()
+        self.collisions = 0
+        self.renamed = 0
+        self.scan = ScanResult()
+
+    def summary(self):
+        return (f"{len(self.moves)} files to move ({self.layout} layout), {self.collisions} name collisions, "
+                f"{self.renamed} renamed; {self.scan.files_checked} files in {self.scan.directories_scanned} folders checked")
+
+# Outcome of execute_moves: moved holds (source, target, method) and failed
+# (source, target, error) for the manifest. renamed and copied count the files moved by
+# each method. interrupted is the error that stopped the run part way, or None.
+class MoveResult:
+    def __init__(self, total):
+        self.total = total
+        self.moved = []
+        self.failed = []
+        self.interrupted = None
+        self.renamed = 0
+        self.copied = 0
+        self.bytes_copied = 0
+        self.seconds = 0.0
+
+    @property
+    def files_per_second(self):
+        return len(self.moved) / self.seconds if self.seconds > 0 else 0.0
+
+    def summary(self):
+        return (f"{len(self.moved)} of {self.total} files moved ({self.renamed} by rename, {self.copied} copied "
+                f"across devices, {self.bytes_copied / 1024 / 1024:,.1f} MB), {len(self.failed)} failed, "
+                f"{self.seconds:.1f}s ({self.files_per_second:,.0f} files/s)")
+
+# Function to give a name that is free in a folder, whose names (casefolded, as Windows
+# and macOS ignore case) are in taken: "report.docx", then "report (2).docx" and so on
+def unique_name(name, taken):
+    if name.casefold() not in taken:
+        return name
+    stem, ext = os.path.splitext(name)
+    number = 2
+    while f"{stem} ({number}){ext}".casefold() in taken:
+        number += 1
+    return f"{stem} ({number}){ext}"
+
+# Function to work out the destination of every file for one layout. Files already in the
+# target folders count as taken, each folder is listed once.
+# Returns (moves, target folders, renamed).
+def destinations(files, source_directory, target_directory, layout):
+    taken = {}
+    moves = []
+    renamed = 0
+    for source in files:
+        if layout == FLAT:
+            folder = target_directory
+        else:
+            folder = os.path.join(target_directory, os.path.relpath(os.path.dirname(source), source_directory))
+            folder = os.path.normpath(folder)
+        names = taken.get(folder)
+        if names is None:
+            try:
+                names = {name.casefold() for name in os.listdir(folder)}
+            except OSError:
+                names = set()
+            taken[folder] = names
+        name = os.path.basename(source)
+        free = unique_name(name, names)
+        if free != name:
+            renamed += 1
+        names.add(free.casefold())
+        moves.append((source, os.path.join(folder, free)))
+    return moves, set(taken), renamed
+
+# Function to plan moving every file of file_types under source_directory into
+# target_directory. Nothing is moved. A target directory inside the source directory is
+# left out of the scan, so files already moved there are not moved again.
+def plan_moves(source_directory, target_directory, file_types=('.docx',), layout=AUTO, workers=DEFAULT_SCAN_WORKERS):
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout {layout!r}, expected one of {', '.join(LAYOUTS)}")
+    source_directory = os.path.abspath(source_directory)
+    target_directory = os.path.abspath(target_directory)
+    if os.path.normcase(source_directory) == os.path.normcase(target_directory):
+        raise ValueError("Source and target directories cannot be the same.")
+
+    plan = MovePlan(source_directory, target_directory, layout, file_types)
+    inside_target = os.path.normcase(os.path.join(target_directory, ''))
+    # Sorted, so the plan (and which of two clashing files keeps its name) is repeatable
+    files = sorted(path for path in iter_files(source_directory, None, file_types, workers=workers, stats=plan.scan)
+                   if not os.path.normcase(path).startswith(inside_target))
+
+    if layout != PRESERVE:
+        plan.moves, plan.folders, plan.collisions = destinations(files, source_directory, target_directory, FLAT)
+        plan.renamed = plan.collisions
+        plan.layout = FLAT
+    if layout == PRESERVE or (layout == AUTO and plan.collisions):
+        plan.moves, plan.folders, plan.renamed = destinations(files, source_directory, target_directory, PRESERVE)
+        plan.layout = PRESERVE
+    logger.info("Move plan: %s", plan.summary())
+    return plan
+
+# Function to copy a file to a target that must not exist yet, flush it to disk and only
+# then delete the source, so a crash or full disk leaves the original in place. The copy
+# keeps the modified date, like shutil.move. Returns the bytes copied.
+def copy_and_remove(source, target):
+    created = False
+    try:
+        with open(source, 'rb') as source_file, open(target, 'xb') as target_file:
+            created = True
+            shutil.copyfileobj(source_file, target_file, COPY_BUFFER_BYTES)
+            target_file.flush()
+            os.fsync(target_file.fileno())
+            size = target_file.tell()
+        shutil.copystat(source, target)
+    except BaseException:
+        # Only a partial copy of our own is removed, never a file that was already there
+        if created:
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+        raise
+    os.remove(source)
+    return size
+
+# Function to move one file by renaming it. os.rename replaces an existing file on POSIX,
+# so there the target is checked first (the plan already avoided taken names, this
+# catches files that appeared since); on Windows the rename itself refuses, which saves a
+# round trip per file on a share. Falls back to a copy when the rename crosses devices
+# after all, e.g. for a drive mounted inside the source tree. Returns (method, bytes copied).
+def rename_or_copy(source, target):
+    if os.name != 'nt' and os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "Target already exists", target)
+    try:
+        os.rename(source, target)
+        return RENAME, 0
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    return COPY, copy_and_remove(source, target)
+
+# Function run on a move thread for a batch of (source, target) pairs.
+# Returns a list of (source, target, method, bytes copied, error).
+def move_batch(batch, rename):
+    outcomes = []
+    for source, target in batch:
+        try:
+            if rename:
+                method, copied = rename_or_copy(source, target)
+            else:
+                method, copied = COPY, copy_and_remove(source, target)
+            outcomes.append((source, target, method, copied, None))
+        except OSError as e:
+            outcomes.append((source, target, None, 0, e))
+    return outcomes
+
+# Function to run function(*arguments) for each arguments tuple in batches on workers
+# threads, passing what each returns to record() on the calling thread, in order. Only a
+# couple of batches per thread are queued at a time, so a slow share is never flooded with
+# requests and the results do not pile up. If the run is interrupted (Ctrl+C, an
+# unexpected error), batches not started are cancelled and those that finished are still
+# recorded before the error is raised, so the caller knows every file that was touched.
+# A batch stays in in_flight until its outcomes are in hand, so one interrupted while the
+# caller waits for it is recorded too.
+def run_batches(function, batches, workers, record, name='batch'):
+    workers = max(1, workers)
+    batches = iter(batches)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) as pool:
+        in_flight = deque()
+
+        def record_next():
+            outcomes = in_flight[0].result()
+            in_flight.popleft()
+            record(outcomes)
+
+        try:
+            for arguments in batches:
+                in_flight.append(pool.submit(function, *arguments))
+                if len(in_flight) >= workers * 2:
+                    record_next()
+            while in_flight:
+                record_next()
+        except BaseException:
+            pool.shutdown(wait=True, cancel_futures=True)
+            for future in in_flight:
+                if not future.cancelled() and future.exception() is None:
+                    record(future.result())
+            raise
+
+# Function to carry out a MovePlan and return a MoveResult. Target folders are created up
+# front, then the files are moved in batches on workers threads: renamed when the source
+# and target directories are on the same device, otherwise copied, fsynced and deleted.
+# Per-file outcomes go to the result and the debug log; on_progress(moved, failed, total,
+# final) is called at most every PROGRESS_SECONDS and progress is logged every
+# PROGRESS_LOG_SECONDS. Pass in result (a MoveResult) to keep what was moved when the run
+# is interrupted: the error is recorded in result.interrupted and raised again.
+def execute_moves(plan, workers=DEFAULT_MOVE_WORKERS, on_progress=None, result=None):
+    started = time.monotonic()
+    result = result if result is not None else MoveResult(len(plan.moves))
+    debug = logger.isEnabledFor(logging.DEBUG)
+    reported = {'callback': 0.0, 'log': started}
+
+    def report(final=False):
+        now = time.monotonic()
+        if on_progress and (final or now - reported['callback'] >= PROGRESS_SECONDS):
+            reported['callback'] = now
+            on_progress(len(result.moved), len(result.failed), result.total, final)
+        if final or now - reported['log'] >= PROGRESS_LOG_SECONDS:
+            reported['log'] = now
+            logger.info("Progress: %d of %d files moved, %d failed", len(result.moved), result.total, len(result.failed))
+
+    def record(outcomes):
+        for source, target, method, copied, error in outcomes:
+            if error is not None:
+                logger.error("Error moving file %s: %s", source, error)
+                result.failed.append((source, target, str(error)))
+                continue
+            if debug:
+                logger.debug("Moved %s to %s (%s)", source, target, method)
+            result.moved.append((source, target, method))
+            if method == RENAME:
+                result.renamed += 1
+            else:
+                result.copied += 1
+                result.bytes_copied += copied
+        report()
+
+    try:
+        for folder in sorted(plan.folders | {plan.target_directory}):
+            try:
+                os.makedirs(folder, exist_ok=True)
+            except OSError as e:
+                logger.error("Unable to create folder %s: %s", folder, e)
+        # One check for the whole tree; a rename that crosses devices below it falls back to a copy
+        same_device = os.stat(plan.source_directory).st_dev == os.stat(plan.target_directory).st_dev
+        batch_size = RENAME_BATCH if same_device else COPY_BATCH
+        logger.info("Moving %d files %s, %d threads", len(plan.moves),
+                    "by rename" if same_device else "by copy across devices", workers)
+
+        moves = plan.moves
+        batches = ((moves[i:i + batch_size], same_device) for i in range(0, len(moves), batch_size))
+        run_batches(move_batch, batches, workers, record, 'move')
+    except BaseException as e:
+        result.interrupted = str(e) or type(e).__name__
+        logger.error("Move interrupted after %d of %d files: %s", len(result.moved), result.total, result.interrupted)
+        raise
+    finally:
+        result.seconds = time.monotonic() - started
+        report(final=True)
+    logger.info("Move completed: %s", result.summary())
+    return result
+
+# Function to give the default manifest path, a timestamped file in the target directory
+def default_manifest_path(target_directory):
+    return os.path.join(target_directory, f"move-manifest-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+
+# Function to write the JSON manifest of a plan and, once it ran, its MoveResult: one
+# entry per file with its source, target and status (planned, moved or failed; after an
+# interrupted run, not moved for the rest of the plan)
+def write_manifest(path, plan, result=None):
+    if result is None:
+        files = [{'source': source, 'target': target, 'status': 'planned'} for source, target in plan.moves]
+    else:
+        files = [{'source': source, 'target': target, 'status': 'moved', 'method': method}
+                 for source, target, method in result.moved]
+        files += [{'source': source, 'target': target, 'status': 'failed', 'error': error}
+                  for source, target, error in result.failed]
+        if result.interrupted is not None:
+            # The rest of the plan was never attempted; the files are still at the source
+            done = {entry['source'] for entry in files}
+            files += [{'source': source, 'target': target, 'status': 'not moved'}
+                      for source, target in plan.moves if source not in done]
+    manifest = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'source_directory': plan.source_directory,
+        'target_directory': plan.target_directory,
+        'file_types': plan.file_types,
+        'layout': plan.layout,
+        'planned': len(plan.moves),
+        'collisions': plan.collisions,
+        'renamed': plan.renamed,
+        'dry_run': result is None,
+    }
+    if result is not None:
+        manifest.update({'moved': len(result.moved), 'failed': len(result.failed),
+                         'bytes_copied': result.bytes_copied, 'seconds': round(result.seconds, 3),
+                         'interrupted': result.interrupted})
+    manifest['files'] = files
+    return write_json(path, manifest)
+
+# Function to write a manifest to a temporary file and rename it into place, so it is
+# never left half written
+def write_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1, ensure_ascii=False)
+    os.replace(temporary, path)
+    return path
@@ -0,0 +1,89 @@
+# Benchmark for the conversion worker pool.
+#
+# Creates a folder of dummy .doc/.xls files and converts them with the fake backend
+# (a byte copy with a simulated Office latency) at each worker count, printing files/sec.
+# The old serial loop is shown for comparison: one conversion followed by a fixed
+# time.sleep(delay) per file.
+#
+# Usage:
+#   python bench_convert.py
+#   python bench_convert.py --files 500 --latency 0.2 --workers 1 2 4 8 16
+#   python bench_convert.py --failure-rate 0.05      # exercise backoff and restarts
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from converters import FakeBackend, backend_factory, target_path_for
+from scheduler import ConversionPool
+
+# Function to create the dummy legacy files
+def build_files(directory, count, size):
+    payload = os.urandom(size)
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'file{i}{".doc" if i % 2 else ".xls"}')
+        with open(path, 'wb') as f:
+            f.write(payload)
+        paths.append(path)
+    return paths
+
+# Function to remove outputs between runs so every run does the same work
+def clear_outputs(paths):
+    for path in paths:
+        try:
+            os.remove(target_path_for(path))
+        except FileNotFoundError:
+            pass
+
+# The previous convert_files loop: one file at a time with a fixed sleep after each
+def legacy_convert(paths, latency, delay):
+    backend = FakeBackend(latency=latency, seed=1)
+    start = time.perf_counter()
+    for path in paths:
+        try:
+            backend.convert(path, target_path_for(path))
+        except Exception:
+            pass
+        time.sleep(delay)
+    return len(paths) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileFlow conversion throughput by worker count')
+    parser.add_argument('--files', type=int, default=200, help='number of files to convert')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='bytes per file')
+    parser.add_argument('--latency', type=float, default=0.1, help='simulated seconds per conversion')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of conversions that fail')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--delay', type=float, default=0.5, help='fixed delay of the legacy loop (0 to skip it)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='fileflow-convert-bench-')
+    try:
+        paths = build_files(directory, args.files, args.size)
+
+        if args.delay:
+            rate = legacy_convert(paths[:min(len(paths), 20)], args.latency, args.delay)
+            print(f"serial + {args.delay}s sleep : {rate:8.2f} files/s")
+            clear_outputs(paths)
+
+        baseline = None
+        for workers in args.workers:
+            factory = backend_factory('fake', latency=args.latency, failure_rate=args.failure_rate)
+            pool = ConversionPool(factory, workers=workers, backoff=0.01, max_backoff=0.1)
+            with pool:
+                for path in paths:
+                    pool.submit(path, target_path_for(path))
+            rate = pool.files_per_second()
+            baseline = baseline or rate
+            print(f"{workers:3d} workers           : {rate:8.2f} files/s  ({rate / baseline:4.1f}x)  "
+                  f"converted {pool.converted}, failed {pool.failed}")
+            clear_outputs(paths)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# Benchmark for converting shares full of identical files, with and without deduplication.
+#
+# Builds a folder of dummy .doc/.xls files in which a given fraction are byte-identical
+# copies of a few templates, then runs engine.convert_files with the fake backend (a byte
+# copy with its default simulated Office latency of 50ms) with dedup off, with dedup on
+# and an empty cache, and again on a second folder of the same templates, which the cache
+# of the first run should serve. Prints the time, files/sec and how many conversions the backend did.
+# Output verification is off: the fake backend's byte copies are not real .docx/.xlsx files.
+#
+# Usage:
+#   python bench_dedup.py
+#   python bench_dedup.py --files 2000 --duplicates 0 0.5 0.9 --workers 4
+import os
+import sys
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import engine
+
+# Function to create count dummy files, a duplicates fraction of them copies of
+# templates distinct templates (the same ones for every seed) and the rest unique
+def build_files(directory, count, size, duplicates, templates, seed):
+    template_data = [random.Random(-t).randbytes(size) for t in range(templates)]
+    generator = random.Random(seed)
+    for i in range(count):
+        folder = os.path.join(directory, f'd{i // 100}')
+        if i % 100 == 0:
+            os.makedirs(folder, exist_ok=True)
+        if generator.random() < duplicates:
+            data = template_data[generator.randrange(templates)]
+        else:
+            data = generator.randbytes(size + generator.randrange(size))
+        with open(os.path.join(folder, f'file{i}{".doc" if i % 2 else ".xls"}'), 'wb') as f:
+            f.write(data)
+
+# Function to remove outputs between runs so every run does the same work
+def clear_outputs(directory):
+    for folder, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if file_name.endswith(('.docx', '.xlsx')):
+                os.remove(os.path.join(folder, file_name))
+
+# Function to run one conversion; returns (seconds, summary)
+def run(directory, workers, dedup, cache_path, journal_path):
+    start = time.perf_counter()
+    summary = engine.convert_files(directory, datetime(1990, 1, 1), workers=workers, backend='fake', journal_path=journal_path,
+                                   sniff=False, dedup=dedup, dedup_cache_path=cache_path, verify=False)
+    return time.perf_counter() - start, summary
+
+def report(label, seconds, summary):
+    files = summary['converted'] + summary['deduplicated']
+    print(f"  {label:24s}: {seconds:7.2f}s  {files / seconds:8.1f} files/s  {summary['converted']:6d} conversions  "
+          f"{summary['deduplicated']:6d} copies ({summary['reused_from_earlier_runs']} from the cache)  {summary['failed']} failed")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileFlow conversion of duplicate files with and without dedup')
+    parser.add_argument('--files', type=int, default=1000, help='number of files per folder')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='bytes per file')
+    parser.add_argument('--duplicates', type=float, nargs='+', default=[0.0, 0.5, 0.9],
+                        help='fractions of the files that are copies of a template')
+    parser.add_argument('--templates', type=int, default=20, help='number of distinct templates')
+    parser.add_argument('--workers', type=int, default=4, help='conversion workers')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    for duplicates in args.duplicates:
+        root = tempfile.mkdtemp(prefix='fileflow-dedup-bench-')
+        try:
+            first, second = os.path.join(root, 'first'), os.path.join(root, 'second')
+            build_files(first, args.files, args.size, duplicates, args.templates, seed=1)
+            build_files(second, args.files, args.size, duplicates, args.templates, seed=2)
+            cache_path = os.path.join(root, 'cache.sqlite3')
+            print(f"{args.files} files, {duplicates:.0%} copies of {args.templates} templates, {args.workers} workers:")
+            report('dedup off', *run(first, args.workers, False, None, None))
+            clear_outputs(first)
+            report('dedup on, empty cache', *run(first, args.workers, True, cache_path, None))
+            report('dedup on, second folder', *run(second, args.workers, True, cache_path, None))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+# Benchmark for the bulk .docx deletion in "Move and delete tools" against the original loop.
+#
+# Builds a synthetic tree (200,000 files by default, a quarter of them .docx), then times:
+#   - the original os.walk + os.remove loop from "Delete all .DOCX files.py"
+#   - planning the deletion (scan, sizes, per-folder totals and the review manifest)
+#   - delete_plan.execute_deletion with each requested thread count
+#   - moving the files to quarantine and restoring them again
+# and checks every run removed exactly the .docx files. The .docx files are written again
+# before each run. --latency adds a delay to every delete and rename, a stand-in for the
+# round trip to a network share (where the threads pay off); 0.001 is a fast LAN share.
+#
+# Usage:
+#   python bench_delete.py                                  # 200,000 files in a temp directory
+#   python bench_delete.py --files 50000 --latency 0.001 --workers 1 8 32
+#   python bench_delete.py --tree \\server\share\bench --keep
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Move and delete tools'))
+from delete_plan import (plan_deletion, execute_deletion, write_manifest, restore_quarantine, default_quarantine_root,
+                         new_quarantine_run, QUARANTINE_MANIFEST)
+
+EXTENSIONS = ['.docx', '.doc', '.xlsx', '.pdf']
+
+# Function to build the synthetic tree: folders of files_per_dir files, every fourth a
+# .docx of docx_bytes. Returns the .docx paths.
+def build_tree(root, total_files, files_per_dir, docx_bytes):
+    docx_files = []
+    for i in range(total_files):
+        directory = os.path.join(root, f'd{i // (files_per_dir * 20)}', f'leaf{i // files_per_dir}')
+        if i % files_per_dir == 0:
+            os.makedirs(directory, exist_ok=True)
+        ext = EXTENSIONS[i % len(EXTENSIONS)]
+        path = os.path.join(directory, f'file{i}{ext}')
+        if ext == '.docx':
+            docx_files.append(path)
+        else:
+            with open(path, 'wb'):
+                pass
+    write_docx(docx_files, docx_bytes)
+    return docx_files
+
+def write_docx(docx_files, docx_bytes):
+    content = b'x' * docx_bytes
+    for path in docx_files:
+        with open(path, 'wb') as f:
+            f.write(content)
+
+# Function to add latency seconds to os.remove and os.rename, for every caller
+def add_latency(latency):
+    if not latency:
+        return
+    remove, rename = os.remove, os.rename
+
+    def slow_remove(path, *args, **kwargs):
+        time.sleep(latency)
+        return remove(path, *args, **kwargs)
+
+    def slow_rename(source, target, *args, **kwargs):
+        time.sleep(latency)
+        return rename(source, target, *args, **kwargs)
+
+    os.remove = slow_remove
+    os.rename = slow_rename
+
+# The deletion loop as it was in "Delete all .DOCX files.py", minus the print per file
+def legacy_delete(directory):
+    deleted_files = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            if file.lower().endswith('.docx'):
+                file_path = os.path.join(root, file)
+                try:
+                    os.remove(file_path)
+                    deleted_files += 1
+                except Exception as e:
+                    print(f"Error deleting file {file_path}: {e}")
+    return deleted_files
+
+# Function to check that none of the .docx files is left
+def all_gone(docx_files):
+    return not any(os.path.exists(path) for path in docx_files)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bulk .docx deletion on a synthetic tree')
+    parser.add_argument('--files', type=int, default=200_000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=200, help='files per leaf directory')
+    parser.add_argument('--docx-kb', type=int, default=4, help='size of each .docx file in KB')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to each delete and rename')
+    parser.add_argument('--tree', help='directory for the synthetic tree (default: temp dir)')
+    parser.add_argument('--keep', action='store_true', help='do not delete the tree afterwards')
+    parser.add_argument('--skip-legacy', action='store_true', help='skip timing the original loop')
+    args = parser.parse_args()
+
+    root = args.tree or tempfile.mkdtemp(prefix='fileflow-delete-bench-')
+    os.makedirs(root, exist_ok=True)
+    docx_bytes = args.docx_kb * 1024
+    try:
+        print(f"Building {args.files:,} files under {root} ...")
+        start = time.perf_counter()
+        docx_files = build_tree(root, args.files, args.per_dir, docx_bytes)
+        print(f"  built in {time.perf_counter() - start:.1f}s, {len(docx_files):,} .docx files")
+        add_latency(args.latency)
+        if args.latency:
+            print(f"  {args.latency * 1000:.1f} ms added to every delete and rename")
+
+        if not args.skip_legacy:
+            start = time.perf_counter()
+            deleted = legacy_delete(root)
+            elapsed = time.perf_counter() - start
+            print(f"original loop     : {elapsed:8.2f}s  {deleted / elapsed:10,.0f} files/s  "
+                  f"{'all deleted' if all_gone(docx_files) else 'FILES LEFT'}")
+            write_docx(docx_files, docx_bytes)
+
+        start = time.perf_counter()
+        plan = plan_deletion(root)
+        write_manifest(os.path.join(tempfile.gettempdir(), 'bench-delete-manifest.json'), plan)
+        elapsed = time.perf_counter() - start
+        print(f"plan + manifest   : {elapsed:8.2f}s  {plan.summary()}")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            result = execute_deletion(plan, workers=workers)
+            elapsed = time.perf_counter() - start
+            print(f"delete {workers:2d} threads : {elapsed:8.2f}s  {len(result.removed) / elapsed:10,.0f} files/s  "
+                  f"{len(result.failed)} failed  {'all deleted' if all_gone(docx_files) else 'FILES LEFT'}")
+            write_docx(docx_files, docx_bytes)
+
+        workers = max(args.workers)
+        quarantine_directory = new_quarantine_run(default_quarantine_root(root))
+        start = time.perf_counter()
+        result = execute_deletion(plan, workers=workers, quarantine_directory=quarantine_directory)
+        write_manifest(os.path.join(quarantine_directory, QUARANTINE_MANIFEST), plan, result)
+        elapsed = time.perf_counter() - start
+        print(f"quarantine {workers:2d}    : {elapsed:8.2f}s  {len(result.removed) / elapsed:10,.0f} files/s  "
+              f"{len(result.failed)} failed  {'all moved' if all_gone(docx_files) else 'FILES LEFT'}")
+        start = time.perf_counter()
+        restored, failed = restore_quarantine(quarantine_directory, workers=workers)
+        elapsed = time.perf_counter() - start
+        back = all(os.path.exists(path) for path in docx_files)
+        print(f"restore {workers:2d}       : {elapsed:8.2f}s  {restored / elapsed:10,.0f} files/s  "
+              f"{failed} failed  {'all restored' if back else 'FILES MISSING'}")
+    finally:
+        if not args.keep and not args.tree:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# Benchmark for the GUI log window during a scan.
+#
+# Runs engine.detect_files over a synthetic tree on a background thread while a Tk window
+# shows the log, once per mode:
+#   - off    : no log window handler (baseline scan time)
+#   - legacy : the previous TextHandler, one root.after(0, ...) per log record
+#   - sink   : log_sink.TextWidgetSink, batched on a timer with a ring of the last lines
+# A heartbeat callback is scheduled on the Tk main loop every 20ms; how late it fires
+# shows how responsive the window stayed. Also printed: how long the window needed to
+# catch up with the log after the scan finished, and how many lines it ended up holding.
+# Needs a display (on Linux run it under xvfb-run).
+#
+# Usage:
+#   python bench_gui_log.py
+#   python bench_gui_log.py --files 500000 --level DEBUG --modes legacy sink
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+import tkinter as tk
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from engine import detect_files
+from log_sink import TextWidgetSink
+from bench_scan import build_tree
+
+HEARTBEAT_MS = 20
+
+# The log window handler as it was in FileFlow.py before the sink
+class LegacyTextHandler(logging.Handler):
+    def __init__(self, text_widget, root):
+        super().__init__()
+        self.text_widget = text_widget
+        self.root = root
+
+    def emit(self, record):
+        msg = self.format(record)
+        level = record.levelname
+
+        def append_text():
+            self.text_widget.configure(state='normal')
+            self.text_widget.insert('end', msg + '\n\n', level)
+            self.text_widget.configure(state='disabled')
+            self.text_widget.yview('end')
+        self.root.after(0, append_text)
+
+# Function to time one scan with the given log window mode.
+# Returns (scan seconds, catch-up seconds, heartbeat delays in ms, lines in the widget).
+def run_mode(mode, tree, level, max_lines):
+    root = tk.Tk()
+    root.geometry("1024x600")
+    text = tk.Text(root, state='disabled')
+    text.pack(fill='both', expand=True)
+
+    logger = logging.getLogger()
+    logger.handlers.clear()
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.NullHandler())
+    handler = None
+    if mode == 'legacy':
+        handler = LegacyTextHandler(text, root)
+        handler.setLevel(level)
+    elif mode == 'sink':
+        handler = TextWidgetSink(text, root, max_lines=max_lines, level=level)
+        handler.start()
+    if handler:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+
+    delays = []
+    timings = {}
+    expected = [time.perf_counter() + HEARTBEAT_MS / 1000]
+
+    def heartbeat():
+        now = time.perf_counter()
+        delays.append(max(0.0, (now - expected[0]) * 1000))
+        expected[0] = now + HEARTBEAT_MS / 1000
+        root.after(HEARTBEAT_MS, heartbeat)
+
+    def scan():
+        start = time.perf_counter()
+        detect_files(tree, datetime.now() - timedelta(days=60), ['.xls', '.doc'], sniff=False)
+        timings['scan'] = time.perf_counter() - start
+        timings['scan_done'] = time.perf_counter()
+
+    # The window has caught up once the scan is done and a callback queued behind the
+    # pending log updates (or the sink's next tick) has run
+    def wait_for_scan():
+        if 'scan_done' not in timings:
+            root.after(50, wait_for_scan)
+            return
+        if mode == 'sink':
+            root.after(handler.interval_ms * 2, finish)
+        else:
+            root.after(0, finish)
+
+    def finish():
+        timings['catch_up'] = time.perf_counter() - timings['scan_done']
+        root.quit()
+
+    root.after(HEARTBEAT_MS, heartbeat)
+    root.after(50, wait_for_scan)
+    threading.Thread(target=scan, daemon=True).start()
+    root.mainloop()
+
+    lines = int(text.index('end-1c').split('.')[0])
+    if handler:
+        logger.removeHandler(handler)
+        if mode == 'sink':
+            handler.stop()
+    root.destroy()
+    return timings['scan'], timings['catch_up'], delays, lines
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the FileFlow log window during a scan')
+    parser.add_argument('--files', type=int, default=200_000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=200, help='files per leaf directory')
+    parser.add_argument('--level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING'], help='log window level')
+    parser.add_argument('--max-lines', type=int, default=5000, help='entries kept by the sink')
+    parser.add_argument('--modes', nargs='+', default=['off', 'legacy', 'sink'], choices=['off', 'legacy', 'sink'])
+    parser.add_argument('--tree', help='directory for the synthetic tree (default: temp dir)')
+    args = parser.parse_args()
+
+    tree = args.tree or tempfile.mkdtemp(prefix='fileflow-bench-')
+    try:
+        if not os.path.isdir(tree) or not os.listdir(tree):
+            print(f"Building {args.files:,} files under {tree} ...")
+            build_tree(tree, args.files, args.per_dir, 10)
+
+        print(f"Window log level {args.level}, heartbeat every {HEARTBEAT_MS}ms")
+        for mode in args.modes:
+            scan_seconds, catch_up, delays, lines = run_mode(mode, tree, args.level, args.max_lines)
+            print(f"{mode:7s}: scan {scan_seconds:7.2f}s  catch-up {catch_up:7.2f}s  "
+                  f"heartbeat delay p50 {percentile(delays, 0.5):7.1f}ms  p99 {percentile(delays, 0.99):8.1f}ms  "
+                  f"max {max(delays, default=0):8.1f}ms  {lines:,} lines in window")
+    finally:
+        if not args.tree:
+            shutil.rmtree(tree, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Benchmark for scan throughput under each logging setup and log level.
+#
+# Runs engine.detect_files over a synthetic tree with:
+#   - off   : no handlers, root logger at WARNING (the cost of the scan itself)
+#   - sync  : the previous setup, colorlog console and a text FileHandler on the root
+#             logger, formatted and written on the scanning threads
+#   - queue : engine.configure_logging, a QueueHandler feeding a listener thread that
+#             writes the rotating JSON-lines file
+# at each requested level (console and file at the same level). The console goes to
+# os.devnull so the terminal's speed does not skew the numbers. "scan" is the time until
+# detect_files returned, "total" also includes writing out the records still queued.
+#
+# Usage:
+#   python bench_logging.py
+#   python bench_logging.py --files 1000000 --levels DEBUG INFO --modes sync queue
+import os
+import sys
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import colorlog
+import engine
+from bench_scan import build_tree
+
+# The previous engine.configure_logging: every handler on the root logger, synchronous
+def configure_sync_logging(log_file_name, level, console_stream):
+    logger = logging.getLogger()
+    logger.handlers.clear()
+    logger.setLevel(logging.DEBUG)
+
+    console_handler = logging.StreamHandler(console_stream)
+    console_handler.setFormatter(colorlog.ColoredFormatter(
+        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    console_handler.setLevel(level)
+    logger.addHandler(console_handler)
+
+    file_handler = logging.FileHandler(log_file_name, mode='w')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S'))
+    file_handler.setLevel(level)
+    logger.addHandler(file_handler)
+    return [console_handler, file_handler]
+
+# Function to run one scan and return (scan seconds, total seconds, log bytes)
+def run_once(mode, level, tree, log_dir, workers, console_stream):
+    for name in os.listdir(log_dir):
+        os.remove(os.path.join(log_dir, name))
+
+    handlers = []
+    if mode == 'off':
+        logging.getLogger().handlers.clear()
+        logging.getLogger().setLevel(logging.WARNING)
+    elif mode == 'sync':
+        handlers = configure_sync_logging(os.path.join(log_dir, 'sync.log'), level, console_stream)
+    else:
+        engine.configure_logging(tree, ' - bench', console_level=level, file_level=level, log_directory=log_dir,
+                                 console_stream=console_stream)
+
+    start = time.perf_counter()
+    for _ in engine.iter_detected_files(tree, datetime.now() - timedelta(days=60), ['.xls', '.doc'], workers=workers,
+                                        on_event=lambda event: None, sniff=False):
+        pass
+    scan_seconds = time.perf_counter() - start
+
+    if mode == 'queue':
+        engine.stop_logging()
+    for handler in handlers:
+        handler.flush()
+        handler.close()
+    total_seconds = time.perf_counter() - start
+    logging.getLogger().handlers.clear()
+
+    log_bytes = sum(os.path.getsize(os.path.join(log_dir, name)) for name in os.listdir(log_dir))
+    return scan_seconds, total_seconds, log_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileFlow scan throughput by logging setup and level')
+    parser.add_argument('--files', type=int, default=200_000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=200, help='files per leaf directory')
+    parser.add_argument('--workers', type=int, default=8, help='scanner threads')
+    parser.add_argument('--levels', nargs='+', default=['DEBUG', 'INFO', 'WARNING'], choices=['DEBUG', 'INFO', 'WARNING'])
+    parser.add_argument('--modes', nargs='+', default=['off', 'sync', 'queue'], choices=['off', 'sync', 'queue'])
+    parser.add_argument('--tree', help='directory for the synthetic tree (default: temp dir)')
+    args = parser.parse_args()
+
+    tree = args.tree or tempfile.mkdtemp(prefix='fileflow-bench-')
+    log_dir = tempfile.mkdtemp(prefix='fileflow-bench-logs-')
+    console_stream = open(os.devnull, 'w')
+    try:
+        if not os.path.isdir(tree) or not os.listdir(tree):
+            print(f"Building {args.files:,} files under {tree} ...")
+            build_tree(tree, args.files, args.per_dir, 10)
+        total_files = sum(len(files) for _, _, files in os.walk(tree))
+
+        for level in args.levels:
+            for mode in args.modes:
+                if mode == 'off' and level != args.levels[0]:
+                    continue
+                scan_seconds, total_seconds, log_bytes = run_once(mode, level, tree, log_dir, args.workers, console_stream)
+                label = 'off' if mode == 'off' else f'{mode} {level}'
+                print(f"{label:14s}: scan {scan_seconds:7.2f}s  total {total_seconds:7.2f}s  "
+                      f"{total_files / scan_seconds:12,.0f} files/s  {log_bytes / 1024 / 1024:8.1f} MB of logs")
+    finally:
+        console_stream.close()
+        shutil.rmtree(log_dir, ignore_errors=True)
+        if not args.tree:
+            shutil.rmtree(tree, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
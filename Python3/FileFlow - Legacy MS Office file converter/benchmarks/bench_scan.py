@@ -0,0 +1,128 @@
+# Benchmark for the scandir scanner engine against the original os.walk detection loop.
+#
+# Builds a synthetic tree (1,000,000 files by default) with a mix of legacy Office,
+# modern Office and unrelated files, some of them older than the cutoff, then times:
+#   - the original os.walk + os.path.getmtime + datetime loop from detect_files
+#   - scanner.scan_files with each requested worker count
+# and checks that every run detects exactly the same files.
+# With --index it also times a cold and a warm incremental scan through scan_index.ScanIndex.
+#
+# Usage:
+#   python bench_scan.py                              # 1M files in a temp directory
+#   python bench_scan.py --files 100000 --workers 1 4 16
+#   python bench_scan.py --tree D:\bench --keep       # reuse the tree on later runs
+#   python bench_scan.py --index                      # include the incremental scan index
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scanner import scan_files
+from scan_index import ScanIndex
+
+EXTENSIONS = ['.doc', '.xls', '.docx', '.xlsx', '.pdf', '.txt', '.csv', '.msg']
+OLD_TIMESTAMP = (datetime.now() - timedelta(days=400)).timestamp()
+
+# Function to build the synthetic tree: nested folders of files_per_dir files each.
+# Every fifth legacy file is back-dated so the cutoff check has something to reject.
+def build_tree(root, total_files, files_per_dir, branching):
+    created = 0
+    dir_index = 0
+    while created < total_files:
+        parts = []
+        n = dir_index
+        for _ in range(3):
+            parts.append(f'd{n % branching}')
+            n //= branching
+        directory = os.path.join(root, *parts, f'leaf{dir_index}')
+        os.makedirs(directory, exist_ok=True)
+        for i in range(min(files_per_dir, total_files - created)):
+            ext = EXTENSIONS[(created + i) % len(EXTENSIONS)]
+            path = os.path.join(directory, f'file{i}{ext}')
+            with open(path, 'wb'):
+                pass
+            if ext in ('.doc', '.xls') and (created + i) % 5 == 0:
+                os.utime(path, (OLD_TIMESTAMP, OLD_TIMESTAMP))
+        created += files_per_dir
+        dir_index += 1
+
+# The detection loop as it was in FileFlow.detect_files, minus the logging calls
+def legacy_detect(directory, cutoff_date, file_types):
+    files_to_check = []
+    total_files_checked = 0
+    for root, dirs, files in os.walk(directory):
+        for file in files:
+            total_files_checked += 1
+            file_path = os.path.join(root, file)
+            last_modified_date = datetime.fromtimestamp(os.path.getmtime(file_path))
+            if any(file.lower().endswith(ft.lower()) for ft in file_types):
+                if last_modified_date > cutoff_date:
+                    files_to_check.append(file_path)
+    return files_to_check, total_files_checked
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileFlow detection on a synthetic tree')
+    parser.add_argument('--files', type=int, default=1_000_000, help='number of files to generate')
+    parser.add_argument('--per-dir', type=int, default=200, help='files per leaf directory')
+    parser.add_argument('--branching', type=int, default=10, help='folders per level above the leaves')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--tree', help='directory for the synthetic tree (default: temp dir)')
+    parser.add_argument('--keep', action='store_true', help='do not delete the tree afterwards')
+    parser.add_argument('--skip-legacy', action='store_true', help='skip timing the os.walk loop')
+    parser.add_argument('--index', action='store_true', help='also time cold and warm scans with the scan index')
+    args = parser.parse_args()
+
+    root = args.tree or tempfile.mkdtemp(prefix='fileflow-bench-')
+    file_types = ['.xls', '.doc']
+    cutoff_date = datetime.now() - timedelta(days=60)
+
+    try:
+        if not os.path.isdir(root) or not os.listdir(root):
+            print(f"Building {args.files:,} files under {root} ...")
+            start = time.perf_counter()
+            build_tree(root, args.files, args.per_dir, args.branching)
+            print(f"  built in {time.perf_counter() - start:.1f}s")
+
+        expected = None
+        if not args.skip_legacy:
+            start = time.perf_counter()
+            legacy_matches, checked = legacy_detect(root, cutoff_date, file_types)
+            elapsed = time.perf_counter() - start
+            expected = sorted(legacy_matches)
+            print(f"os.walk legacy    : {elapsed:8.2f}s  {checked / elapsed:12,.0f} files/s  {len(expected):,} detected")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            result = scan_files(root, cutoff_date, file_types, workers=workers)
+            elapsed = time.perf_counter() - start
+            status = ''
+            if expected is not None:
+                status = 'same results' if result.matches == expected else 'RESULTS DIFFER'
+            print(f"scandir {workers:2d} workers: {elapsed:8.2f}s  {result.files_checked / elapsed:12,.0f} files/s  "
+                  f"{len(result.matches):,} detected  {status}")
+
+        if args.index:
+            index_dir = tempfile.mkdtemp(prefix='fileflow-index-')
+            try:
+                with ScanIndex(os.path.join(index_dir, 'scan_index.sqlite3')) as index:
+                    for label in ('index cold run   ', 'index warm run   '):
+                        start = time.perf_counter()
+                        result = index.scan(root, cutoff_date, file_types, workers=max(args.workers))
+                        elapsed = time.perf_counter() - start
+                        status = ''
+                        if expected is not None:
+                            status = 'same results' if result.matches == expected else 'RESULTS DIFFER'
+                        print(f"{label}: {elapsed:8.2f}s  {result.directories_scanned:,} folders listed, "
+                              f"{result.directories_skipped:,} skipped  {len(result.matches):,} detected  {status}")
+            finally:
+                shutil.rmtree(index_dir, ignore_errors=True)
+    finally:
+        if not args.keep and not args.tree:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
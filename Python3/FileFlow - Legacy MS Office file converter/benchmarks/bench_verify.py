@@ -0,0 +1,75 @@
+# Benchmark for the output verification stage, against the conversion it runs alongside.
+#
+# Generates plain data workbooks with xlwt (see bench_xls.py), converts them once with
+# the native backend and then verifies every output against its source with the
+# VerificationPool at each worker count, printing files/sec and MB/sec of output checked
+# next to the conversion rate. Every output should pass; a failure is printed.
+#
+# Usage:
+#   python bench_verify.py
+#   python bench_verify.py --files 500 --rows 5000 --workers 1 2 4 8 --data C:\temp\xls-bench
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from converters import backend_factory, target_path_for
+from scheduler import ConversionPool
+from verifier import VerificationPool
+from bench_xls import build_workbooks, clear_outputs
+
+# Function to verify every output with workers threads; returns (seconds, passed, failed)
+def verify_all(paths, workers):
+    failures = []
+    def on_result(result):
+        if not result.ok:
+            failures.append(result)
+    start = time.perf_counter()
+    pool = VerificationPool(on_result, workers)
+    with pool:
+        for path in paths:
+            pool.submit(path, target_path_for(path))
+    seconds = time.perf_counter() - start
+    for result in failures[:5]:
+        print(f"  failed: {result.target_path}: {result.error}")
+    return seconds, pool.passed, pool.failed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FileFlow output verification')
+    parser.add_argument('--files', type=int, default=200, help='number of workbooks')
+    parser.add_argument('--sheets', type=int, default=3, help='sheets per workbook')
+    parser.add_argument('--rows', type=int, default=2000, help='rows per sheet')
+    parser.add_argument('--columns', type=int, default=8, help='columns per sheet')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='verification threads')
+    parser.add_argument('--data', help='folder for the workbooks, kept between runs (default: temp dir)')
+    args = parser.parse_args()
+
+    directory = args.data or tempfile.mkdtemp(prefix='fileflow-verify-bench-')
+    os.makedirs(directory, exist_ok=True)
+    try:
+        paths, cells = build_workbooks(directory, args.files, args.sheets, args.rows, args.columns)
+        clear_outputs(paths)
+        pool = ConversionPool(backend_factory('native', use_fallback=False), workers=1)
+        with pool:
+            for path in paths:
+                pool.submit(path, target_path_for(path))
+        converted = pool.files_per_second()
+        size = sum(os.path.getsize(target_path_for(path)) for path in paths) / 1024 / 1024
+        print(f"{len(paths)} workbooks of {cells:,} cells, {size:,.1f} MB of .xlsx, {os.cpu_count()} CPUs")
+        print(f"{'conversion':12s}   1 workers : {converted:8.2f} files/s  (native backend)")
+
+        for workers in args.workers:
+            seconds, passed, failed = verify_all(paths, workers)
+            print(f"{'verification':12s} {workers:3d} workers : {len(paths) / seconds:8.2f} files/s  "
+                  f"{size / seconds:8.1f} MB/s  passed {passed}, failed {failed}")
+    finally:
+        if args.data:
+            clear_outputs(paths)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
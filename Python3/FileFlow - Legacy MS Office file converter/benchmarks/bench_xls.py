@@ -0,0 +1,152 @@
+# Benchmark for the native .xls -> .xlsx backend against the Office (COM) and LibreOffice paths.
+#
+# Generates plain data workbooks with xlwt (text, numbers, dates and currency formats over
+# a few sheets) and converts them through the conversion pool with each requested backend
+# at each worker count, printing files/sec and cells/sec. The native backend runs without
+# a fallback, so a workbook it cannot convert counts as failed. Backends that cannot be
+# opened on this machine (office without Windows and Excel, libreoffice without soffice)
+# are reported as not available. --verify reads every native output back with openpyxl and
+# compares it cell by cell with the source.
+#
+# Generating the workbooks takes a while; --data keeps them between runs.
+#
+# Usage:
+#   python bench_xls.py                                   # native at 1, 2 and 4 workers
+#   python bench_xls.py --files 500 --rows 5000 --workers 1 2 4 8 --verify
+#   python bench_xls.py --backends native office --data C:\temp\xls-bench
+import os
+import sys
+import time
+import shutil
+import argparse
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from converters import backend_factory, target_path_for
+from scheduler import ConversionPool
+
+# Written next to the workbooks so a --data folder is only reused for the same settings
+MARKER = 'bench_xls.txt'
+
+# Function to generate count workbooks of sheets x rows x columns cells in directory, or
+# reuse the ones a previous run left there. Returns the paths and the cells per workbook.
+def build_workbooks(directory, count, sheets, rows, columns):
+    import xlwt
+    paths = [os.path.join(directory, f'book{i}.xls') for i in range(count)]
+    settings = f'{count} {sheets} {rows} {columns}'
+    cells = sheets * rows * columns
+    marker = os.path.join(directory, MARKER)
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read() == settings:
+                return paths, cells
+    date_style = xlwt.easyxf(num_format_str='yyyy-mm-dd')
+    money_style = xlwt.easyxf(num_format_str='#,##0.00')
+    start = datetime.date(2000, 1, 1)
+    for i, path in enumerate(paths):
+        workbook = xlwt.Workbook()
+        for s in range(sheets):
+            sheet = workbook.add_sheet(f'Sheet {s + 1}')
+            for r in range(rows):
+                for c in range(columns):
+                    kind = c % 4
+                    if kind == 0:
+                        sheet.write(r, c, f'item {i}-{r}-{c}')
+                    elif kind == 1:
+                        sheet.write(r, c, r * columns + c)
+                    elif kind == 2:
+                        sheet.write(r, c, start + datetime.timedelta(days=r), date_style)
+                    else:
+                        sheet.write(r, c, (r + c) * 1.01, money_style)
+        workbook.save(path)
+    with open(marker, 'w') as f:
+        f.write(settings)
+    return paths, cells
+
+# Function to remove outputs between runs so every run does the same work
+def clear_outputs(paths):
+    for path in paths:
+        try:
+            os.remove(target_path_for(path))
+        except FileNotFoundError:
+            pass
+
+# Function to check a backend can be opened here; returns the reason when it cannot
+def unavailable(name, factory):
+    try:
+        backend = factory()
+        backend.open()
+        backend.close()
+    except Exception as e:
+        return str(e) or type(e).__name__
+    return None
+
+# Function to compare every cell of the outputs with the source workbooks. Returns the
+# number of differing cells.
+def verify(paths):
+    import xlrd
+    import openpyxl
+    differences = 0
+    for path in paths:
+        book = xlrd.open_workbook(path)
+        output = openpyxl.load_workbook(target_path_for(path), read_only=True)
+        for source, converted in zip(book.sheets(), output.worksheets):
+            for row_index, row in enumerate(converted.iter_rows(values_only=True)):
+                for column, value in enumerate(row):
+                    expected = source.cell(row_index, column)
+                    if expected.ctype == xlrd.XL_CELL_DATE:
+                        expected = xlrd.xldate.xldate_as_datetime(expected.value, book.datemode)
+                    else:
+                        expected = expected.value
+                    if value != expected:
+                        differences += 1
+        output.close()
+    return differences
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark native .xls to .xlsx conversion against the other backends')
+    parser.add_argument('--files', type=int, default=200, help='number of workbooks to convert')
+    parser.add_argument('--sheets', type=int, default=3, help='sheets per workbook')
+    parser.add_argument('--rows', type=int, default=2000, help='rows per sheet')
+    parser.add_argument('--columns', type=int, default=8, help='columns per sheet')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--backends', nargs='+', default=['native', 'office', 'libreoffice'])
+    parser.add_argument('--data', help='folder for the workbooks, kept between runs (default: temp dir)')
+    parser.add_argument('--verify', action='store_true', help='compare the native outputs with the sources')
+    args = parser.parse_args()
+
+    directory = args.data or tempfile.mkdtemp(prefix='fileflow-xls-bench-')
+    os.makedirs(directory, exist_ok=True)
+    try:
+        start = time.perf_counter()
+        paths, cells = build_workbooks(directory, args.files, args.sheets, args.rows, args.columns)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"{len(paths)} workbooks of {cells:,} cells, {size / 1024 / 1024:,.1f} MB "
+              f"(ready in {time.perf_counter() - start:.1f}s), {os.cpu_count()} CPUs")
+
+        for name in args.backends:
+            options = {'use_fallback': False} if name == 'native' else {}
+            factory = backend_factory(name, **options)
+            reason = unavailable(name, factory)
+            if reason:
+                print(f"{name:12s}: not available ({reason})")
+                continue
+            clear_outputs(paths)
+            for workers in args.workers:
+                pool = ConversionPool(factory, workers=workers)
+                with pool:
+                    for path in paths:
+                        pool.submit(path, target_path_for(path))
+                rate = pool.files_per_second()
+                print(f"{name:12s} {workers:3d} workers : {rate:8.2f} files/s  {rate * cells:12,.0f} cells/s  "
+                      f"converted {pool.converted}, failed {pool.failed}")
+                if args.verify and name == 'native':
+                    print(f"{'':12s} {len(paths)} outputs checked, {verify(paths)} cells differ")
+                clear_outputs(paths)
+    finally:
+        if not args.data:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,460 @@
+import os
+import time
+import random
+import pathlib
+import shutil
+import logging
+import tempfile
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Legacy extension -> modern extension written by every backend
+TARGET_EXTENSIONS = {
+    '.xls': '.xlsx',
+    '.doc': '.docx',
+}
+
+# Function to work out the output path for a legacy file, e.g. report.xls -> report.xlsx.
+# file_type is the legacy type when it is known from the content (sniffer.py), so a Word
+# file saved as report.dat becomes report.docx.
+def target_path_for(file_path, file_type=None):
+    base, ext = os.path.splitext(file_path)
+    return os.path.abspath(base + TARGET_EXTENSIONS[file_type or ext.lower()])
+
+# Base class for conversion backends.
+# A worker owns exactly one backend instance: open() is called once on the worker's
+# thread before the first file, convert() for every file and close() when the worker stops.
+# Backends that are cheaper per file in bulk set batch_size above 1 and override
+# convert_batch(). health_check() is used by the pool to decide when to restart a backend.
+class ConverterBackend:
+    name = 'base'
+    batch_size = 1
+
+    def open(self):
+        pass
+
+    def convert(self, source_path, target_path):
+        raise NotImplementedError
+
+    # Function to convert several (source, target) pairs, returning one error (or None)
+    # per pair in the same order
+    def convert_batch(self, jobs):
+        errors = []
+        for source_path, target_path in jobs:
+            try:
+                self.convert(source_path, target_path)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def health_check(self):
+        return True
+
+    def close(self):
+        pass
+
+# Converts with Microsoft Office through COM: a hidden Excel (xlwings) for .xls and a
+# Word instance (pywin32) for .doc. Every backend starts its own Office processes, so
+# several workers never share a COM server.
+class OfficeComBackend(ConverterBackend):
+    name = 'office'
+
+    def __init__(self):
+        self.excel = None
+        self.word = None
+        self.com_initialised = False
+
+    def open(self):
+        # COM has to be initialised on every thread that talks to Office
+        import pythoncom
+        pythoncom.CoInitialize()
+        self.com_initialised = True
+
+    # Office applications are only started the first time a file needs them
+    def excel_app(self):
+        if self.excel is None:
+            import xlwings as xw
+            self.excel = xw.App(visible=False, add_book=False)
+            self.excel.display_alerts = False
+            self.excel.screen_updating = False
+        return self.excel
+
+    def word_app(self):
+        if self.word is None:
+            import win32com.client as win32
+            # DispatchEx starts a new Word process instead of attaching to a running one
+            self.word = win32.DispatchEx("Word.Application")
+            self.word.Visible = False
+            self.word.DisplayAlerts = 0
+        return self.word
+
+    # The target says which application to use: the source may have an unusual extension
+    # when its type was recognised from the content
+    def convert(self, source_path, target_path):
+        ext = os.path.splitext(target_path)[1].lower()
+        if ext == '.xlsx':
+            wb = self.excel_app().books.open(source_path)
+            try:
+                wb.save(target_path)
+            finally:
+                wb.close()
+        elif ext == '.docx':
+            doc = self.word_app().Documents.Open(source_path)
+            try:
+                doc.SaveAs(target_path, FileFormat=16)  # 16 corresponds to wdFormatXMLDocument
+            finally:
+                doc.Close()
+        else:
+            raise ValueError(f"Unsupported file type: {source_path}")
+
+    # Touch a cheap property on every running Office instance; a crashed or hung COM
+    # server raises here
+    def health_check(self):
+        try:
+            if self.excel is not None:
+                self.excel.books.count
+            if self.word is not None:
+                self.word.Documents.Count
+            return True
+        except Exception as e:
+            logger.warning("Office health check failed: %s", e)
+            return False
+
+    def close(self):
+        if self.excel is not None:
+            try:
+                self.excel.quit()
+            except Exception as e:
+                logger.warning("Error closing Excel: %s", e)
+            self.excel = None
+        if self.word is not None:
+            try:
+                self.word.Quit()
+            except Exception as e:
+                logger.warning("Error closing Word: %s", e)
+            self.word = None
+        if self.com_initialised:
+            import pythoncom
+            pythoncom.CoUninitialize()
+            self.com_initialised = False
+
+# Stand-in backend for testing and benchmarking on machines without Office.
+# It copies the source bytes to the target after sleeping for latency seconds plus or
+# minus jitter, and fails the given fraction of files to exercise the error paths.
+class FakeBackend(ConverterBackend):
+    name = 'fake'
+
+    def __init__(self, latency=0.05, jitter=0.5, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def convert(self, source_path, target_path):
+        if self.latency:
+            spread = self.latency * self.jitter
+            time.sleep(max(0.0, self.random.uniform(self.latency - spread, self.latency + spread)))
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise RuntimeError(f"Simulated conversion failure for {source_path}")
+        shutil.copyfile(source_path, target_path)
+
+# Converts .xls workbooks without Office: xlrd reads them and openpyxl writes the .xlsx
+# in write-only mode (see xls_native.py), in a process of the backend's own so that
+# several workers convert on several cores. Workbooks holding something the native engine
+# would lose (formulas, charts, pictures, macros, ...) and .doc files go to the fallback
+# backend (default_backend() unless fallback names another), which is only opened the
+# first time it is needed; use_fallback=False fails them instead. native and fallen_back
+# count the files each converted.
+class NativeBackend(ConverterBackend):
+    name = 'native'
+
+    def __init__(self, fallback=None, use_fallback=True):
+        self.fallback_name = (fallback or default_backend()) if use_fallback else None
+        self.fallback = None
+        self.executor = None
+        self.broken = False
+        self.native = 0
+        self.fallen_back = 0
+
+    def open(self):
+        try:
+            import xls_native
+        except ImportError as e:
+            raise RuntimeError(f"The native backend needs xlrd and openpyxl (pip install xlrd openpyxl): {e}")
+        from concurrent.futures import ProcessPoolExecutor
+        self.xls_native = xls_native
+        self.executor = ProcessPoolExecutor(max_workers=1)
+
+    def fallback_backend(self, source_path, reason):
+        if self.fallback_name is None:
+            raise RuntimeError(f"{source_path} needs Office ({reason}) and no fallback backend is set")
+        if self.fallback is None:
+            fallback = BACKENDS[self.fallback_name]()
+            fallback.open()
+            self.fallback = fallback
+        logger.info("Converting %s with the %s backend: %s", source_path, self.fallback_name, reason)
+        return self.fallback
+
+    def convert(self, source_path, target_path):
+        from concurrent.futures.process import BrokenProcessPool
+        if os.path.splitext(target_path)[1].lower() != '.xlsx':
+            self.fallback_backend(source_path, "not an Excel workbook").convert(source_path, target_path)
+            self.fallen_back += 1
+            return
+        try:
+            self.executor.submit(self.xls_native.convert_xls, source_path, target_path).result()
+            self.native += 1
+        except self.xls_native.NeedsOffice as e:
+            self.fallback_backend(source_path, str(e)).convert(source_path, target_path)
+            self.fallen_back += 1
+        except BrokenProcessPool:
+            # The conversion process died (out of memory on a huge workbook, say); the
+            # health check has the pool restart the backend
+            self.broken = True
+            raise
+
+    def health_check(self):
+        if self.broken:
+            return False
+        return self.fallback is None or self.fallback.health_check()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.fallback is not None:
+            try:
+                self.fallback.close()
+            except Exception as e:
+                logger.warning("Error closing the %s backend: %s", self.fallback_name, e)
+            self.fallback = None
+
+# Places LibreOffice is installed when soffice is not on the PATH
+SOFFICE_LOCATIONS = [
+    r'C:\Program Files\LibreOffice\program\soffice.exe',
+    r'C:\Program Files (x86)\LibreOffice\program\soffice.exe',
+    '/usr/lib/libreoffice/program/soffice',
+    '/opt/libreoffice/program/soffice',
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+]
+
+# Function to find the soffice executable, FILEFLOW_SOFFICE overrides the search
+def find_soffice():
+    override = os.environ.get('FILEFLOW_SOFFICE')
+    if override:
+        return override
+    for name in ('soffice', 'libreoffice'):
+        path = shutil.which(name)
+        if path:
+            return path
+    for path in SOFFICE_LOCATIONS:
+        if os.path.exists(path):
+            return path
+    return None
+
+# Converts with headless LibreOffice, so it runs on Linux batch hosts without Office.
+#
+# When the python UNO bridge is importable (python3-uno on Linux, the Python bundled with
+# LibreOffice on Windows) each backend keeps a long-lived soffice listener running and
+# converts through it, so LibreOffice only starts once per worker. Otherwise it falls
+# back to `soffice --headless --convert-to`, converting up to batch_size files per
+# invocation so the start-up cost is shared by the whole batch.
+#
+# Every backend uses its own LibreOffice profile directory, which is what lets several
+# instances run side by side.
+class LibreOfficeBackend(ConverterBackend):
+    name = 'libreoffice'
+
+    # Target extension -> (convert-to format, export filter)
+    FILTERS = {
+        '.docx': ('docx', 'MS Word 2007 XML'),
+        '.xlsx': ('xlsx', 'Calc MS Excel 2007 XML'),
+    }
+
+    def __init__(self, soffice=None, batch_size=20, use_listener=True, timeout=600, start_timeout=60):
+        self.soffice = soffice
+        self.batch_size = batch_size
+        self.use_listener = use_listener
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.profile_dir = None
+        self.process = None
+        self.desktop = None
+        self.uno = None
+
+    def open(self):
+        self.soffice = self.soffice or find_soffice()
+        if not self.soffice:
+            raise RuntimeError("LibreOffice (soffice) was not found, install it or set FILEFLOW_SOFFICE")
+        self.profile_dir = tempfile.mkdtemp(prefix='fileflow-lo-')
+        if self.use_listener:
+            try:
+                import uno
+                self.uno = uno
+            except ImportError:
+                logger.info("Python UNO bridge not available, using soffice --convert-to batches")
+        if self.uno is not None:
+            self.start_listener()
+            # With a listener every file is cheap, so there is nothing to batch
+            self.batch_size = 1
+
+    # file:// URI of the profile directory for the -env:UserInstallation option
+    def profile_url(self):
+        return pathlib.Path(self.profile_dir).resolve().as_uri()
+
+    def start_listener(self):
+        pipe_name = f'fileflow_{os.getpid()}_{os.path.basename(self.profile_dir)}'
+        self.process = subprocess.Popen(
+            [self.soffice, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault',
+             f'-env:UserInstallation={self.profile_url()}', f'--accept=pipe,name={pipe_name};urp;'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local_context = self.uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            'com.sun.star.bridge.UnoUrlResolver', local_context)
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            try:
+                context = resolver.resolve(f'uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext')
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError("LibreOffice listener did not start")
+                time.sleep(0.25)
+        self.desktop = context.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', context)
+
+    def property_values(self, **values):
+        from com.sun.star.beans import PropertyValue
+        properties = []
+        for name, value in values.items():
+            prop = PropertyValue()
+            prop.Name = name
+            prop.Value = value
+            properties.append(prop)
+        return tuple(properties)
+
+    def convert(self, source_path, target_path):
+        error = self.convert_batch([(source_path, target_path)])[0]
+        if error is not None:
+            raise error
+
+    def convert_batch(self, jobs):
+        if self.desktop is not None:
+            return [self.convert_with_listener(source_path, target_path) for source_path, target_path in jobs]
+
+        errors = {}
+        # --convert-to writes <name>.<ext> into --outdir, so one invocation handles the
+        # files of one folder and one output format. Sources sharing a name (report.xls and
+        # a sniffed report.dat) would write the same output there, so each goes to an
+        # invocation of its own.
+        groups = {}
+        stems = {}
+        for source_path, target_path in jobs:
+            target_ext = os.path.splitext(target_path)[1].lower()
+            if target_ext not in self.FILTERS:
+                errors[source_path] = ValueError(f"Unsupported target type: {target_path}")
+                continue
+            folder = os.path.dirname(source_path)
+            stem = (folder, target_ext, os.path.normcase(pathlib.Path(source_path).stem))
+            round_number = stems.get(stem, 0)
+            stems[stem] = round_number + 1
+            groups.setdefault((folder, target_ext, round_number), []).append((source_path, target_path))
+        for (_, target_ext, _), group in groups.items():
+            errors.update(self.convert_group(group, target_ext))
+        return [errors.get(source_path) for source_path, _ in jobs]
+
+    def convert_with_listener(self, source_path, target_path):
+        target_ext = os.path.splitext(target_path)[1].lower()
+        try:
+            document = self.desktop.loadComponentFromURL(
+                self.uno.systemPathToFileUrl(os.path.abspath(source_path)), '_blank', 0,
+                self.property_values(Hidden=True, ReadOnly=True))
+            if document is None:
+                return RuntimeError(f"LibreOffice could not open {source_path}")
+            try:
+                document.storeToURL(self.uno.systemPathToFileUrl(os.path.abspath(target_path)),
+                                    self.property_values(FilterName=self.FILTERS[target_ext][1], Overwrite=True))
+            finally:
+                document.close(True)
+            return None
+        except Exception as e:
+            return e
+
+    def convert_group(self, group, target_ext):
+        fmt, export_filter = self.FILTERS[target_ext]
+        outdir = tempfile.mkdtemp(dir=self.profile_dir, prefix='out-')
+        errors = {}
+        try:
+            command = [self.soffice, '--headless', '--invisible', '--nologo', '--norestore',
+                       f'-env:UserInstallation={self.profile_url()}',
+                       '--convert-to', f'{fmt}:{export_filter}', '--outdir', outdir]
+            command.extend(source_path for source_path, _ in group)
+            try:
+                completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                           timeout=self.timeout)
+                output = completed.stdout.decode(errors='replace').strip()
+            except subprocess.TimeoutExpired:
+                output = f"soffice timed out after {self.timeout}s"
+
+            for source_path, target_path in group:
+                produced = os.path.join(outdir, os.path.splitext(os.path.basename(source_path))[0] + '.' + fmt)
+                if os.path.exists(produced):
+                    shutil.move(produced, target_path)
+                else:
+                    errors[source_path] = RuntimeError(f"LibreOffice did not convert {source_path}: {output}")
+        finally:
+            shutil.rmtree(outdir, ignore_errors=True)
+        return errors
+
+    def health_check(self):
+        if self.desktop is not None:
+            if self.process.poll() is not None:
+                return False
+            try:
+                self.desktop.getComponents()
+                return True
+            except Exception as e:
+                logger.warning("LibreOffice health check failed: %s", e)
+                return False
+        return bool(self.soffice) and os.path.exists(self.soffice)
+
+    def close(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        if self.process is not None:
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None
+        if self.profile_dir:
+            shutil.rmtree(self.profile_dir, ignore_errors=True)
+            self.profile_dir = None
+
+# Backend name -> class, used by the GUI and command line to pick a backend
+BACKENDS = {
+    OfficeComBackend.name: OfficeComBackend,
+    LibreOfficeBackend.name: LibreOfficeBackend,
+    NativeBackend.name: NativeBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+# Function to pick the backend to use when none is chosen: Office on Windows,
+# LibreOffice everywhere else
+def default_backend():
+    return OfficeComBackend.name if os.name == 'nt' else LibreOfficeBackend.name
+
+# Function returning a factory that builds a fresh backend for each worker
+def backend_factory(name, **options):
+    try:
+        backend_class = BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown conversion backend '{name}', choose from: {', '.join(BACKENDS)}")
+    return lambda: backend_class(**options)
@@ -0,0 +1,259 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# What Deduplicator.plan() tells the engine to do with a file
+CONVERT = 'convert'   # convert it with the backend
+COPY = 'copy'         # its output can be made now, from an output that already exists
+WAIT = 'wait'         # a file with the same content is being converted; its output follows
+
+# How the output of a duplicate is made from the converted one
+COPY_OUTPUT = 'copy'
+HARDLINK_OUTPUT = 'hardlink'
+OUTPUT_MODES = (COPY_OUTPUT, HARDLINK_OUTPUT)
+
+# Bytes read at a time while hashing
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# Function to hash a file's content. BLAKE2b is the fastest of hashlib's strong hashes
+# in pure software; 128 bits is plenty to tell documents apart.
+def content_hash(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_BYTES)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Persistent content hash -> output cache, stored in SQLite, so a later run can reuse an
+# output converted by an earlier one. An entry is only trusted while its output still has
+# the size and modified time it had when it was recorded; a converted file someone has
+# since edited or removed is never copied.
+class OutputCache:
+    def __init__(self, cache_path, group_size=500):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS outputs (size INTEGER, hash TEXT, extension TEXT, output TEXT, '
+            'output_size INTEGER, output_mtime REAL, PRIMARY KEY (size, hash, extension))')
+        self.lock = threading.Lock()
+        self.pending = []
+        self.group_size = group_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Function to list the source sizes the cache has outputs for; only files of these
+    # sizes (or of a size seen twice in a run) are worth hashing
+    def sizes(self):
+        self.flush()
+        with self.lock:
+            return {row[0] for row in self.connection.execute('SELECT DISTINCT size FROM outputs')}
+
+    # Function to give the cached output for a key, or None. Stale entries are dropped.
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT output, output_size, output_mtime FROM outputs '
+                                          'WHERE size = ? AND hash = ? AND extension = ?', key).fetchone()
+        if row is None:
+            return None
+        output, size, mtime = row
+        try:
+            stat = os.stat(output)
+        except OSError:
+            stat = None
+        if stat is not None and stat.st_size == size and stat.st_mtime == mtime:
+            return output
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM outputs WHERE size = ? AND hash = ? AND extension = ?', key)
+        return None
+
+    def put(self, key, output_path):
+        try:
+            stat = os.stat(output_path)
+        except OSError:
+            return
+        with self.lock:
+            self.pending.append((*key, output_path, stat.st_size, stat.st_mtime))
+            full = len(self.pending) >= self.group_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)', self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+# One file the backend converts, and the files with the same content waiting for its
+# output. An output found in the cache is a representative with no source_path.
+class Representative:
+    def __init__(self, source_path, target_path, size, key=None):
+        self.source_path = source_path
+        self.target_path = target_path
+        self.size = size
+        self.key = key
+        self.done = False
+        self.followers = []
+
+# Groups the files of a conversion run by content so each distinct file is converted once.
+#
+# Files are grouped by size first: a file whose size nothing else has is queued without
+# being read (it is hashed by finished() once converted). The second file of a size has
+# both it and the first hashed, and from then on files are grouped by (size, hash, output
+# extension). The first file of a group is
+# converted; plan() returns WAIT for the others while it is converting and COPY once its
+# output exists (or the cache has one from an earlier run). finished() is called with
+# every conversion result and hands back the followers whose output can now be made.
+# plan() runs on the thread queueing the files, finished() on the conversion workers.
+#
+# Sizes and converted files are remembered for the whole run, so memory grows with the
+# number of distinct sizes and of files that share one, not with the files skipped.
+class Deduplicator:
+    def __init__(self, cache=None):
+        self.cache = cache
+        self.lock = threading.Lock()
+        # Sizes to hash on sight: cached ones, and each size seen once its first file is
+        # known (that file is in first_of_size until a second one turns up)
+        self.hash_sizes = cache.sizes() if cache is not None else set()
+        self.first_of_size = {}
+        self.groups = {}
+        self.converting = {}
+        self.hashed = 0
+
+    # Function to work out the grouping key of a file, or None if it cannot be read
+    def key_for(self, source_path, size, target_path):
+        try:
+            digest = content_hash(source_path)
+        except OSError as e:
+            logger.warning("Unable to hash %s, it is not deduplicated: %s", source_path, e)
+            return None
+        with self.lock:
+            self.hashed += 1
+        return size, digest, os.path.splitext(target_path)[1].lower()
+
+    # Function to decide what to do with one file before it is queued.
+    # Returns (CONVERT, None), or (COPY or WAIT, the representative whose output to copy).
+    def plan(self, source_path, target_path):
+        try:
+            size = os.stat(source_path).st_size
+        except OSError:
+            return CONVERT, None
+        with self.lock:
+            first = self.first_of_size.pop(size, None)
+            if first is None and size not in self.hash_sizes:
+                # Only file of this size so far: converted without being read
+                self.hash_sizes.add(size)
+                representative = Representative(source_path, target_path, size)
+                self.first_of_size[size] = representative
+                self.converting[source_path] = representative
+                return CONVERT, None
+
+        # A second file of this size: the first one's key is needed too, unless its
+        # conversion has finished and worked it out already
+        if first is not None:
+            first_key = first.key or self.key_for(first.source_path, size, first.target_path)
+            with self.lock:
+                if first.key is None:
+                    first.key = first_key
+                if first.key is not None and (first.done or first.source_path in self.converting):
+                    self.groups.setdefault(first.key, first)
+
+        key = self.key_for(source_path, size, target_path)
+        if key is None:
+            return CONVERT, None
+        with self.lock:
+            representative = self.groups.get(key)
+            if representative is not None:
+                if representative.done:
+                    return COPY, representative
+                representative.followers.append((source_path, target_path))
+                return WAIT, representative
+        cached = self.cache.get(key) if self.cache is not None else None
+        with self.lock:
+            if cached is not None and os.path.abspath(cached) != os.path.abspath(target_path):
+                representative = Representative(None, cached, size, key)
+                representative.done = True
+                self.groups[key] = representative
+                return COPY, representative
+            representative = Representative(source_path, target_path, size, key)
+            self.groups[key] = representative
+            self.converting[source_path] = representative
+            return CONVERT, None
+
+    # Function to record the result of a conversion. Returns the (source, target) of the
+    # files waiting for it and the output's cache key (pass it to remember() once the output
+    # is known to be good). After a failure the caller fails the waiting files too; their
+    # content is the same, and the journal has them retried by the next run. The next file
+    # with the same content is converted again.
+    def finished(self, source_path, ok):
+        with self.lock:
+            representative = self.converting.pop(source_path, None)
+            if representative is None:
+                return [], None
+            followers, representative.followers = representative.followers, []
+            representative.done = ok
+            if not ok:
+                if representative.key is not None and self.groups.get(representative.key) is representative:
+                    del self.groups[representative.key]
+                if self.first_of_size.get(representative.size) is representative:
+                    del self.first_of_size[representative.size]
+                return followers, None
+            needs_key = representative.key is None
+        if needs_key:
+            # Hashed now, on the worker, while the source is still there (originals are
+            # deleted in batches later) and most likely still in the OS cache from the
+            # conversion: later files of the same size and later runs can reuse the output
+            key = self.key_for(source_path, representative.size, representative.target_path)
+            with self.lock:
+                if representative.key is None:
+                    representative.key = key
+        return followers, representative.key
+
+    # Function to add a converted output to the cache, for later runs
+    def remember(self, key, output_path):
+        if self.cache is not None:
+            self.cache.put(key, output_path)
+
+# Function to make the output of a duplicate from an existing output: a copy, or with
+# HARDLINK_OUTPUT a hard link where the file system allows one (falling back to a copy).
+# A link shares the converted file's modified time, so it is only used when that is newer
+# than the duplicate's source; otherwise the next run would take the output for stale.
+# The target is written under a temporary name and renamed into place.
+def materialise_output(output_path, target_path, source_path, mode=COPY_OUTPUT):
+    temp_path = target_path + '.fileflow-tmp'
+    try:
+        linked = False
+        if mode == HARDLINK_OUTPUT and os.stat(output_path).st_mtime >= os.stat(source_path).st_mtime:
+            try:
+                os.link(output_path, temp_path)
+                linked = True
+            except OSError:
+                pass
+        if not linked:
+            shutil.copyfile(output_path, temp_path)
+        os.replace(temp_path, target_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
@@ -0,0 +1,507 @@
+# FileFlow engine: detection, conversion and logging shared by the GUI (FileFlow.py) and
+# the command line (fileflow_cli.py). Nothing here imports Tk or Office; the COM modules
+# are only loaded by the office backend when a worker starts.
+import os
+import time
+import logging
+import tempfile
+import threading
+import colorlog
+from datetime import datetime
+from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+from log_pipeline import JsonLinesFormatter, start_logging, stop_logging
+from scanner import iter_files, cutoff_timestamp, ScanResult, DEFAULT_SCAN_WORKERS
+from scan_index import ScanIndex
+from sniffer import SniffCache, SniffStats, iter_sniffed
+from converters import backend_factory, target_path_for, default_backend
+from scheduler import ConversionPool, DEFAULT_CONVERSION_WORKERS
+from journal import ConversionJournal, already_converted, QUEUED, CONVERTING, WRITTEN, DELETED, FAILED
+from dedup import Deduplicator, OutputCache, materialise_output, CONVERT, COPY, COPY_OUTPUT
+from verifier import VerificationPool, DEFAULT_VERIFY_WORKERS, output_fingerprint
+
+# Logs, the scan index and the conversion journal all live here
+LOG_DIRECTORY = r'C:\temp\FileFlowLogs' if os.name == 'nt' else os.path.join(tempfile.gettempdir(), 'FileFlowLogs')
+
+# SQLite index used for incremental scans when 'Use scan index' is ticked
+INDEX_FILE = os.path.join(LOG_DIRECTORY, 'scan_index.sqlite3')
+
+# Conversion journal, lets an interrupted conversion resume where it stopped
+JOURNAL_FILE = os.path.join(LOG_DIRECTORY, 'conversion_journal.sqlite3')
+
+# Log file rotation: start a new file every LOG_MAX_BYTES, keeping LOG_BACKUP_COUNT old ones
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Cache of content checks (sniffer.py), keyed by path, size and modified time
+SNIFF_CACHE_FILE = os.path.join(LOG_DIRECTORY, 'sniff_cache.sqlite3')
+
+# Content hash -> output cache (dedup.py), so identical files are only converted once, across runs too
+DEDUP_CACHE_FILE = os.path.join(LOG_DIRECTORY, 'conversion_cache.sqlite3')
+
+# How often a conversion logs its files discovered vs. converted counts
+PROGRESS_LOG_SECONDS = 10
+
+# Function to create the log directory if it doesn't exist
+def ensure_log_directory_exists(log_directory):
+    if not os.path.exists(log_directory):
+        os.makedirs(log_directory)
+
+# Function to format the log file name and ensure log directory exists.
+# The file log is JSON lines, one object per record.
+def get_log_file_name(log_directory, suffix=''):
+    ensure_log_directory_exists(log_directory)
+    date_str = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
+    log_file_name = os.path.join(log_directory, f'{date_str}{suffix}.jsonl')
+    return log_file_name
+
+# Configure logging: coloured console, a rotating JSON-lines log file per run and any
+# extra handlers (the GUI passes its log window sink).
+# Log calls only queue the record; formatting and writing happen on a background
+# listener thread (see log_pipeline.py). The file is rotated every max_bytes, or on a
+# schedule if rotate_when is given (a TimedRotatingFileHandler 'when' value such as 'H'
+# or 'midnight'), keeping backup_count old files.
+def configure_logging(directory, suffix='', extra_handlers=(), console_level=logging.DEBUG, log_directory=LOG_DIRECTORY,
+                      file_level=logging.DEBUG, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT, rotate_when=None,
+                      console_stream=None):
+    log_file_name = get_log_file_name(log_directory, suffix)
+    log_formatter = colorlog.ColoredFormatter(
+        '%(log_color)s%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        reset=True,
+        log_colors={
+            'DEBUG': 'cyan',
+            'INFO': 'green',
+            'WARNING': 'yellow',
+            'ERROR': 'red',
+            'CRITICAL': 'bold_red',
+        }
+    )
+
+    text_formatter = logging.Formatter(
+        '%(asctime)s - %(levelname)s - %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S'
+    )
+
+    # Console handler with color
+    console_handler = logging.StreamHandler(console_stream)
+    console_handler.setFormatter(log_formatter)
+    console_handler.setLevel(console_level)
+
+    # Rotating JSON-lines file handler
+    if rotate_when:
+        file_handler = TimedRotatingFileHandler(log_file_name, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    else:
+        file_handler = RotatingFileHandler(log_file_name, mode='w', maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding='utf-8')
+    file_handler.setFormatter(JsonLinesFormatter())
+    file_handler.setLevel(file_level)
+
+    # Extra handlers, using the plain text formatter to avoid color codes
+    for handler in extra_handlers:
+        if handler.formatter is None:
+            handler.setFormatter(text_formatter)
+
+    start_logging([console_handler, file_handler, *extra_handlers])
+    return log_file_name
+
+# Function to accept either one directory or a list of them
+def as_roots(directory):
+    if isinstance(directory, (str, os.PathLike)):
+        return [directory]
+    return list(directory)
+
+# Function to stream the files whose name and modified date match, from the scanner or
+# the scan index. totals gets the number of files checked.
+def iter_candidate_files(roots, cutoff_date, file_types, workers, index_path, on_event, totals):
+    logger = logging.getLogger()
+    if index_path:
+        # Incremental scan: only folders changed since the last run are listed again,
+        # so only the changes are logged file by file
+        with ScanIndex(index_path) as index:
+            result = index.scan(roots, cutoff_date, file_types, workers=workers, collect_matches=False)
+            for change, paths in (('added', result.added), ('modified', result.modified), ('deleted', result.deleted)):
+                for file_path in paths:
+                    logger.info("%s file: %s", change.capitalize(), file_path)
+                    if on_event:
+                        on_event({'event': change, 'path': file_path})
+            logger.info("Scan index: %d folders listed, %d unchanged folders skipped, %d added, %d modified, %d deleted",
+                        result.directories_scanned, result.directories_skipped, len(result.added), len(result.modified),
+                        len(result.deleted))
+            totals['checked'] = result.files_checked
+            yield from index.iter_matches([os.path.abspath(root) for root in roots], cutoff_timestamp(cutoff_date))
+    else:
+        stats = ScanResult()
+        for file_path in iter_files(roots, cutoff_date, file_types, workers=workers, stats=stats):
+            totals['checked'] = stats.files_checked
+            yield file_path
+        totals['checked'] = stats.files_checked
+
+# Function to stream detected files as the scan finds them, so conversion can start on
+# the first match instead of waiting for the whole tree to be walked.
+# Yields (path, file type). With sniff on, every candidate's first few KB are read (see
+# sniffer.py) and the file type comes from the content: files that are already OOXML,
+# encrypted or not Word/Excel at all are left out, and files with one of
+# sniff_extensions are included when their content is Word or Excel 97-2003.
+# on_event, if given, receives a dict per detected, rejected (or, with an index,
+# changed) file.
+def iter_detected_files(directory, cutoff_date, file_types=['.xls', '.doc'], workers=DEFAULT_SCAN_WORKERS, index_path=None,
+                        on_event=None, sniff=True, sniff_cache_path=SNIFF_CACHE_FILE, sniff_extensions=()):
+    logger = logging.getLogger()
+    roots = as_roots(directory)
+    logger.info("Starting detection in directory: %s", ', '.join(map(str, roots)))
+    logger.info("Cutoff date for file modification: %s", cutoff_date.strftime('%Y-%m-%d'))
+
+    totals = {'checked': 0, 'detected': 0, 'rejected': 0}
+    scan_types = list(file_types) + [ext for ext in sniff_extensions if ext not in file_types] if sniff else file_types
+    sniff_stats = SniffStats()
+    cache = None
+
+    try:
+        candidates = iter_candidate_files(roots, cutoff_date, scan_types, workers, index_path, on_event, totals)
+        if sniff:
+            cache = SniffCache(sniff_cache_path) if sniff_cache_path else None
+            classified = iter_sniffed(candidates, workers=workers, cache=cache, stats=sniff_stats)
+        else:
+            classified = ((file_path, os.path.splitext(file_path)[1].lower()) for file_path in candidates)
+
+        for file_path, file_type in classified:
+            if file_type not in file_types:
+                # Files picked up through sniff_extensions are only of interest if they
+                # turn out to be Word or Excel
+                if os.path.splitext(file_path)[1].lower() in file_types:
+                    totals['rejected'] += 1
+                    logger.info("Skipping %s: content is %s, not one of the selected file types", file_path, file_type)
+                    if on_event:
+                        on_event({'event': 'rejected', 'path': file_path, 'kind': file_type})
+                continue
+            totals['detected'] += 1
+            logger.info("Detected file: %s", file_path)
+            if on_event:
+                on_event({'event': 'detected', 'path': file_path, 'kind': file_type})
+            yield file_path, file_type
+
+    except Exception as e:
+        logger.error("Error during detection: %s", e)
+    finally:
+        if cache is not None:
+            cache.close()
+
+    if sniff:
+        kinds = ', '.join(f'{count} {kind}' for kind, count in sorted(sniff_stats.kinds.items()))
+        logger.info("Content check: %d files classified (%d from cache): %s", sniff_stats.sniffed, sniff_stats.cache_hits,
+                    kinds or 'none')
+    logger.info("Detection completed. Total files checked: %d, Files detected: %d, Rejected by content: %d",
+                totals['checked'], totals['detected'], totals['rejected'])
+
+def detect_files(directory, cutoff_date, file_types=['.xls', '.doc'], workers=DEFAULT_SCAN_WORKERS, index_path=None, on_event=None,
+                 sniff=True, sniff_cache_path=SNIFF_CACHE_FILE, sniff_extensions=()):
+    return sorted(file_path for file_path, _ in iter_detected_files(
+        directory, cutoff_date, file_types, workers=workers, index_path=index_path, on_event=on_event,
+        sniff=sniff, sniff_cache_path=sniff_cache_path, sniff_extensions=sniff_extensions))
+
+# Function to convert every detected file and return a summary dict.
+# on_progress(discovered, converted, failed, skipped, final) is called at most once a
+# second; on_event receives a dict for every file (converted, failed, skipped, deleted).
+# dry_run only reports what would be converted, without starting a backend or touching
+# the journal (so only existing outputs count as already converted).
+# sniff, sniff_cache_path and sniff_extensions are passed on to iter_detected_files; files
+# rejected by the content check never reach the conversion workers.
+# With dedup on, byte-identical files are converted once (see dedup.py): the others get a
+# copy of the converted output (a hard link with dedup_mode='hardlink'), and outputs of
+# earlier runs are reused from the cache at dedup_cache_path (None for no cache).
+# With verify on, every output is checked without Office on verify_workers threads while
+# the conversion goes on (see verifier.py): a valid zip with the parts it needs and about
+# as many pages, sheets and rows as the source. An original is only deleted once its
+# output has passed; a failed output is reported and its original kept.
+def convert_files(directory, cutoff_date, workers=DEFAULT_CONVERSION_WORKERS, file_types=['.xls', '.doc'], delete_originals=False,
+                  index_path=None, backend=None, journal_path=JOURNAL_FILE, on_progress=None, on_event=None,
+                  scan_workers=DEFAULT_SCAN_WORKERS, dry_run=False, sniff=True, sniff_cache_path=SNIFF_CACHE_FILE,
+                  sniff_extensions=(), dedup=True, dedup_cache_path=DEDUP_CACHE_FILE, dedup_mode=COPY_OUTPUT, verify=True,
+                  verify_workers=DEFAULT_VERIFY_WORKERS):
+    backend = backend or default_backend()
+    logger = logging.getLogger()
+    logger.info("Starting conversion in directory: %s", ', '.join(map(str, as_roots(directory))))
+    logger.info("Cutoff date for file modification: %s", cutoff_date.strftime('%Y-%m-%d'))
+    logger.info("Using %d conversion worker(s) with the %s backend%s", workers, backend, ' (dry run)' if dry_run else '')
+
+    journal = ConversionJournal(journal_path) if journal_path and not dry_run else None
+    output_cache = OutputCache(dedup_cache_path) if dedup and dedup_cache_path else None
+    deduplicator = Deduplicator(output_cache) if dedup else None
+    pending_deletes = []
+    pending_lock = threading.Lock()
+    # A sniffed report.dat and a report.xls next to it both map to report.xlsx. The journal
+    # knows which source holds each output, in this run or an earlier one; without one
+    # (a dry run, or journal_path=None) the outputs claimed in this run are kept here,
+    # output path (normcased) -> source.
+    claimed_targets = {}
+    totals = {'discovered': 0, 'skipped': 0, 'deleted': 0, 'rejected': 0, 'deduplicated': 0, 'reused': 0,
+              'duplicates_failed': 0}
+    progress_times = {'callback': 0.0, 'log': time.monotonic()}
+
+    def emit(event):
+        if on_event:
+            on_event(event)
+
+    # Originals are only removed once their output passed verification and its 'written'
+    # record is committed, so a crash can never leave a deleted original the journal does
+    # not know about. An output that changed since it was checked (overwritten or removed)
+    # keeps its original; the next run checks it again.
+    def delete_written_originals():
+        if journal:
+            journal.flush()
+        with pending_lock:
+            batch = pending_deletes[:]
+            pending_deletes.clear()
+        for source_path, target_path, fingerprint in batch:
+            if output_fingerprint(target_path) != fingerprint:
+                logger.warning("Output %s changed after it was checked, original kept: %s", target_path, source_path)
+                emit({'event': 'delete-skipped', 'source': source_path, 'target': target_path,
+                      'reason': 'output changed after it was checked'})
+                continue
+            try:
+                os.remove(source_path)
+                with pending_lock:
+                    totals['deleted'] += 1
+                logger.info("Deleted original file: %s", source_path)
+                emit({'event': 'deleted', 'source': source_path, 'target': target_path})
+                if journal:
+                    journal.record(source_path, DELETED, target_path)
+            except OSError as e:
+                logger.error("Error deleting original file %s: %s", source_path, e)
+                emit({'event': 'delete-failed', 'source': source_path, 'error': str(e)})
+
+    # Only rejections are passed on from detection, every detected file gets its own
+    # converted/failed/skipped event
+    def handle_detection_event(event):
+        if event['event'] == 'rejected':
+            totals['rejected'] += 1
+            emit(event)
+
+    def queue_delete(source_path, target_path, fingerprint):
+        with pending_lock:
+            pending_deletes.append((source_path, target_path, fingerprint))
+
+    # Every output goes through verification before its original may be deleted; new
+    # outputs are verified even when originals are kept, to report broken ones.
+    # written is False for outputs of earlier runs, which are only checked before a delete.
+    # A converted output is only added to the dedup cache (cache_key) once it has passed.
+    def output_ready(source_path, target_path, written=True, cache_key=None):
+        if verification:
+            if written or delete_originals:
+                verification.submit(source_path, target_path, (written, cache_key))
+            return
+        if cache_key:
+            deduplicator.remember(cache_key, target_path)
+        if delete_originals:
+            queue_delete(source_path, target_path, output_fingerprint(target_path))
+
+    # Runs on the verifying threads, one output at a time
+    def handle_verification(result):
+        written, cache_key = result.context
+        if result.ok:
+            if cache_key:
+                deduplicator.remember(cache_key, result.target_path)
+            logger.debug("Verified output: %s %s", result.target_path, result.details)
+            emit({'event': 'verified', 'source': result.source_path, 'target': result.target_path, **result.details})
+            if delete_originals:
+                queue_delete(result.source_path, result.target_path, result.fingerprint)
+                if journal is None or journal.due():
+                    delete_written_originals()
+            return
+        logger.error("Output %s failed verification, original kept: %s", result.target_path, result.error)
+        emit({'event': 'verify-failed', 'source': result.source_path, 'target': result.target_path,
+              'error': str(result.error)})
+        # An output written by this run is redone by the next one. One from an earlier run
+        # may have been edited since, so it is left alone and only its original kept.
+        if journal and written:
+            journal.record(result.source_path, FAILED, result.target_path, f"output failed verification: {result.error}")
+
+    # Reports files discovered vs. converted, at most once a second to on_progress and
+    # every PROGRESS_LOG_SECONDS to the log
+    def report_progress(final=False):
+        now = time.monotonic()
+        with pending_lock:
+            call_back = on_progress and (final or now - progress_times['callback'] >= 1.0)
+            log = final or now - progress_times['log'] >= PROGRESS_LOG_SECONDS
+            if call_back:
+                progress_times['callback'] = now
+            if log:
+                progress_times['log'] = now
+        converted = pool.converted + totals['deduplicated']
+        failed = pool.failed + totals['duplicates_failed']
+        if call_back:
+            on_progress(totals['discovered'], converted, failed, totals['skipped'], final)
+        if log:
+            logger.info("Progress: %d files discovered, %d converted (%d as copies of identical files), %d failed, %d skipped",
+                        totals['discovered'], converted, totals['deduplicated'], failed, totals['skipped'])
+
+    # Fails a file that never reaches the pool: a copy of a representative that failed, or
+    # a second source for an output another file of this run already converts to
+    def fail_duplicate(source_path, target_path, error):
+        with pending_lock:
+            totals['duplicates_failed'] += 1
+        logger.error("Error processing file %s: %s", source_path, error)
+        emit({'event': 'failed', 'source': source_path, 'error': str(error)})
+        if journal:
+            journal.record(source_path, FAILED, target_path, error)
+
+    # Gives a file the output of an identical one instead of converting it. Runs on the
+    # main thread for outputs that already exist and on the worker threads for files that
+    # waited for their representative's conversion.
+    def write_duplicate(source_path, target_path, output_path, cached):
+        if journal:
+            journal.record(source_path, CONVERTING, target_path)
+            journal.ensure_durable(source_path)
+        try:
+            materialise_output(output_path, target_path, source_path, dedup_mode)
+        except OSError as e:
+            fail_duplicate(source_path, target_path, e)
+            return
+        with pending_lock:
+            totals['deduplicated'] += 1
+            if cached:
+                totals['reused'] += 1
+        logger.info("Saved file as: %s (copy of %s, identical source%s)", target_path, output_path,
+                    ', from an earlier run' if cached else '')
+        emit({'event': 'deduplicated', 'source': source_path, 'target': target_path, 'copy_of': output_path,
+              'cached': cached})
+        if journal:
+            journal.record(source_path, WRITTEN, target_path)
+        output_ready(source_path, target_path)
+
+    # Runs on the worker thread just before the backend starts writing the output
+    def handle_start(source_path, target_path):
+        if journal:
+            journal.ensure_durable(source_path)
+            journal.record(source_path, CONVERTING, target_path)
+
+    # Runs on the worker threads, several at once. The copies for the files that waited on
+    # this one are made here, on the worker that converted it, with no lock held.
+    def handle_result(result):
+        if not result.ok:
+            logger.error("Error processing file %s: %s", result.source_path, result.error)
+            emit({'event': 'failed', 'source': result.source_path, 'error': str(result.error)})
+            if journal:
+                journal.record(result.source_path, FAILED, result.target_path, result.error)
+        else:
+            logger.info("Saved file as: %s (%.2fs)", result.target_path, result.seconds)
+            emit({'event': 'converted', 'source': result.source_path, 'target': result.target_path,
+                  'seconds': round(result.seconds, 3)})
+            if journal:
+                journal.record(result.source_path, WRITTEN, result.target_path)
+        followers, cache_key = deduplicator.finished(result.source_path, result.ok) if deduplicator else ([], None)
+        if result.ok:
+            output_ready(result.source_path, result.target_path, cache_key=cache_key)
+        for source_path, target_path in followers:
+            if result.ok:
+                write_duplicate(source_path, target_path, result.target_path, False)
+            else:
+                fail_duplicate(source_path, target_path,
+                               f"identical to {result.source_path}, which failed to convert: {result.error}")
+        if journal is None or journal.due():
+            delete_written_originals()
+        report_progress()
+
+    pool = ConversionPool(backend_factory(backend), workers=workers, on_result=handle_result, on_start=handle_start)
+    verification = VerificationPool(handle_verification, verify_workers) if verify and not dry_run else None
+    try:
+        if not dry_run:
+            pool.start()
+        # Files are submitted as the scan finds them; submit() blocks while the
+        # pool's queue is full, which also holds the scan back
+        for file_path, file_type in iter_detected_files(directory, cutoff_date, file_types, workers=scan_workers,
+                                                        index_path=index_path, on_event=handle_detection_event, sniff=sniff,
+                                                        sniff_cache_path=sniff_cache_path, sniff_extensions=sniff_extensions):
+            totals['discovered'] += 1
+            report_progress()
+            source_path = os.path.abspath(file_path)
+            target_path = target_path_for(file_path, file_type)
+
+            # Only the first source discovered for an output is converted, also across runs; a
+            # second one would overwrite it (or be skipped as converted) and could then be
+            # deleted as done. It is journalled as failed, so it is reported and its original kept.
+            if journal:
+                owner = journal.owner(source_path, target_path)
+            else:
+                owner = claimed_targets.setdefault(os.path.normcase(target_path), source_path)
+            if owner is not None and owner != source_path:
+                fail_duplicate(source_path, target_path, f"{owner} converts to the same output {target_path}")
+                continue
+
+            # Resume: skip files a previous (possibly interrupted) run already converted
+            skip, reason = already_converted(journal, source_path, target_path)
+            if skip:
+                totals['skipped'] += 1
+                logger.info("Skipping already converted file: %s (%s)", file_path, reason)
+                emit({'event': 'skipped', 'source': source_path, 'target': target_path, 'reason': reason})
+                if journal and reason != 'journal':
+                    journal.record(source_path, WRITTEN, target_path)
+                if delete_originals and not dry_run:
+                    output_ready(source_path, target_path, written=False)
+                continue
+
+            # Identical files are converted once; the others get a copy of that output
+            action, representative = deduplicator.plan(source_path, target_path) if deduplicator else (CONVERT, None)
+
+            if dry_run:
+                if action == CONVERT:
+                    logger.info("Would convert: %s -> %s", file_path, target_path)
+                    emit({'event': 'would-convert', 'source': source_path, 'target': target_path})
+                else:
+                    logger.info("Would copy: %s -> %s (identical to %s)", file_path, target_path,
+                                representative.source_path or representative.target_path)
+                    emit({'event': 'would-copy', 'source': source_path, 'target': target_path,
+                          'copy_of': representative.target_path})
+                continue
+
+            if action == COPY:
+                write_duplicate(source_path, target_path, representative.target_path, representative.source_path is None)
+                report_progress()
+                continue
+            if action != CONVERT:
+                logger.info("Waiting for identical file %s to convert: %s", representative.source_path, file_path)
+                if journal:
+                    journal.record(source_path, QUEUED, target_path)
+                continue
+
+            logger.info("Processing file: %s", file_path)
+            if journal:
+                journal.record(source_path, QUEUED, target_path)
+            pool.submit(source_path, target_path)
+    finally:
+        if not dry_run:
+            pool.close()
+        if verification:
+            verification.close()
+        delete_written_originals()
+        if journal:
+            journal.close()
+        if output_cache:
+            output_cache.close()
+        report_progress(final=True)
+
+    summary = {
+        'event': 'summary',
+        'discovered': totals['discovered'],
+        'converted': pool.converted,
+        'deduplicated': totals['deduplicated'],
+        'reused_from_earlier_runs': totals['reused'],
+        'failed': pool.failed + totals['duplicates_failed'],
+        'skipped': totals['skipped'],
+        'rejected': totals['rejected'],
+        'deleted': totals['deleted'],
+        'verified': verification.passed if verification else 0,
+        'invalid_outputs': verification.failed if verification else 0,
+        'files_per_second': round(pool.files_per_second(), 2),
+    }
+    if deduplicator:
+        logger.info("Deduplication: %d conversions saved by copying the output of an identical file "
+                    "(%d from earlier runs), %d files hashed", totals['deduplicated'], totals['reused'], deduplicator.hashed)
+    if verification:
+        logger.info("Verification: %d outputs passed, %d failed (originals kept)", verification.passed, verification.failed)
+    logger.info("Conversion completed. Total files checked: %d, Files converted: %d, Copies of identical files: %d, "
+                "Failed: %d, Skipped (already converted): %d, Rejected by content: %d, Originals deleted: %d, "
+                "Throughput: %.2f files/s", totals['discovered'], pool.converted, totals['deduplicated'],
+                pool.failed + totals['duplicates_failed'], totals['skipped'], totals['rejected'], totals['deleted'],
+                pool.files_per_second())
+    return summary
@@ -0,0 +1,179 @@
+# FileFlow command line, for scheduled and scripted runs.
+#
+#   python fileflow_cli.py check   D:\Shares\Finance D:\Shares\HR --days 60
+#   python fileflow_cli.py convert D:\Shares\Finance --workers 4 --backend libreoffice --delete-originals
+#   python fileflow_cli.py convert D:\Shares\Finance --dry-run
+#   python fileflow_cli.py report  --state failed
+#   python fileflow_cli.py gui
+#
+# Results are written as JSON lines (one object per file plus a final summary) to stdout
+# or --output, log messages go to stderr and the JSON-lines log file. Tk and Office are only
+# imported when the gui subcommand or the office backend actually needs them.
+import os
+import sys
+import json
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from scanner import DEFAULT_SCAN_WORKERS
+from scheduler import DEFAULT_CONVERSION_WORKERS
+from converters import BACKENDS, default_backend
+from journal import ConversionJournal
+from dedup import COPY_OUTPUT, HARDLINK_OUTPUT
+from verifier import DEFAULT_VERIFY_WORKERS
+import engine
+
+FILE_TYPES = {'doc': '.doc', 'xls': '.xls'}
+
+# Writes one JSON object per line; events arrive from the conversion worker threads too
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+
+# Function to turn --days / --since into the cutoff datetime. Without either, every file
+# counts as modified after the cutoff.
+def cutoff_from_args(args):
+    if args.since:
+        return datetime.strptime(args.since, '%Y-%m-%d')
+    if args.days is not None:
+        return datetime.now() - timedelta(days=args.days)
+    return datetime.fromtimestamp(0)
+
+def add_scan_arguments(parser):
+    parser.add_argument('roots', nargs='+', help='directories to scan')
+    parser.add_argument('--types', nargs='+', choices=sorted(FILE_TYPES), default=sorted(FILE_TYPES),
+                        help='legacy file types to look for (default: all)')
+    cutoff = parser.add_mutually_exclusive_group()
+    cutoff.add_argument('--days', type=int, help='only files modified in the last N days')
+    cutoff.add_argument('--since', help='only files modified after this date (YYYY-MM-DD)')
+    parser.add_argument('--scan-workers', type=int, default=DEFAULT_SCAN_WORKERS, help='directory scanning threads')
+    parser.add_argument('--index', nargs='?', const=engine.INDEX_FILE, metavar='PATH',
+                        help=f'use the incremental scan index (default path: {engine.INDEX_FILE})')
+    parser.add_argument('--no-sniff', action='store_true',
+                        help='trust the file extension instead of checking the first few KB of each file')
+    parser.add_argument('--sniff-extensions', nargs='+', default=[], metavar='EXT',
+                        help='also check files with these extensions (e.g. .tmp .dat) and include Word/Excel ones')
+    parser.add_argument('--sniff-cache', default=engine.SNIFF_CACHE_FILE, metavar='PATH',
+                        help='cache of content checks, keyed by path, size and modified time')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='fileflow', description='Check and convert legacy Microsoft Office files.')
+    parser.add_argument('--output', help='write JSON lines here instead of stdout')
+    parser.add_argument('--log-dir', default=engine.LOG_DIRECTORY, help='directory for the log file')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='console log level')
+    parser.add_argument('--file-log-level', default='DEBUG', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='log file level (JSON lines)')
+    parser.add_argument('--log-max-mb', type=int, default=engine.LOG_MAX_BYTES // (1024 * 1024),
+                        help='start a new log file after this many MB')
+    parser.add_argument('--log-rotate-when', choices=['H', 'midnight'],
+                        help='rotate the log file hourly or at midnight instead of by size')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    check = subparsers.add_parser('check', help='list legacy files that would be converted')
+    add_scan_arguments(check)
+
+    convert = subparsers.add_parser('convert', help='convert legacy files to .docx/.xlsx')
+    add_scan_arguments(convert)
+    convert.add_argument('--workers', type=int, default=DEFAULT_CONVERSION_WORKERS, help='conversion workers')
+    convert.add_argument('--backend', choices=sorted(BACKENDS), default=default_backend(), help='conversion backend')
+    convert.add_argument('--delete-originals', action='store_true', help='delete originals after conversion')
+    convert.add_argument('--dry-run', action='store_true', help='only report what would be converted')
+    convert.add_argument('--no-dedup', action='store_true',
+                         help='convert every file, even when it is byte-identical to another one')
+    convert.add_argument('--dedup-cache', default=engine.DEDUP_CACHE_FILE, metavar='PATH',
+                         help='cache of converted outputs by content hash, reused by later runs')
+    convert.add_argument('--hardlink-duplicates', action='store_true',
+                         help='hard link the outputs of identical files instead of copying them')
+    convert.add_argument('--no-verify', action='store_true',
+                         help='do not check the outputs before originals are deleted (not recommended)')
+    convert.add_argument('--verify-workers', type=int, default=DEFAULT_VERIFY_WORKERS, help='output verification threads')
+    journal = convert.add_mutually_exclusive_group()
+    journal.add_argument('--journal', default=engine.JOURNAL_FILE, help='conversion journal used to resume runs')
+    journal.add_argument('--no-journal', action='store_true', help='do not record or resume from a journal')
+
+    report = subparsers.add_parser('report', help='report conversion states from the journal')
+    report.add_argument('--journal', default=engine.JOURNAL_FILE, help='conversion journal to read')
+    report.add_argument('--state', help='only list jobs in this state (e.g. failed)')
+    report.add_argument('--summary-only', action='store_true', help='only print the per-state counts')
+
+    subparsers.add_parser('gui', help='start the FileFlow window')
+    return parser
+
+# Function to turn the sniffing options into iter_detected_files keyword arguments
+def sniff_options(args):
+    extensions = [ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in args.sniff_extensions]
+    return {'sniff': not args.no_sniff, 'sniff_cache_path': args.sniff_cache, 'sniff_extensions': extensions}
+
+def run_check(args, emit):
+    cutoff_date = cutoff_from_args(args)
+    file_types = [FILE_TYPES[t] for t in args.types]
+    detected = 0
+    for _ in engine.iter_detected_files(args.roots, cutoff_date, file_types, workers=args.scan_workers,
+                                        index_path=args.index, on_event=emit, **sniff_options(args)):
+        detected += 1
+    emit({'event': 'summary', 'detected': detected})
+    return 0
+
+def run_convert(args, emit):
+    summary = engine.convert_files(
+        args.roots, cutoff_from_args(args), workers=args.workers, file_types=[FILE_TYPES[t] for t in args.types],
+        delete_originals=args.delete_originals, index_path=args.index, backend=args.backend,
+        journal_path=None if args.no_journal else args.journal, on_event=emit,
+        scan_workers=args.scan_workers, dry_run=args.dry_run, dedup=not args.no_dedup, dedup_cache_path=args.dedup_cache,
+        dedup_mode=HARDLINK_OUTPUT if args.hardlink_duplicates else COPY_OUTPUT, verify=not args.no_verify,
+        verify_workers=args.verify_workers, **sniff_options(args))
+    emit(summary)
+    return 1 if summary['failed'] or summary['invalid_outputs'] else 0
+
+def run_report(args, emit):
+    if not os.path.exists(args.journal):
+        logging.getLogger().error("No conversion journal found at %s", args.journal)
+        return 1
+    with ConversionJournal(args.journal) as journal:
+        if not args.summary_only:
+            for job in journal.iter_jobs(args.state):
+                emit(dict(event='job', **job))
+        emit({'event': 'summary', 'states': journal.counts()})
+    return 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'gui':
+        # Only the GUI needs Tk/customtkinter
+        from FileFlow import Application
+        Application().mainloop()
+        return 0
+
+    label = args.command.capitalize()
+    engine.configure_logging(getattr(args, 'roots', None), f' - {label}', console_level=args.log_level,
+                             log_directory=args.log_dir, file_level=args.file_log_level,
+                             max_bytes=args.log_max_mb * 1024 * 1024, rotate_when=args.log_rotate_when)
+
+    stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        emit = JsonLinesWriter(stream)
+        if args.command == 'check':
+            return run_check(args, emit)
+        if args.command == 'convert':
+            return run_convert(args, emit)
+        return run_report(args, emit)
+    finally:
+        if args.output:
+            stream.close()
+        else:
+            stream.flush()
+        # Write out log records still queued for the listener thread
+        engine.stop_logging()
+
+if __name__ == '__main__':
+    sys.exit(main())
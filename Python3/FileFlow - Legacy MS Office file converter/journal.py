@@ -0,0 +1,168 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Job states, in the order a file moves through them
+QUEUED = 'queued'
+CONVERTING = 'converting'
+WRITTEN = 'written'
+DELETED = 'original-deleted'
+FAILED = 'failed'
+
+# Targets are compared the way the file system does: without case on Windows
+TARGET_COLLATE = ' COLLATE NOCASE' if os.name == 'nt' else ''
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    source TEXT PRIMARY KEY,
+    target TEXT NOT NULL,
+    state TEXT NOT NULL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_target ON jobs (target""" + TARGET_COLLATE + """);
+"""
+
+# Write-ahead journal of conversion jobs, stored in SQLite.
+#
+# Every file is recorded as queued -> converting -> written -> original-deleted (or failed).
+# Records are buffered and committed in groups to keep the journal off the critical path,
+# with two rules that make it crash safe:
+#   - ensure_durable() is called before a backend starts writing a target, so a target
+#     without a committed record can never be a half-written leftover
+#   - originals are only deleted after their 'written' record has been committed, so a
+#     deleted original is never lost track of
+class ConversionJournal:
+    def __init__(self, journal_path, group_size=500, group_interval=1.0):
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self.journal_path = journal_path
+        self.connection = sqlite3.connect(journal_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.pending = []
+        # Latest (state, target) of records not committed yet; everything else is read
+        # back from the database, so memory does not grow with the number of files
+        self.uncommitted = {}
+        # Source of each target held by an uncommitted record, for owner()
+        self.uncommitted_targets = {}
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.last_commit = time.monotonic()
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    # Function to look up the last recorded (state, target) for a source, or None
+    def entry(self, source_path):
+        with self.lock:
+            if source_path in self.uncommitted:
+                return self.uncommitted[source_path]
+            return self.connection.execute('SELECT state, target FROM jobs WHERE source = ?', (source_path,)).fetchone()
+
+    # Function to find the source that holds target_path, in this run or an earlier one:
+    # another source whose last record is for that target and did not fail. Returns it, or
+    # None when the target is free for source_path.
+    def owner(self, source_path, target_path):
+        claim = os.path.normcase(target_path)
+        with self.lock:
+            owner = self.uncommitted_targets.get(claim)
+            if owner is not None and owner != source_path:
+                return owner
+            rows = self.connection.execute('SELECT source FROM jobs WHERE target = ?' + TARGET_COLLATE +
+                                           ' AND source != ? AND state != ?', (target_path, source_path, FAILED))
+            for (other,) in rows:
+                # A record not committed yet may have failed the other source since
+                state, other_target = self.uncommitted.get(other, (None, target_path))
+                if state != FAILED and os.path.normcase(other_target) == claim:
+                    return other
+        return None
+
+    def record(self, source_path, state, target_path, error=None):
+        with self.lock:
+            self.pending.append((source_path, target_path, state, str(error) if error else None,
+                                 1 if state == CONVERTING else 0, time.time()))
+            self.uncommitted[source_path] = (state, target_path)
+            claim = os.path.normcase(target_path)
+            if state != FAILED:
+                self.uncommitted_targets[claim] = source_path
+            elif self.uncommitted_targets.get(claim) == source_path:
+                del self.uncommitted_targets[claim]
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            with self.connection:
+                self.connection.executemany(
+                    """INSERT INTO jobs (source, target, state, error, attempts, updated) VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (source) DO UPDATE SET target = excluded.target, state = excluded.state,
+                       error = excluded.error, attempts = attempts + excluded.attempts, updated = excluded.updated""",
+                    self.pending)
+            self.pending = []
+            self.uncommitted.clear()
+            self.uncommitted_targets.clear()
+            self.last_commit = time.monotonic()
+            self.commits += 1
+
+    # Function to make sure the record for source_path is on disk, committing the whole
+    # buffered group if it is not
+    def ensure_durable(self, source_path):
+        if source_path in self.uncommitted:
+            self.flush()
+
+    # Function to tell the caller a group commit is due: enough records are buffered,
+    # or the oldest buffered record has waited long enough
+    def due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.group_size or time.monotonic() - self.last_commit >= self.group_interval
+
+    # Function to stream every job as a dict, optionally only those in one state
+    def iter_jobs(self, state=None):
+        self.flush()
+        query = 'SELECT source, target, state, error, attempts, updated FROM jobs'
+        params = ()
+        if state:
+            query += ' WHERE state = ?'
+            params = (state,)
+        for source, target, job_state, error, attempts, updated in self.connection.execute(query + ' ORDER BY source', params):
+            yield {'source': source, 'target': target, 'state': job_state, 'error': error,
+                   'attempts': attempts, 'updated': updated}
+
+    # Function to count jobs per state
+    def counts(self):
+        self.flush()
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall())
+
+# Function to decide whether a detected file still needs converting.
+# Returns (skip, reason). A target is trusted when the journal says it was written, or
+# when there is no journal record and the target is newer than the source; a target
+# left behind by a failed conversion or a run that stopped mid-conversion is always redone.
+def already_converted(journal, source_path, target_path):
+    entry = journal.entry(source_path) if journal else None
+    if entry and entry[0] in (QUEUED, CONVERTING, FAILED):
+        return False, 'interrupted' if entry[0] != FAILED else 'failed before'
+    try:
+        target_mtime = os.stat(target_path).st_mtime
+    except OSError:
+        return False, 'no output'
+    if target_mtime < os.stat(source_path).st_mtime:
+        return False, 'source changed'
+    if entry and entry[0] in (WRITTEN, DELETED):
+        return True, 'journal'
+    return True, 'output newer than source'
@@ -0,0 +1,105 @@
+import json
+import time
+import atexit
+import queue
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else on a record came in through extra={...}
+# and is written to the JSON log as its own field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+# Listener of the current run, stopped (and its queue drained) by stop_logging()
+current_listener = None
+listener_lock = threading.Lock()
+
+# Formatter for the log file: one compact JSON object per line, e.g.
+#   {"time":"2024-07-21 10:15:02.113","level":"INFO","logger":"engine","thread":"scan_0","msg":"Detected file: ..."}
+class JsonLinesFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        # Records arrive in bursts, so the date/time part is only formatted once a second
+        self.cached_second = None
+        self.cached_time = ''
+
+    def format(self, record):
+        second = int(record.created)
+        if second != self.cached_second:
+            self.cached_second = second
+            self.cached_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+        entry = {
+            'time': f'{self.cached_time}.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        for key in record.__dict__.keys() - RECORD_ATTRIBUTES:
+            if not key.startswith('_'):
+                entry[key] = record.__dict__[key]
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False, separators=(',', ':'))
+
+# QueueHandler that leaves formatting to the listener thread.
+# The standard prepare() merges msg % args (and renders tracebacks) on the logging
+# thread; here the record is queued as it is, so a scan or conversion thread only pays
+# for creating the record. Our log calls pass strings and numbers as arguments, which
+# are safe to format later on another thread.
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+# Function to route the root logger through a queue: the root logger only gets a
+# DeferredQueueHandler and a background QueueListener thread formats and writes the
+# records to the given handlers (each keeps its own level).
+# The root level is set to the lowest handler level, so records no handler wants (e.g.
+# per-file DEBUG lines when every handler is at INFO) are never even created.
+def start_logging(handlers):
+    global current_listener
+    stop_logging()
+
+    level = min((handler.level or logging.DEBUG for handler in handlers), default=logging.WARNING)
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.setLevel(level)
+    root.addHandler(DeferredQueueHandler(log_queue))
+
+    with listener_lock:
+        current_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        current_listener.start()
+    return current_listener
+
+# Function to write out everything still queued and close the handlers.
+# Called before the next run reconfigures logging and when the program exits.
+def stop_logging():
+    global current_listener
+    with listener_lock:
+        listener = current_listener
+        current_listener = None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in listener.handlers:
+        try:
+            handler.flush()
+            handler.close()
+        except Exception:
+            pass
+
+atexit.register(stop_logging)
+
+# Thread-safe counter for sampling high-volume debug records: should_log() is True for
+# the first call and then for every Nth call after it.
+class LogSampler:
+    def __init__(self, every):
+        self.every = max(1, every)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def should_log(self):
+        with self.lock:
+            self.count += 1
+            return (self.count - 1) % self.every == 0
@@ -0,0 +1,102 @@
+import logging
+import threading
+from collections import deque
+
+# Colours for each log level in the window
+LEVEL_TAGS = {
+    'DEBUG': {'foreground': 'cyan'},
+    'INFO': {'foreground': 'green'},
+    'WARNING': {'foreground': 'yellow'},
+    'ERROR': {'foreground': 'red'},
+    'CRITICAL': {'foreground': 'red', 'font': ('Helvetica', '12', 'bold')},
+}
+
+# Logging handler that shows log records in a Tk Text widget without flooding the Tk
+# main loop.
+#
+# emit() runs on the scan and conversion threads and only appends the record to a ring
+# of the last max_lines records; it never touches Tk. Every interval_ms the main loop
+# drains the ring, formats what is left and inserts it with a single Text.insert call,
+# then trims the widget back to about the last max_lines entries. Records below the
+# handler's level are dropped by logging before emit(), and records pushed out of the
+# ring are never formatted at all, so a 500k-file scan costs the window one insert
+# per tick.
+class TextWidgetSink(logging.Handler):
+    def __init__(self, text_widget, root, max_lines=5000, interval_ms=100, level=logging.INFO):
+        super().__init__(level)
+        self.text_widget = text_widget
+        self.root = root
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        self.records = deque(maxlen=max_lines)
+        self.records_lock = threading.Lock()
+        self.dropped = 0
+        self.running = False
+
+        for level_name, options in LEVEL_TAGS.items():
+            self.text_widget.tag_configure(level_name, **options)
+
+    def emit(self, record):
+        with self.records_lock:
+            if len(self.records) == self.max_lines:
+                self.dropped += 1
+            self.records.append(record)
+
+    # Start draining on the Tk main loop; call from the main thread
+    def start(self):
+        if not self.running:
+            self.running = True
+            self.root.after(self.interval_ms, self.drain)
+
+    def stop(self):
+        self.running = False
+
+    # Function to empty the window, e.g. before a new run
+    def clear(self):
+        with self.records_lock:
+            self.records.clear()
+            self.dropped = 0
+        self.text_widget.configure(state='normal')
+        self.text_widget.delete('1.0', 'end')
+        self.text_widget.configure(state='disabled')
+
+    # Function to move everything queued since the last tick into the widget.
+    # Runs on the Tk main loop and reschedules itself while the sink is running.
+    def drain(self):
+        try:
+            self.flush_to_widget()
+        except Exception:
+            # A formatting or Tk error must not stop the window from updating
+            logging.getLogger(__name__).debug("Log window update failed", exc_info=True)
+        if self.running:
+            self.root.after(self.interval_ms, self.drain)
+
+    def flush_to_widget(self):
+        with self.records_lock:
+            if not self.records:
+                return
+            records = list(self.records)
+            self.records.clear()
+            dropped = self.dropped
+            self.dropped = 0
+
+        # Text.insert takes text/tag pairs, so the whole batch goes in with one call
+        chunks = []
+        if dropped:
+            chunks += [f"... {dropped} earlier log lines not shown here, see the log file ...\n\n", 'WARNING']
+        for record in records:
+            chunks += [self.format(record) + '\n\n', record.levelname]
+
+        # Only follow the end of the log if the user has not scrolled up to read something
+        at_bottom = self.text_widget.yview()[1] >= 0.999
+        self.text_widget.configure(state='normal')
+        self.text_widget.insert('end', *chunks)
+        # Every entry is followed by a blank line, so max_lines entries (plus the 'not
+        # shown' notice) take about twice as many lines; the last line is always empty
+        line_count = int(self.text_widget.index('end-1c').split('.')[0]) - 1
+        excess = line_count - (self.max_lines + 1) * 2
+        if excess > 0:
+            self.text_widget.delete('1.0', f'{excess + 1}.0')
+        self.text_widget.configure(state='disabled')
+        if at_bottom:
+            self.text_widget.yview('end')
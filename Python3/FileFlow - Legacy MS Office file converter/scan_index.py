@@ -0,0 +1,252 @@
+import os
+import time
+import sqlite3
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from scanner import DEFAULT_SCAN_WORKERS, normalise_file_types, cutoff_timestamp
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = '1'
+
+# A directory whose mtime is this close to the scan start may still be changing
+# (and FAT/SMB only keep 2 second mtimes), so it is stored as dirty and re-listed next run
+MTIME_SETTLE_SECONDS = 2.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL NOT NULL,
+    file_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    extension TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+"""
+
+# Outcome of an indexed scan. matches holds every indexed file newer than the cutoff
+# (the same list a full scan returns); added/modified/deleted only hold the changes
+# since the previous run.
+class IndexedScanResult:
+    def __init__(self):
+        self.matches = []
+        self.added = []
+        self.modified = []
+        self.deleted = []
+        self.files_checked = 0
+        self.directories_scanned = 0
+        self.directories_skipped = 0
+        self.errors = 0
+
+# Function to check whether path is root or lives underneath it
+def is_under(path, root):
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+# Function to list a directory whose mtime changed.
+# Returns (subdirectories, {path: (size, mtime, extension)}, number of files seen, errors).
+# Failing to list the directory itself raises OSError.
+def index_directory(path, suffixes):
+    subdirectories = []
+    entries = {}
+    files_checked = 0
+    errors = 0
+
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirectories.append(entry.path)
+                    continue
+
+                files_checked += 1
+                name = entry.name.lower()
+                if not name.endswith(suffixes):
+                    continue
+                st = entry.stat()
+                entries[entry.path] = (st.st_size, st.st_mtime, os.path.splitext(name)[1])
+            except OSError as e:
+                errors += 1
+                logger.warning("Unable to read %s: %s", entry.path, e)
+
+    return subdirectories, entries, files_checked, errors
+
+# Function run on the scanner threads: stat the directory and only list it when its
+# mtime differs from the one stored in the index
+def visit_directory(path, known_mtime, suffixes):
+    try:
+        mtime = os.stat(path).st_mtime
+        if known_mtime is not None and mtime == known_mtime:
+            return path, mtime, None
+        return path, mtime, index_directory(path, suffixes)
+    except FileNotFoundError:
+        return path, None, None
+    except OSError as e:
+        logger.warning("Unable to read directory %s: %s", path, e)
+        return path, None, e
+
+# On-disk index of the last scan, stored in SQLite.
+# Directory mtimes tell us which folders had entries added, removed or renamed since the
+# last run; only those are listed again, unchanged folders are served from the index.
+# Note: editing a file in place does not touch its folder's mtime, use full=True
+# (or delete the index file) to pick those up.
+class ScanIndex:
+    def __init__(self, index_path):
+        directory = os.path.dirname(os.path.abspath(index_path))
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = index_path
+        self.connection = sqlite3.connect(index_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # The index only holds files of the scanned types, so a different set of types
+    # means starting again from an empty index
+    def check_file_types(self, suffixes):
+        wanted = ','.join(sorted(suffixes))
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'file_types'").fetchone()
+        version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row and row[0] == wanted and version and version[0] == INDEX_VERSION:
+            return
+        if row:
+            logger.info("Scan index file types changed from %s to %s, rebuilding index", row[0], wanted)
+        with self.connection:
+            self.connection.execute('DELETE FROM directories')
+            self.connection.execute('DELETE FROM files')
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('file_types', ?)", (wanted,))
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (INDEX_VERSION,))
+
+    def load_directories(self, roots):
+        directories = {}
+        children = {}
+        for path, parent, mtime, file_count in self.connection.execute(
+                'SELECT path, parent, mtime, file_count FROM directories'):
+            if not any(is_under(path, root) for root in roots):
+                continue
+            directories[path] = (mtime, file_count)
+            children.setdefault(parent, []).append(path)
+        return directories, children
+
+    def files_in(self, directory):
+        return {path: (size, mtime, extension) for path, size, mtime, extension in self.connection.execute(
+            'SELECT path, size, mtime, extension FROM files WHERE directory = ?', (directory,))}
+
+    # Function to stream indexed files newer than the cutoff, in path order, straight
+    # from the database
+    def iter_matches(self, roots, cutoff_ts):
+        for root in roots:
+            prefix = root.rstrip(os.sep) + os.sep
+            for (path,) in self.connection.execute(
+                    'SELECT path FROM files WHERE mtime > ? AND substr(path, 1, ?) = ? ORDER BY path',
+                    (cutoff_ts, len(prefix), prefix)):
+                yield path
+
+    # Function to bring the index up to date for the given roots and report what changed.
+    # full=True ignores stored directory mtimes and lists every folder again.
+    # collect_matches=False leaves result.matches empty for callers that stream them
+    # with iter_matches() instead.
+    def scan(self, roots, cutoff_date, file_types, workers=DEFAULT_SCAN_WORKERS, full=False, collect_matches=True):
+        if isinstance(roots, (str, os.PathLike)):
+            roots = [roots]
+        roots = [os.path.abspath(root) for root in roots]
+        suffixes = normalise_file_types(file_types)
+        self.check_file_types(suffixes)
+
+        result = IndexedScanResult()
+        scan_started = time.time()
+        known, children = self.load_directories(roots)
+        visited = set()
+        directory_rows = []
+
+        def handle(outcome, parent):
+            path, mtime, listing = outcome
+            if mtime is None:
+                # An unreadable folder keeps its previous entries rather than being
+                # reported as deleted; a missing one is cleaned up below
+                if listing is not None:
+                    result.errors += 1
+                    visited.update(known_path for known_path in known if is_under(known_path, path))
+                return []
+            visited.add(path)
+            stored_mtime = mtime if scan_started - mtime > MTIME_SETTLE_SECONDS else -1.0
+
+            if listing is None:
+                result.directories_skipped += 1
+                result.files_checked += known[path][1]
+                return children.get(path, [])
+
+            subdirectories, entries, files_checked, errors = listing
+            result.directories_scanned += 1
+            result.files_checked += files_checked
+            result.errors += errors
+            directory_rows.append((path, parent, stored_mtime, files_checked))
+
+            previous = self.files_in(path) if path in known else {}
+            for file_path, entry in entries.items():
+                old = previous.pop(file_path, None)
+                if old is None:
+                    result.added.append(file_path)
+                elif old[0] != entry[0] or old[1] != entry[1]:
+                    result.modified.append(file_path)
+                else:
+                    continue
+                self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                                        (file_path, path, entry[0], entry[1], entry[2]))
+            for file_path in previous:
+                result.deleted.append(file_path)
+                self.connection.execute('DELETE FROM files WHERE path = ?', (file_path,))
+            return subdirectories
+
+        def known_mtime(path):
+            if full or path not in known:
+                return None
+            return known[path][0]
+
+        # The whole scan is one transaction so the index is never left half updated
+        with self.connection:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='index') as pool:
+                pending = [(pool.submit(visit_directory, root, known_mtime(root), suffixes), None) for root in roots]
+                while pending:
+                    future, parent = pending.pop()
+                    outcome = future.result()
+                    for subdirectory in handle(outcome, parent):
+                        pending.append((pool.submit(visit_directory, subdirectory, known_mtime(subdirectory), suffixes),
+                                        outcome[0]))
+
+            for path, parent, mtime, file_count in directory_rows:
+                self.connection.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)',
+                                        (path, parent, mtime, file_count))
+
+            # Folders in the index that were not reached this time have been removed
+            for path in set(known) - visited:
+                for file_path in self.files_in(path):
+                    result.deleted.append(file_path)
+                self.connection.execute('DELETE FROM files WHERE directory = ?', (path,))
+                self.connection.execute('DELETE FROM directories WHERE path = ?', (path,))
+
+        if collect_matches:
+            result.matches = sorted(self.iter_matches(roots, cutoff_timestamp(cutoff_date)))
+        result.added.sort()
+        result.modified.sort()
+        result.deleted.sort()
+        return result
@@ -0,0 +1,136 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from log_pipeline import LogSampler
+
+logger = logging.getLogger(__name__)
+
+# At DEBUG level each directory gets one summary line; the individual skipped files are
+# only logged one in DEBUG_SAMPLE_EVERY, a million-file scan would otherwise write a
+# million debug lines
+DEBUG_SAMPLE_EVERY = 1000
+skipped_file_sampler = LogSampler(DEBUG_SAMPLE_EVERY)
+
+# Default number of scanner threads. Directory listing is I/O bound (especially on
+# network shares) so we use more threads than cores, capped like ThreadPoolExecutor
+DEFAULT_SCAN_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Holds the outcome of a scan: matching paths plus counters for the summary log line
+class ScanResult:
+    def __init__(self):
+        self.matches = []
+        self.files_checked = 0
+        self.directories_scanned = 0
+        self.errors = 0
+
+# Function to turn ['.xls', '.doc'] into a lowercase tuple usable with str.endswith
+def normalise_file_types(file_types):
+    return tuple(ft.lower() for ft in file_types)
+
+# Function to convert the cutoff datetime into an epoch float once, so each file only
+# needs a float comparison instead of building a datetime object
+def cutoff_timestamp(cutoff_date):
+    if cutoff_date is None:
+        return float('-inf')
+    return cutoff_date.timestamp()
+
+# Function to list a single directory.
+# Returns (subdirectories, matching files, number of files seen, number of errors).
+# The extension is checked before stat() is called, and on Windows DirEntry.stat()
+# is served from the directory listing so matching files cost no extra syscall either.
+# With with_stats each match is a (path, stat result) pair instead of a path.
+def scan_directory(path, suffixes, cutoff_ts, with_stats=False):
+    subdirectories = []
+    matches = []
+    files_checked = 0
+    errors = 0
+    other_types = 0
+    before_cutoff = 0
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    # Same rules as os.walk: symlinked directories are listed as
+                    # directories but not followed
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            subdirectories.append(entry.path)
+                        continue
+
+                    files_checked += 1
+                    if not entry.name.lower().endswith(suffixes):
+                        other_types += 1
+                        if debug and skipped_file_sampler.should_log():
+                            logger.debug("File %s does not match the file types %s (sampled)", entry.path, suffixes)
+                        continue
+
+                    stat = entry.stat()
+                    if stat.st_mtime > cutoff_ts:
+                        matches.append((entry.path, stat) if with_stats else entry.path)
+                    else:
+                        before_cutoff += 1
+                        if debug and skipped_file_sampler.should_log():
+                            logger.debug("File %s skipped, last modified before cutoff (sampled)", entry.path)
+                except OSError as e:
+                    errors += 1
+                    logger.warning("Unable to read %s: %s", entry.path, e)
+    except OSError as e:
+        errors += 1
+        logger.warning("Unable to list directory %s: %s", path, e)
+
+    if debug:
+        logger.debug("Listed %s: %d files, %d matched, %d other types, %d before cutoff",
+                     path, files_checked, len(matches), other_types, before_cutoff)
+
+    return subdirectories, matches, files_checked, errors
+
+# Function to stream matching files from one or more directory trees as soon as each
+# directory has been listed. Each directory is listed as its own task so large subtrees
+# are spread across the thread pool; only a bounded number of directory listings are in
+# flight, so memory stays flat however big the tree is and however slowly the caller
+# consumes the results. Counters are kept on stats (a ScanResult) if one is passed in.
+# workers <= 1 scans on the calling thread. with_stats yields (path, stat result) pairs,
+# for callers that need the size as well, without another stat() per file.
+def iter_files(roots, cutoff_date, file_types, workers=DEFAULT_SCAN_WORKERS, stats=None, with_stats=False):
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+
+    suffixes = normalise_file_types(file_types)
+    cutoff_ts = cutoff_timestamp(cutoff_date)
+    stats = stats if stats is not None else ScanResult()
+
+    def record(outcome):
+        subdirectories, matches, files_checked, errors = outcome
+        stats.directories_scanned += 1
+        stats.files_checked += files_checked
+        stats.errors += errors
+        return subdirectories, matches
+
+    waiting = list(roots)
+    if workers <= 1:
+        while waiting:
+            subdirectories, matches = record(scan_directory(waiting.pop(), suffixes, cutoff_ts, with_stats))
+            waiting.extend(subdirectories)
+            yield from matches
+        return
+
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan') as pool:
+        in_flight = deque()
+        while waiting or in_flight:
+            while waiting and len(in_flight) < max_in_flight:
+                in_flight.append(pool.submit(scan_directory, waiting.pop(), suffixes, cutoff_ts, with_stats))
+            subdirectories, matches = record(in_flight.popleft().result())
+            waiting.extend(subdirectories)
+            yield from matches
+
+# Function to scan one or more directory trees for files of the given types modified
+# after the cutoff date, returning every match at once
+def scan_files(roots, cutoff_date, file_types, workers=DEFAULT_SCAN_WORKERS):
+    result = ScanResult()
+    # Completion order depends on thread timing, sort so results are repeatable
+    result.matches = sorted(iter_files(roots, cutoff_date, file_types, workers=workers, stats=result))
+    return result
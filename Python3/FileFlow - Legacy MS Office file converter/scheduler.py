@@ -0,0 +1,245 @@
+import os
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Each worker runs its own Office (or other backend) instance, which is memory hungry,
+# so stay at or below the core count
+DEFAULT_CONVERSION_WORKERS = min(4, os.cpu_count() or 1)
+
+# Outcome of converting one file, passed to the pool's on_result callback
+class ConversionResult:
+    def __init__(self, source_path, target_path, error=None, seconds=0.0, worker=None):
+        self.source_path = source_path
+        self.target_path = target_path
+        self.error = error
+        self.seconds = seconds
+        self.worker = worker
+
+    @property
+    def ok(self):
+        return self.error is None
+
+# Adaptive concurrency limit shared by the workers (additive increase, multiplicative
+# decrease). Every success lets one more conversion run at once, up to the number of
+# workers. A failure, or a conversion much slower than the recent average, halves the
+# limit. Office backs off when it is overloaded instead of piling up "server busy" errors.
+class AdaptiveLimiter:
+    def __init__(self, max_limit, min_limit=1, slow_factor=4.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.slow_factor = slow_factor
+        self.limit = float(max_limit)
+        self.active = 0
+        self.average_seconds = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, success, seconds):
+        with self.condition:
+            self.active -= 1
+            slow = self.average_seconds is not None and seconds > self.average_seconds * self.slow_factor
+            if success and not slow:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.min_limit, self.limit / 2)
+            if success:
+                # Exponentially weighted moving average of successful conversion times
+                if self.average_seconds is None:
+                    self.average_seconds = seconds
+                else:
+                    self.average_seconds += 0.2 * (seconds - self.average_seconds)
+            self.condition.notify_all()
+
+# Pool of conversion workers fed from a bounded queue.
+# on_start(source, target) is called on the worker thread just before a file is handed to
+# the backend, on_result(result) on the same thread once it is finished. on_result runs
+# without the pool's lock held, so several workers may be in it at once, and slow work
+# there (copying outputs, queueing them for verification) only holds up its own worker.
+# submit() blocks while the queue is full, so detection can never run far ahead of
+# conversion. Each worker builds its own backend with backend_factory() and takes up to
+# backend.batch_size files at a time. A backend that fails its health check, or fails
+# restart_after batches in a row, is closed and opened again, and a failing worker waits
+# an exponentially growing backoff before taking the next batch.
+class ConversionPool:
+    def __init__(self, backend_factory, workers=DEFAULT_CONVERSION_WORKERS, queue_size=None, on_result=None,
+                 on_start=None, restart_after=3, backoff=0.5, max_backoff=30.0):
+        self.backend_factory = backend_factory
+        self.workers = max(1, workers)
+        # Deep enough for batching backends to fill a batch, small enough to keep memory flat
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 32)
+        self.on_result = on_result
+        self.on_start = on_start
+        self.restart_after = restart_after
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.limiter = AdaptiveLimiter(self.workers)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.alive_workers = 0
+        self.last_error = None
+        self.submitted = 0
+        self.converted = 0
+        self.failed = 0
+        self.started_at = None
+        self.finished_at = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.alive_workers = self.workers
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run_worker, args=(index,), name=f'convert-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue a file, blocking while the queue is full
+    def submit(self, source_path, target_path):
+        if not self.put((source_path, target_path)):
+            raise RuntimeError(f"No conversion workers are running: {self.last_error}")
+        self.submitted += 1
+
+    # Wait for every queued file to finish and stop the workers
+    def close(self):
+        for _ in self.threads:
+            self.put(None)
+        for thread in self.threads:
+            thread.join()
+        # If every worker died, whatever is still queued is reported as failed
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                self.record(ConversionResult(job[0], job[1], error=self.last_error))
+        self.finished_at = time.perf_counter()
+
+    def files_per_second(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return (self.converted + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def put(self, item):
+        while True:
+            if self.alive_workers == 0:
+                return False
+            try:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+
+    def record(self, result):
+        with self.lock:
+            if result.ok:
+                self.converted += 1
+            else:
+                self.failed += 1
+        if self.on_result:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logger.error("Error handling result for %s: %s", result.source_path, e)
+
+    def open_backend(self, index):
+        backend = self.backend_factory()
+        try:
+            backend.open()
+        except Exception as e:
+            logger.error("Conversion worker %d could not start its %s backend: %s", index, backend.name, e)
+            self.last_error = e
+            try:
+                backend.close()
+            except Exception:
+                pass
+            return None
+        return backend
+
+    # Function to take the next batch of jobs off the queue: waits for the first one, then
+    # adds whatever is already queued up to the backend's batch size.
+    # Returns (jobs, stop) where stop is True once the close() sentinel was seen.
+    def next_batch(self, batch_size):
+        job = self.queue.get()
+        if job is None:
+            return [], True
+        jobs = [job]
+        while len(jobs) < batch_size:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def restart_backend(self, index, backend, reason):
+        logger.warning("Conversion worker %d restarting its %s backend: %s", index, backend.name, reason)
+        try:
+            backend.close()
+        except Exception as e:
+            logger.warning("Error closing %s backend: %s", backend.name, e)
+        return self.open_backend(index)
+
+    def run_worker(self, index):
+        backend = self.open_backend(index)
+        consecutive_failures = 0
+        stop = False
+        try:
+            while backend is not None and not stop:
+                jobs, stop = self.next_batch(max(1, backend.batch_size))
+                if not jobs:
+                    break
+
+                if self.on_start:
+                    for source_path, target_path in jobs:
+                        self.on_start(source_path, target_path)
+
+                self.limiter.acquire()
+                started = time.perf_counter()
+                try:
+                    errors = backend.convert_batch(jobs)
+                except Exception as e:
+                    errors = [e] * len(jobs)
+                seconds = (time.perf_counter() - started) / len(jobs)
+                failures = sum(1 for error in errors if error is not None)
+                self.limiter.release(failures == 0, seconds)
+                for (source_path, target_path), error in zip(jobs, errors):
+                    self.record(ConversionResult(source_path, target_path, error, seconds, index))
+
+                if failures == 0:
+                    consecutive_failures = 0
+                    continue
+
+                # A failed file is often just a bad file, so the backend is only restarted
+                # when it fails its health check or keeps failing
+                consecutive_failures += 1
+                if not backend.health_check():
+                    backend = self.restart_backend(index, backend, "health check failed")
+                elif consecutive_failures % self.restart_after == 0:
+                    backend = self.restart_backend(index, backend, f"{consecutive_failures} failures in a row")
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** (consecutive_failures - 1)))
+        finally:
+            if backend is not None:
+                try:
+                    backend.close()
+                except Exception as e:
+                    logger.warning("Error closing %s backend: %s", backend.name, e)
+            with self.lock:
+                self.alive_workers -= 1
@@ -0,0 +1,237 @@
+import os
+import struct
+import sqlite3
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# What a file's first few KB say it is. Word and Excel 97-2003 files are reported as the
+# legacy extension they convert from, so a kind can be used wherever a file type is.
+DOC = '.doc'               # Word 97-2003 (or Word 6/95) binary, or RTF saved as .doc
+XLS = '.xls'               # Excel 97-2003 BIFF8 (or Excel 5/95 BIFF5) workbook
+OOXML = 'ooxml'            # Already a modern zip-based Office file
+ENCRYPTED = 'encrypted'    # Password protected; Office would stop at a password prompt
+OLE_OTHER = 'ole'          # Another compound file (Outlook .msg, PowerPoint, ...)
+CORRUPT = 'corrupt'        # Compound file header that points past the end of the file
+UNKNOWN = 'unknown'        # Anything else: empty, text, HTML, ...
+UNREADABLE = 'unreadable'  # Could not be opened; never cached
+
+# Kinds a conversion backend can handle
+CONVERTIBLE_KINDS = (DOC, XLS)
+
+OLE_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZIP_SIGNATURE = b'PK\x03\x04'
+RTF_SIGNATURE = b'{\\rtf'
+END_OF_CHAIN = 0xFFFFFFFE
+
+# The directory stream of an Office file is a few sectors long, the streams we look for
+# are almost always in the first one. Give up after this many sectors.
+MAX_DIRECTORY_SECTORS = 16
+
+# Streams shorter than this live in the mini stream, which is not worth following here
+MINI_STREAM_CUTOFF = 4096
+
+# Stream name -> kind. The first match in the directory wins.
+STREAM_KINDS = {
+    'WordDocument': DOC,
+    'Workbook': XLS,
+    'Book': XLS,
+    'EncryptedPackage': ENCRYPTED,
+}
+
+# BIFF record types read at the start of an Excel workbook stream
+BIFF_BOF = 0x0809
+BIFF_FILEPASS = 0x002F
+
+# Default number of sniffing threads; like scanning, this is I/O bound
+DEFAULT_SNIFF_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Function to read one sector of a compound file, or None if the file is too short
+def read_sector(f, sector, sector_size):
+    f.seek((sector + 1) * sector_size)
+    data = f.read(sector_size)
+    return data if len(data) == sector_size else None
+
+# Function to follow the FAT to the sector after this one. Only the first 109 FAT sectors
+# are listed in the header, which covers files up to ~7 MB with 512 byte sectors; beyond
+# that None is returned and the caller stops.
+def next_sector(f, header, sector, sector_size):
+    per_fat_sector = sector_size // 4
+    fat_index = sector // per_fat_sector
+    if fat_index >= 109:
+        return None
+    fat_sector = struct.unpack_from('<I', header, 76 + fat_index * 4)[0]
+    f.seek((fat_sector + 1) * sector_size + (sector % per_fat_sector) * 4)
+    data = f.read(4)
+    if len(data) != 4:
+        return None
+    return struct.unpack('<I', data)[0]
+
+# Function to tell whether the start of a stream says the document is password protected.
+# Word: the fEncrypted bit of the FIB. Excel: a FILEPASS record right after the BOF.
+def stream_is_encrypted(f, kind, start_sector, sector_size):
+    f.seek((start_sector + 1) * sector_size)
+    data = f.read(512)
+    if kind == DOC:
+        return len(data) >= 12 and bool(struct.unpack_from('<H', data, 10)[0] & 0x0100)
+    offset = 0
+    for _ in range(8):
+        if offset + 4 > len(data):
+            break
+        record_type, length = struct.unpack_from('<HH', data, offset)
+        if record_type == BIFF_FILEPASS:
+            return True
+        if offset == 0 and record_type != BIFF_BOF:
+            break
+        offset += 4 + length
+    return False
+
+# Function to classify an open OLE2 compound file from its header and directory stream
+def sniff_compound_file(f, header):
+    sector_shift = struct.unpack_from('<H', header, 30)[0]
+    if sector_shift not in (9, 12):
+        return CORRUPT
+    sector_size = 1 << sector_shift
+    sector = struct.unpack_from('<I', header, 48)[0]
+
+    for _ in range(MAX_DIRECTORY_SECTORS):
+        if sector is None or sector >= END_OF_CHAIN:
+            break
+        directory = read_sector(f, sector, sector_size)
+        if directory is None:
+            return CORRUPT
+        for offset in range(0, sector_size, 128):
+            name_length = struct.unpack_from('<H', directory, offset + 64)[0]
+            if not 2 <= name_length <= 64:
+                continue
+            name = directory[offset:offset + name_length - 2].decode('utf-16-le', errors='replace')
+            kind = STREAM_KINDS.get(name)
+            if kind is None:
+                continue
+            if kind in CONVERTIBLE_KINDS:
+                start_sector, size = struct.unpack_from('<II', directory, offset + 116)
+                if size >= MINI_STREAM_CUTOFF and stream_is_encrypted(f, kind, start_sector, sector_size):
+                    return ENCRYPTED
+            return kind
+        sector = next_sector(f, header, sector, sector_size)
+    return OLE_OTHER
+
+# Function to classify a file by content, reading only its header and directory stream
+def sniff_file(path):
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(512)
+            if header.startswith(OLE_SIGNATURE):
+                if len(header) < 512:
+                    return CORRUPT
+                return sniff_compound_file(f, header)
+    except OSError as e:
+        logger.warning("Unable to read %s: %s", path, e)
+        return UNREADABLE
+    if header.startswith(ZIP_SIGNATURE):
+        return OOXML
+    if header.startswith(RTF_SIGNATURE):
+        return DOC
+    return UNKNOWN
+
+# Persistent cache of sniffing results keyed by (path, size, mtime), so an unchanged file
+# is never opened twice. Results are written in groups; call flush() or close() at the end.
+class SniffCache:
+    def __init__(self, cache_path, group_size=500):
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS sniffs (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, kind TEXT)')
+        self.lock = threading.Lock()
+        self.pending = []
+        self.group_size = group_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, path, size, mtime):
+        with self.lock:
+            row = self.connection.execute('SELECT size, mtime, kind FROM sniffs WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == size and row[1] == mtime:
+            return row[2]
+        return None
+
+    def put(self, path, size, mtime, kind):
+        with self.lock:
+            self.pending.append((path, size, mtime, kind))
+            full = len(self.pending) >= self.group_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            with self.connection:
+                self.connection.executemany('INSERT OR REPLACE INTO sniffs VALUES (?, ?, ?, ?)', self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+# Counters for the summary log line
+class SniffStats:
+    def __init__(self):
+        self.sniffed = 0
+        self.cache_hits = 0
+        self.kinds = {}
+
+# Function to classify one file, using the cache when size and mtime are unchanged.
+# Returns (kind, cache hit).
+def sniff_cached(path, cache):
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logger.warning("Unable to read %s: %s", path, e)
+        return UNREADABLE, False
+    if cache is not None:
+        kind = cache.get(path, stat.st_size, stat.st_mtime)
+        if kind is not None:
+            return kind, True
+    kind = sniff_file(path)
+    if cache is not None and kind != UNREADABLE:
+        cache.put(path, stat.st_size, stat.st_mtime, kind)
+    return kind, False
+
+# Function to classify a stream of paths on a thread pool, yielding (path, kind) in the
+# order the paths arrive. Like the scanner, only a bounded number of files are in flight,
+# so sniffing keeps pace with whatever produces and consumes the paths.
+def iter_sniffed(paths, workers=DEFAULT_SNIFF_WORKERS, cache=None, stats=None):
+    stats = stats if stats is not None else SniffStats()
+
+    def record(path, outcome):
+        kind, cache_hit = outcome
+        stats.sniffed += 1
+        stats.cache_hits += cache_hit
+        stats.kinds[kind] = stats.kinds.get(kind, 0) + 1
+        return path, kind
+
+    if workers <= 1:
+        for path in paths:
+            yield record(path, sniff_cached(path, cache))
+        return
+
+    max_in_flight = workers * 4
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sniff') as pool:
+        in_flight = deque()
+        for path in paths:
+            in_flight.append((path, pool.submit(sniff_cached, path, cache)))
+            if len(in_flight) >= max_in_flight:
+                done_path, future = in_flight.popleft()
+                yield record(done_path, future.result())
+        while in_flight:
+            done_path, future = in_flight.popleft()
+            yield record(done_path, future.result())
@@ -0,0 +1,107 @@
+# Tests for moves and deletions interrupted part way (Ctrl+C): the manifest written
+# afterwards has to list every file that was touched, or it cannot be undone.
+#
+# Each batch is slowed down and a KeyboardInterrupt is raised on the main thread (by
+# SIGALRM) while it waits for a batch to finish, as Ctrl+C would be.
+#
+# Usage:
+#   python -m unittest discover -s tests
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Move and delete tools'))
+import move_plan
+import delete_plan
+
+FILES = 30
+BATCH = 10
+BATCH_SECONDS = 0.2
+# Two batches are queued for the one thread; the interrupt comes while the second runs
+INTERRUPT_SECONDS = 0.3
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt()
+
+# Function to raise KeyboardInterrupt on the main thread after INTERRUPT_SECONDS, as
+# Ctrl+C would; the returned function cancels it
+def interrupt_soon():
+    previous = signal.signal(signal.SIGALRM, interrupt)
+    signal.setitimer(signal.ITIMER_REAL, INTERRUPT_SECONDS)
+    def cancel():
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+    return cancel
+
+# Function to wrap a batch function so every batch takes at least BATCH_SECONDS
+def slowed(function):
+    def slow_batch(*arguments):
+        time.sleep(BATCH_SECONDS)
+        return function(*arguments)
+    return slow_batch
+
+@unittest.skipUnless(hasattr(signal, 'setitimer'), "needs SIGALRM")
+class InterruptedRunTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='fileflow-interrupt-test-')
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.source = os.path.join(self.directory, 'source')
+        os.makedirs(self.source)
+        self.paths = []
+        for i in range(FILES):
+            path = os.path.join(self.source, f"report {i:02d}.docx")
+            with open(path, 'wb') as f:
+                f.write(b'docx %d' % i)
+            self.paths.append(path)
+
+    def test_interrupted_move_lists_every_moved_file(self):
+        target = os.path.join(self.directory, 'target')
+        plan = move_plan.plan_moves(self.source, target, workers=1)
+        result = move_plan.MoveResult(len(plan.moves))
+        with mock.patch.object(move_plan, 'RENAME_BATCH', BATCH), \
+                mock.patch.object(move_plan, 'move_batch', slowed(move_plan.move_batch)):
+            self.addCleanup(interrupt_soon())
+            with self.assertRaises(KeyboardInterrupt):
+                move_plan.execute_moves(plan, workers=1, result=result)
+        manifest_path = move_plan.write_manifest(os.path.join(self.directory, 'manifest.json'), plan, result)
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        self.assertIsNotNone(manifest['interrupted'])
+        self.assertLess(manifest['moved'], FILES)
+        statuses = {entry['source']: entry['status'] for entry in manifest['files']}
+        self.assertEqual(sorted(statuses), self.paths)
+        for source, target_path in plan.moves:
+            if statuses[source] == 'moved':
+                self.assertFalse(os.path.exists(source), source)
+                self.assertTrue(os.path.exists(target_path), target_path)
+            else:
+                self.assertTrue(os.path.exists(source), f"{source} is gone but listed as {statuses[source]}")
+
+    def test_interrupted_quarantine_is_restored(self):
+        plan = delete_plan.plan_deletion(self.source, workers=1)
+        quarantine_directory = delete_plan.new_quarantine_run(delete_plan.default_quarantine_root(self.source))
+        result = delete_plan.DeletionResult(len(plan.files), quarantine_directory)
+        with mock.patch.object(delete_plan, 'DELETE_BATCH', BATCH), \
+                mock.patch.object(delete_plan, 'delete_batch', slowed(delete_plan.delete_batch)):
+            self.addCleanup(interrupt_soon())
+            with self.assertRaises(KeyboardInterrupt):
+                delete_plan.execute_deletion(plan, workers=1, quarantine_directory=quarantine_directory, result=result)
+        delete_plan.write_manifest(delete_plan.default_manifest_path(self.source, quarantine_directory), plan, result)
+
+        self.assertLess(len(result.removed), FILES)
+        self.assertTrue(any(not os.path.exists(path) for path in self.paths))
+        restored, failed = delete_plan.restore_quarantine(quarantine_directory, workers=1)
+        self.assertEqual(failed, 0)
+        self.assertEqual(restored, len(result.removed))
+        for path in self.paths:
+            self.assertTrue(os.path.exists(path), f"{path} was not restored")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,407 @@
+import io
+import os
+import re
+import struct
+import zipfile
+import logging
+import posixpath
+import threading
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Verification reads and inflates the outputs, which is mostly I/O and zlib (which
+# releases the GIL), so a few threads per core keep up with the conversion workers
+DEFAULT_VERIFY_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+# Parts every OOXML package needs to open at all
+REQUIRED_PARTS = ('[Content_Types].xml', '_rels/.rels')
+
+# Main part of each output type: the relationship type it is found by (transitional and
+# strict OOXML differ only in the prefix) and the name of its root element
+OFFICE_DOCUMENT_RELATIONSHIP = '/officeDocument'
+MAIN_PART_ROOTS = {'.docx': 'document', '.xlsx': 'workbook'}
+
+# A converted document may paginate a little differently and a sheet may lose trailing
+# formatted but empty rows, but an output with less than this fraction of the source's
+# pages or rows has lost content
+MIN_CONTENT_RATIO = 0.5
+
+# Below this many characters of text a Word document may be pictures or an empty form,
+# so its output is not required to have text
+MIN_SOURCE_TEXT = 100
+
+# Bytes inflated at a time while reading a sheet
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Rows of a worksheet part, with their (optional) row number
+ROW_PATTERN = re.compile(rb'<(?:\w+:)?row\b([^>]*)>')
+ROW_NUMBER_PATTERN = re.compile(rb'\sr="(\d+)"')
+
+# BIFF records read from the source workbook
+BIFF_BOF = 0x0809
+BIFF_EOF = 0x000A
+BIFF_BOUNDSHEET = 0x0085
+BIFF_DIMENSIONS = 0x0200
+BIFF_FILEPASS = 0x002F
+BIFF8_VERSION = 0x0600
+WORKSHEET = 0x00
+
+# Word's File Information Block: its magic number and where the length of the main text is
+WORD_MAGIC = 0xA5EC
+FIB_CCP_TEXT = 0x004C
+
+# Page count in the summary information property set of an OLE document
+SUMMARY_INFORMATION = '\x05SummaryInformation'
+PIDSI_PAGECOUNT = 14
+VT_I4 = 3
+
+# An output that is not a usable conversion of its source; the message says why
+class VerificationError(Exception):
+    pass
+
+# Function to open an output as a zip and check its central directory: every entry has to
+# lie inside the file, so a truncated or half-written output fails without being inflated
+def open_package(target_path):
+    size = os.path.getsize(target_path)
+    try:
+        archive = zipfile.ZipFile(target_path)
+    except (zipfile.BadZipFile, OSError) as e:
+        raise VerificationError(f"not a valid zip file: {e}")
+    for info in archive.infolist():
+        if info.header_offset + len(info.FileHeader()) + info.compress_size > size:
+            archive.close()
+            raise VerificationError(f"part {info.filename} runs past the end of the file")
+    names = set(archive.namelist())
+    for part in REQUIRED_PARTS:
+        if part not in names:
+            archive.close()
+            raise VerificationError(f"required part {part} is missing")
+    return archive
+
+# Function to read a part, which also checks its CRC
+def read_part(archive, name):
+    try:
+        return archive.read(name)
+    except KeyError:
+        raise VerificationError(f"part {name} is missing")
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, OSError, EOFError, ValueError) as e:
+        raise VerificationError(f"part {name} is damaged: {e}")
+
+def parse_part(archive, name):
+    try:
+        return ET.fromstring(read_part(archive, name))
+    except ET.ParseError as e:
+        raise VerificationError(f"part {name} is not well-formed XML: {e}")
+
+# Function to give the targets of a part's relationships, {id: (type, part name)}
+def relationships(archive, part_name):
+    folder, base = posixpath.split(part_name)
+    rels_name = posixpath.join(folder, '_rels', base + '.rels')
+    targets = {}
+    if rels_name not in archive.NameToInfo:
+        return targets
+    for relationship in parse_part(archive, rels_name):
+        target = relationship.get('Target', '')
+        if relationship.get('TargetMode') == 'External':
+            continue
+        target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(folder, target))
+        targets[relationship.get('Id')] = (relationship.get('Type', ''), target)
+    return targets
+
+# Function to find the main part (word/document.xml, xl/workbook.xml, ...) and check it
+# is the right kind of document
+def main_part(archive, extension):
+    for relationship_type, target in relationships(archive, '').values():
+        if relationship_type.endswith(OFFICE_DOCUMENT_RELATIONSHIP):
+            break
+    else:
+        raise VerificationError("no main document part is declared in _rels/.rels")
+    root = parse_part(archive, target)
+    expected = MAIN_PART_ROOTS.get(extension)
+    if expected and root.tag.rsplit('}', 1)[-1] != expected:
+        raise VerificationError(f"main part {target} is a {root.tag.rsplit('}', 1)[-1]}, not a {expected}")
+    return target, root
+
+# Function to count the rows of a worksheet part, inflating it in chunks (which also checks
+# its CRC). Returns the highest row number, or the number of rows if they carry none.
+def count_rows(archive, name):
+    last_row = rows = 0
+    tail = b''
+    try:
+        with archive.open(name) as part:
+            while True:
+                chunk = part.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                data = tail + chunk
+                # A row tag split over two chunks is picked up with the next one
+                cut = data.rfind(b'<')
+                for match in ROW_PATTERN.finditer(data, 0, cut if cut >= 0 else len(data)):
+                    rows += 1
+                    number = ROW_NUMBER_PATTERN.search(match.group(1))
+                    if number:
+                        last_row = max(last_row, int(number.group(1)))
+                tail = data[cut:] if cut >= 0 else b''
+    except KeyError:
+        raise VerificationError(f"part {name} is missing")
+    except (zipfile.BadZipFile, OSError, EOFError, ValueError) as e:
+        raise VerificationError(f"part {name} is damaged: {e}")
+    return max(last_row, rows)
+
+# Function to list the sheets of a workbook output as {name: rows}, None for chart sheets
+def workbook_sheets(archive, workbook_part, workbook):
+    targets = relationships(archive, workbook_part)
+    sheets = {}
+    for element in workbook.iter():
+        if element.tag.rsplit('}', 1)[-1] != 'sheet':
+            continue
+        relationship_id = next((value for key, value in element.attrib.items() if key.rsplit('}', 1)[-1] == 'id'), None)
+        relationship_type, target = targets.get(relationship_id, ('', None))
+        if target is None:
+            raise VerificationError(f"sheet {element.get('name')} has no part")
+        sheets[element.get('name')] = count_rows(archive, target) if relationship_type.endswith('/worksheet') else None
+    return sheets
+
+# Function to read the page count Word recorded in docProps/app.xml, or None
+def output_pages(archive):
+    if 'docProps/app.xml' not in archive.NameToInfo:
+        return None
+    for element in parse_part(archive, 'docProps/app.xml'):
+        if element.tag.rsplit('}', 1)[-1] == 'Pages' and (element.text or '').strip().isdigit():
+            return int(element.text)
+    return None
+
+# Function to open the compound file of a legacy source, or None when it is not one (RTF
+# saved as .doc) or xlrd, whose reader is used, is not installed
+def open_compound_file(source_path):
+    try:
+        from xlrd.compdoc import CompDoc, CompDocError
+    except ImportError:
+        return None
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    try:
+        return CompDoc(data, logfile=io.StringIO())
+    except (CompDocError, struct.error, IndexError, ValueError) as e:
+        logger.debug("Unable to read %s as a compound file: %s", source_path, e)
+        return None
+
+def stream(compound, name):
+    from xlrd.compdoc import CompDocError
+    try:
+        return compound.get_named_stream(name)
+    except (CompDocError, struct.error, IndexError, ValueError):
+        return None
+
+# Function to read the page count from a source's summary information, or None
+def source_pages(compound):
+    data = stream(compound, SUMMARY_INFORMATION)
+    if not data or len(data) < 48:
+        return None
+    section = struct.unpack_from('<I', data, 44)[0]
+    if section + 8 > len(data):
+        return None
+    count = struct.unpack_from('<I', data, section + 4)[0]
+    for index in range(min(count, (len(data) - section - 8) // 8)):
+        property_id, offset = struct.unpack_from('<II', data, section + 8 + index * 8)
+        if property_id == PIDSI_PAGECOUNT and section + offset + 8 <= len(data):
+            value_type, value = struct.unpack_from('<Ii', data, section + offset)
+            return value if value_type == VT_I4 and value > 0 else None
+    return None
+
+# Function to read the length of a Word source's main text from its FIB, or None
+def source_text_length(compound):
+    data = stream(compound, 'WordDocument')
+    if not data or len(data) < FIB_CCP_TEXT + 4 or struct.unpack_from('<H', data, 0)[0] != WORD_MAGIC:
+        return None
+    return struct.unpack_from('<i', data, FIB_CCP_TEXT)[0]
+
+# Function to list the worksheets of an .xls source as {name: rows}, from the BOUNDSHEET
+# records of the workbook globals and the DIMENSIONS record of each sheet. Returns None for
+# an encrypted workbook or one that cannot be read.
+def source_sheets(compound):
+    for name in ('Workbook', 'Book'):
+        data = stream(compound, name)
+        if data:
+            break
+    else:
+        return None
+    sheets = {}
+    positions = []
+    biff8 = False
+    position = 0
+    try:
+        while position + 4 <= len(data):
+            record, length = struct.unpack_from('<HH', data, position)
+            body = position + 4
+            if record == BIFF_BOF and position == 0:
+                biff8 = struct.unpack_from('<H', data, body)[0] == BIFF8_VERSION
+            elif record == BIFF_FILEPASS:
+                return None
+            elif record == BIFF_BOUNDSHEET:
+                offset, sheet_type, name_length = struct.unpack_from('<IxBB', data, body)
+                if biff8:
+                    wide = data[body + 7] & 0x01
+                    raw = data[body + 8:body + 8 + name_length * (2 if wide else 1)]
+                    sheet_name = raw.decode('utf-16-le' if wide else 'latin-1')
+                else:
+                    sheet_name = data[body + 7:body + 7 + name_length].decode('cp1252', errors='replace')
+                if sheet_type == WORKSHEET:
+                    positions.append((sheet_name, offset))
+            elif record == BIFF_EOF:
+                break
+            position = body + length
+        for sheet_name, offset in positions:
+            sheets[sheet_name] = sheet_rows(data, offset, biff8)
+    except (struct.error, IndexError):
+        return None
+    return sheets
+
+# Function to read the number of used rows from a sheet's DIMENSIONS record
+def sheet_rows(data, position, biff8):
+    while position + 4 <= len(data):
+        record, length = struct.unpack_from('<HH', data, position)
+        if record == BIFF_DIMENSIONS:
+            return struct.unpack_from('<I' if biff8 else '<H', data, position + 4 + (4 if biff8 else 2))[0]
+        if record == BIFF_EOF:
+            break
+        position += 4 + length
+    return 0
+
+# Function to check a .docx against its source: it must have text when the source has
+# some, and not far fewer pages than the source recorded
+def verify_document(archive, document, source_path):
+    compound = open_compound_file(source_path)
+    if compound is None:
+        return {}
+    details = {}
+    text_length = source_text_length(compound)
+    if text_length is not None and text_length >= MIN_SOURCE_TEXT:
+        details['source_characters'] = text_length
+        if not any(element.text for element in document.iter() if element.tag.rsplit('}', 1)[-1] == 't'):
+            raise VerificationError(f"output has no text, the source has {text_length} characters")
+    pages, converted_pages = source_pages(compound), output_pages(archive)
+    if pages and converted_pages is not None:
+        details.update(source_pages=pages, pages=converted_pages)
+        if converted_pages < pages * MIN_CONTENT_RATIO:
+            raise VerificationError(f"output has {converted_pages} pages, the source has {pages}")
+    return details
+
+# Function to check an .xlsx against its source: every worksheet must be there, and none
+# may have far fewer rows than the source's used range
+def verify_workbook(archive, sheets, source_path):
+    compound = open_compound_file(source_path)
+    source = source_sheets(compound) if compound is not None else None
+    if source is None:
+        return {}
+    if len(sheets) < len(source):
+        raise VerificationError(f"output has {len(sheets)} sheets, the source has {len(source)} worksheets")
+    for name, rows in source.items():
+        converted_rows = sheets.get(name)
+        if converted_rows is not None and converted_rows < rows * MIN_CONTENT_RATIO:
+            raise VerificationError(f"sheet {name} has {converted_rows} rows, the source has {rows}")
+    return {'source_sheets': len(source), 'source_rows': sum(source.values())}
+
+# Function to verify one output without Office: a valid zip, the required parts, a main
+# part of the right kind and, where the source can be read, plausible page, sheet and row
+# counts. Raises VerificationError; returns a dict of what was counted.
+def verify_output(source_path, target_path):
+    extension = os.path.splitext(target_path)[1].lower()
+    try:
+        archive = open_package(target_path)
+    except OSError as e:
+        raise VerificationError(f"output cannot be read: {e}")
+    with archive:
+        part, root = main_part(archive, extension)
+        if extension == '.xlsx':
+            sheets = workbook_sheets(archive, part, root)
+            if not sheets:
+                raise VerificationError("workbook has no sheets")
+            details = {'sheets': len(sheets), 'rows': sum(rows or 0 for rows in sheets.values())}
+            details.update(verify_workbook(archive, sheets, source_path))
+        else:
+            details = verify_document(archive, root, source_path)
+    return details
+
+# Function to give what identifies the current content of an output, (size, modified
+# time in ns), or None if it is gone. An original is only deleted while its output still
+# has the fingerprint it was verified with.
+def output_fingerprint(target_path):
+    try:
+        stat = os.stat(target_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+# Result of verifying one output; context is whatever the caller submitted it with and
+# fingerprint the output_fingerprint() of the file that was checked
+class VerificationResult:
+    def __init__(self, source_path, target_path, error=None, details=None, context=None, fingerprint=None):
+        self.source_path = source_path
+        self.target_path = target_path
+        self.error = error
+        self.details = details or {}
+        self.context = context
+        self.fingerprint = fingerprint
+
+    @property
+    def ok(self):
+        return self.error is None
+
+# Thread pool verifying outputs while the conversion goes on. submit() blocks while
+# workers * 64 outputs are waiting, so a resumed run with many outputs to check cannot
+# queue them all at once. on_result is called on the verifying thread with each
+# VerificationResult; close() waits for all of them.
+class VerificationPool:
+    def __init__(self, on_result, workers=DEFAULT_VERIFY_WORKERS):
+        self.on_result = on_result
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='verify')
+        self.slots = threading.BoundedSemaphore(max(1, workers) * 64)
+        self.lock = threading.Lock()
+        self.passed = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, source_path, target_path, context=None):
+        self.slots.acquire()
+        try:
+            self.executor.submit(self.run, source_path, target_path, context)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def run(self, source_path, target_path, context):
+        try:
+            fingerprint = output_fingerprint(target_path)
+            try:
+                details = verify_output(source_path, target_path)
+                if output_fingerprint(target_path) != fingerprint:
+                    raise VerificationError("output changed while it was being verified")
+                result = VerificationResult(source_path, target_path, details=details, context=context,
+                                            fingerprint=fingerprint)
+            except VerificationError as e:
+                result = VerificationResult(source_path, target_path, error=e, context=context)
+            except Exception as e:
+                logger.exception("Unexpected error verifying %s", target_path)
+                result = VerificationResult(source_path, target_path, error=e, context=context)
+            with self.lock:
+                if result.ok:
+                    self.passed += 1
+                else:
+                    self.failed += 1
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logger.error("Error handling the verification of %s: %s", target_path, e)
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
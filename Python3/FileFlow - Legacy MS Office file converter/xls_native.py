@@ -0,0 +1,203 @@
+# Office-free .xls -> .xlsx conversion for plain data workbooks, used by the native
+# backend in converters.py.
+#
+# The workbook is read with xlrd (BIFF8, and BIFF5 from Excel 5/95) one sheet at a time
+# and written with openpyxl in write-only mode, which streams the rows to disk instead of
+# building the workbook in memory. Values, number formats (dates included, with the
+# workbook's 1900 or 1904 date system), sheet names and visibility, column widths and
+# merged cells are kept. Anything else a workbook may hold is not, so before converting,
+# the workbook stream is checked for formulas, charts, pictures and other drawings,
+# macros, hyperlinks and pivot tables; a workbook with any of them raises NeedsOffice and
+# is left to Office.
+import os
+import struct
+import xlrd
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import CALENDAR_MAC_1904
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+# A workbook the native engine cannot convert without losing something; the message says what
+class NeedsOffice(Exception):
+    pass
+
+# BIFF record types that mean the workbook holds more than values and formats
+UNSUPPORTED_RECORDS = {
+    0x0006: 'formulas',            # FORMULA
+    0x0221: 'formulas',            # ARRAY
+    0x04BC: 'formulas',            # SHRFMLA
+    0x0236: 'formulas',            # TABLEOP (data tables)
+    0x00EB: 'drawings',            # MSODRAWINGGROUP: pictures, charts, shapes or comments
+    0x005D: 'drawings',            # OBJ
+    0x01B8: 'hyperlinks',          # HLINK
+    0x00B0: 'pivot tables',        # SXVIEW
+    0x00D3: 'macros',              # OBJPROJ: a VBA project
+    0x002F: 'password protection', # FILEPASS
+}
+
+# Beginning of a sub-stream (the workbook globals, a worksheet, a chart, ...)
+BIFF_BOF = 0x0809
+
+# Sub-stream types of a BOF record that hold something other than a worksheet
+UNSUPPORTED_SUBSTREAMS = {
+    0x0020: 'charts',              # chart sheet
+    0x0040: 'macros',              # Excel 4.0 macro sheet
+    0x0006: 'macros',              # Visual Basic module (BIFF5)
+}
+
+# Directory entry of a VBA project in the compound file, as stored (UTF-16)
+VBA_STORAGE = '_VBA_PROJECT_CUR'.encode('utf-16-le')
+
+# openpyxl's names for xlrd's sheet visibility 0, 1 and 2
+SHEET_STATES = ('visible', 'hidden', 'veryHidden')
+
+# Column widths are stored in 1/256 of a character
+WIDTH_UNITS = 256
+
+# How openpyxl formats the numbers it writes
+PRECISION = '%.16g'
+
+# Function to list what in a workbook the native engine would lose. data is the whole
+# file (for the VBA storage); the workbook stream is stream[start:end], as xlrd located it
+# (book.mem, book.base, book.stream_len). Walking the records is one struct call per
+# record, little next to what xlrd spends.
+def unsupported_features(data, stream, start, end):
+    found = set()
+    if VBA_STORAGE in data:
+        found.add('macros')
+    unpack = struct.unpack_from
+    position = start
+    last = end - 4
+    while position <= last:
+        record, length = unpack('<HH', stream, position)
+        if record in UNSUPPORTED_RECORDS:
+            found.add(UNSUPPORTED_RECORDS[record])
+        elif record == BIFF_BOF and length >= 4:
+            substream = unpack('<H', stream, position + 6)[0]
+            if substream in UNSUPPORTED_SUBSTREAMS:
+                found.add(UNSUPPORTED_SUBSTREAMS[substream])
+        position += 4 + length
+    return sorted(found)
+
+# Function to give the number format string of every XF (cell format) record, 'General'
+# included, so a cell's format is one list lookup
+def number_formats(book):
+    formats = []
+    for xf in book.xf_list:
+        fmt = book.format_map.get(xf.format_key)
+        formats.append(fmt.format_str if fmt is not None and fmt.format_str else 'General')
+    return formats
+
+# Function to turn one xlrd cell into what openpyxl should write: the plain value where
+# possible (cheapest for openpyxl), a WriteOnlyCell where a format or type has to be set
+def convert_cell(cell, sheet, formats, error_text):
+    ctype = cell.ctype
+    if ctype == xlrd.XL_CELL_EMPTY or ctype == xlrd.XL_CELL_BLANK:
+        return None
+    value = cell.value
+    if ctype == xlrd.XL_CELL_NUMBER or ctype == xlrd.XL_CELL_DATE:
+        # Excel stores every number as a double; whole ones are written as integers
+        if value.is_integer() and abs(value) < 2 ** 53:
+            value = int(value)
+            exact = True
+        else:
+            # openpyxl writes numbers to 16 significant digits, which changes the doubles
+            # that need 17 (3.0300000000000002 becomes 3.03); those are written as text of
+            # their exact value, still typed as numbers
+            exact = float(PRECISION % value) == value
+        fmt = formats[cell.xf_index] if cell.xf_index is not None else 'General'
+        if fmt == 'General' and exact:
+            return value
+        written = WriteOnlyCell(sheet, value if exact else repr(value))
+        if not exact:
+            written.data_type = 'n'
+        if fmt != 'General':
+            written.number_format = fmt
+        return written
+    if ctype == xlrd.XL_CELL_TEXT:
+        fmt = formats[cell.xf_index] if cell.xf_index is not None else 'General'
+        if value[:1] != '=' and value[:1] != '#' and fmt == 'General':
+            return value
+        # openpyxl would take "=..." for a formula and "#N/A" for an error, it is text here
+        written = WriteOnlyCell(sheet, value)
+        written.data_type = 's'
+        if fmt != 'General':
+            written.number_format = fmt
+        return written
+    if ctype == xlrd.XL_CELL_BOOLEAN:
+        return bool(value)
+    if ctype == xlrd.XL_CELL_ERROR:
+        written = WriteOnlyCell(sheet, error_text.get(value, '#N/A'))
+        written.data_type = 'e'
+        return written
+    return value
+
+# Function to copy one xlrd sheet into a write-only openpyxl sheet
+def copy_sheet(source, target, formats):
+    target.sheet_state = SHEET_STATES[source.visibility] if source.visibility < len(SHEET_STATES) else 'visible'
+    # Column widths have to be set before the first row is written
+    for column, info in sorted(source.colinfo_map.items()):
+        if info.width and column < 16384:
+            target.column_dimensions[get_column_letter(column + 1)].width = info.width / WIDTH_UNITS
+    error_text = xlrd.error_text_from_code
+    cells = 0
+    for row_index in range(source.nrows):
+        row = [convert_cell(cell, target, formats, error_text) for cell in source.row(row_index)]
+        # Trailing empty cells are left out, like Excel does
+        while row and row[-1] is None:
+            row.pop()
+        cells += len(row)
+        target.append(row)
+    for first_row, last_row, first_column, last_column in source.merged_cells:
+        if (last_row - first_row) * (last_column - first_column) > 1:
+            target.merged_cells.add(f"{get_column_letter(first_column + 1)}{first_row + 1}:"
+                                    f"{get_column_letter(last_column)}{last_row}")
+    return cells
+
+# Function to convert one .xls workbook to .xlsx, raising NeedsOffice (before anything is
+# written) when it holds something the native engine would lose. Sheets are loaded one at
+# a time and released once written. A half-written target is removed on any error.
+# Returns (sheets, rows, cells) written.
+def convert_xls(source_path, target_path):
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    try:
+        book = xlrd.open_workbook(file_contents=data, formatting_info=True, on_demand=True, ragged_rows=True)
+    except xlrd.XLRDError as e:
+        # Encrypted, or a format xlrd does not read (BIFF2-4); Office may still manage
+        raise NeedsOffice(f"not readable without Office: {e}")
+    try:
+        unsupported = unsupported_features(data, book.mem, book.base, book.stream_len)
+        if unsupported:
+            raise NeedsOffice(f"workbook has {', '.join(unsupported)}")
+        del data
+
+        formats = number_formats(book)
+        workbook = openpyxl.Workbook(write_only=True)
+        if book.datemode == 1:
+            workbook.epoch = CALENDAR_MAC_1904
+        rows = cells = 0
+        try:
+            for index in range(book.nsheets):
+                source = book.sheet_by_index(index)
+                cells += copy_sheet(source, workbook.create_sheet(source.name), formats)
+                rows += source.nrows
+                book.unload_sheet(index)
+            workbook.save(target_path)
+        except IllegalCharacterError as e:
+            remove_partial(target_path)
+            raise NeedsOffice(f"text with control characters openpyxl cannot write: {e}")
+        except BaseException:
+            remove_partial(target_path)
+            raise
+        return book.nsheets, rows, cells
+    finally:
+        book.release_resources()
+
+# Function to remove what was written of a target that could not be finished
+def remove_partial(target_path):
+    try:
+        os.remove(target_path)
+    except OSError:
+        pass
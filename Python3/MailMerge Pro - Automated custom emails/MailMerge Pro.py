@@ -7,41 +7,27 @@ import smtplib, ssl
 import tkinter as tk
 import tkinter.messagebox as messagebox
 import json
+import sqlite3
+import threading
 
 from tkinter import filedialog
 from tkinter import ttk
 from tkinter import messagebox
 from email import encoders
 from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
+from smtp_pool import describe_smtp_error
+from send_job import PAUSED, CANCELLING, CANCELLED, FAILED
+from outbox import SENT
+from outbox import FAILED as DELIVERY_FAILED
+import engine
 
 # Create a logger object
 logger = logging.getLogger(__name__)
 # Set the logging level
 logger.setLevel(logging.DEBUG)
 
-# Determine the directory where the script is being run
-current_dir = os.path.dirname(os.path.abspath(__file__))
-
-# Create a log folder if it doesn't exist
-
-log_dir = os.path.join(current_dir, 'log')
-os.makedirs(log_dir, exist_ok=True)
-
-# Create a file handler
-log_file_path = os.path.join(log_dir, 'Csv_Email_Log.txt')
-handler = logging.FileHandler(log_file_path)
-
-# Create a log formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-
-# Add the formatter to the file handler
-handler.setFormatter(formatter)
-
-# Add the file handler to the logger
-logger.addHandler(handler)
+# How often the window checks on a running send (milliseconds)
+PROGRESS_POLL_MS = 200
 
 class EmailGUI:
     def __init__(self, master):
@@ -49,6 +35,9 @@ class EmailGUI:
         self.csv_file = None
         self.folder = None
         self.sender_email = None
+        self.job = None
+        self.outbox = None
+        self.plan_result = None
         
         # Create a label and textbox for the sender email
         self.sender_email_label = tk.Label(master, text="Sender email:")
@@ -63,7 +52,7 @@ class EmailGUI:
         self.subject_text.pack()
         
         # Create a label and textbox for the email description
-        self.description_label = tk.Label(master, text="Email message:")
+        self.description_label = tk.Label(master, text="Email message ({{ column }} inserts a CSV column):")
         self.description_label.pack()
         self.description_text = tk.Text(master, height=15, width=40)
         self.description_text.pack()
@@ -88,6 +77,16 @@ class EmailGUI:
         self.send_button = tk.Button(master, text="Send", command=self.send_email)
         self.send_button.pack()
 
+        # Progress of the running send, with pause and cancel
+        self.progress_bar = ttk.Progressbar(master, length=300, mode='determinate')
+        self.progress_bar.pack()
+        self.progress_label = tk.Label(master, text="")
+        self.progress_label.pack()
+        self.pause_button = tk.Button(master, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack()
+        self.cancel_button = tk.Button(master, text="Cancel", command=self.cancel_send, state=tk.DISABLED)
+        self.cancel_button.pack()
+
     def browse_csv(self):
         # Open a file selection dialog and select a CSV file
         self.csv_file = filedialog.askopenfilename(filetypes=[("CSV files", "*.csv")])
@@ -99,9 +98,14 @@ class EmailGUI:
         self.folder_label.config(text=folder)
         self.folder = folder
 
-    def pdf_files(self):
-        # Get the list of PDF files in the selected folder
-        return [file for file in os.listdir(self.folder) if file.endswith(".pdf")]
+    # Called by the send job's threads for every email
+    def log_delivery(self, result):
+        invoice_ID, recipient_email, subject, _ = result.job.key
+        if result.ok:
+            print(f"Email {subject} sent {invoice_ID} document to {recipient_email}")
+        else:
+            print(f"Failed to send email: {describe_smtp_error(result.error)}")
+        engine.log_delivery(result)
 
     def send_email(self):
         # Get sender, subject and description
@@ -115,95 +119,153 @@ class EmailGUI:
         if not subject:
             messagebox.showerror("Error", "Please enter an email subject")
             return
+        if not self.csv_file or not self.folder:
+            messagebox.showerror("Error", "Please select a CSV file and a PDF folder")
+            return
 
-        # SMTP SERVER and PORT
-        smtp_server = "SMTP-Sever"
-        smtp_port = 25
+        # SMTP server, connections, rate limit and the optional HTML message come from the
+        # settings file (mailmerge.json); the subject and message are compiled as templates once here
+        try:
+            config = engine.load_config()
+            _, html_body = engine.read_message_files(config)
+            mailing = engine.mailing_from_config(config, self.sender_email, subject,
+                                                 self.description_text.get("1.0", "end-1c"), html_body)
+        except (OSError, ValueError) as e:
+            logger.exception("Unable to read the settings file")
+            messagebox.showerror("Error", f"Unable to read the settings file {engine.CONFIG_FILE}: {e}")
+            return
 
-        # Server connection
+        # Match the CSV rows to the PDFs before anything is sent, off the Tk thread
+        self.send_button.config(state=tk.DISABLED)
+        self.progress_label.config(text="Matching the CSV to the PDF folder...")
+        self.plan_result = None
+        threading.Thread(target=self.build_plan, args=(mailing, self.csv_file, self.folder), daemon=True).start()
+        self.master.after(PROGRESS_POLL_MS, self.wait_for_plan, mailing)
+
+    # Runs on a background thread; the result (or the error) is picked up by wait_for_plan
+    def build_plan(self, mailing, csv_file, folder):
         try:
-            # Create SMTP server
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            # Error handling
-        except smtplib.SMTPConnectError as e:
-            logger.exception("An error occurred while connecting to the server")
-            messagebox.showerror("Error", "An error occurred while connecting to the server")
-        except smtplib.SMTPAuthenticationError as e:
-            logger.exception("Authentication error")
-            messagebox.showerror("Error", "Authentication error")
-        except smtplib.SMTPHeloError as e:
-            logger.exception("Error sending HELO message")
-            messagebox.showerror("Error", "Error sending HELO message")
-        except smtplib.SMTPRecipientsRefused as e:
-            logger.exception("At least one recipient was refused")
-            messagebox.showerror("Error", "At least one recipient was refused")
-        except smtplib.SMTPSenderRefused as e:
-            logger.exception("Sender address was refused")
-            messagebox.showerror("Error", "Sender address was refused")
-        except smtplib.SMTPDataError as e:
-            logger.exception("Error sending data")
-            messagebox.showerror("Error", "Error sending data")
-        except Exception as e:
-            logger.exception("An error occurred while creating the SSL context")
-            messagebox.showerror("Error", "An error occurred while creating the SSL context")
-  
-        # Open CSV file # Find matching record for this file's ID
-        with open(self.csv_file, "r") as csv_file:
-            reader = csv.reader(csv_file,delimiter=",")
-            next(reader) # Skips the header row
-            for row in reader:
-                # Get Invoice name excluding the .pdf suffix
-                for pdf in self.pdf_files():   
-                    invoice_ID = pdf[0:-4]
-                    if row[0] != invoice_ID:
-                        continue
-                    csv_name, csv_email = row[0], row[1:]
-                    file_path = os.path.join(self.folder, f"{invoice_ID}.pdf")
-                    if csv_name == invoice_ID:   
-                        #Found the record, begin to send email
-                        for recipient_email in csv_email:
-                            # Construct the email
-                            message = MIMEMultipart()
-                            message["From"] = self.sender_email
-                            message["To"] = recipient_email
-                            message["Subject"] = self.subject_text.get("1.0", "end-1c")
-                            message.attach(MIMEText(self.description_text.get("1.0", "end-1c"), "plain"))
-                            
-                            # Check if the PDF file exists
-                            if os.path.exists(file_path):
-                                # Create the attachment
-                                attachment = MIMEApplication(open(file_path, "rb").read(), _subtype="pdf")
-                                attachment.add_header("Content-Disposition", "attachment", filename=f"{invoice_ID}.pdf")
-                                # Add the attachment to the email
-                                message.attach(attachment)
-                            else:
-                                # Log an error if the PDF file doesn't exist
-                                logger.error(f"PDF file not found for invoice ID {invoice_ID}")
-                           
-                            # Send the email
-                            try:
-                                print(f"Sending {invoice_ID} to email {recipient_email}")
-                                logger.info("Email sending to {}".format(recipient_email))
-                                server.sendmail(self.sender_email, recipient_email, message.as_string())
-                                print(f"Email {subject} sent {invoice_ID} document to {recipient_email}")
-                                logger.info(f"Email {subject} sent {invoice_ID} document to {recipient_email}")
-                        
-                            except smtplib.SMTPRecipientsRefused as e:
-                                print("Failed to send email: invalid recipient address")
-                            except smtplib.SMTPDataError as e:
-                                print("Failed to send email: data error")
-                            except smtplib.SMTPHeloError as e:
-                                print("Failed to send email: invalid HELO/EHLO message")
-                            except smtplib.SMTPSenderRefused as e:
-                                print("Failed to send email: invalid sender address")
-                            except smtplib.SMTPAuthenticationError as e:
-                                print("Failed to send email: authentication error")
-                            except smtplib.SMTPException as e:
-                                print("Failed to send email: general error")      
-        # Close the connection to the server
-        server.quit()
-        messagebox.showinfo("Success", "Emails sent successfully")
-        logger.info("Success, Emails sent successfully")
+            self.plan_result = mailing.plan(csv_file, folder)
+        except (OSError, csv.Error) as e:
+            logger.exception("Unable to read the CSV file or PDF folder")
+            self.plan_result = e
+
+    def wait_for_plan(self, mailing):
+        if self.plan_result is None:
+            self.master.after(PROGRESS_POLL_MS, self.wait_for_plan, mailing)
+            return
+        plan = self.plan_result
+        self.progress_label.config(text="")
+        if isinstance(plan, Exception):
+            messagebox.showerror("Error", f"Unable to read the CSV file or PDF folder: {plan}")
+            self.send_button.config(state=tk.NORMAL)
+            return
+        if not messagebox.askyesno("Send plan", f"{plan.summary()}\n\nDetails are in the log. Send the {plan.message_count} emails?"):
+            logger.info("Sending cancelled after reviewing the send plan")
+            self.send_button.config(state=tk.NORMAL)
+            return
+
+        # Offer to resume when an earlier run of this CSV already sent some of the emails
+        outbox_path = engine.outbox_path_for(self.csv_file)
+        try:
+            self.outbox = engine.open_outbox(self.csv_file)
+            counts = self.outbox.counts()
+            mismatch = self.outbox.csv_mismatch(self.csv_file)
+        except (sqlite3.Error, OSError) as e:
+            logger.exception("Unable to open the outbox")
+            messagebox.showerror("Error", f"Unable to open the outbox {outbox_path}: {e}")
+            self.send_button.config(state=tk.NORMAL)
+            return
+        resume = False
+        if counts.get(SENT) or counts.get(DELIVERY_FAILED):
+            note = f"\n\n{mismatch} Check it is the same mailing before resuming." if mismatch else ""
+            answer = messagebox.askyesnocancel(
+                "Resume", f"An earlier run of this CSV sent {counts.get(SENT, 0)} emails and {counts.get(DELIVERY_FAILED, 0)} "
+                          f"failed for good.{note}\n\nYes: send only the emails not sent yet\nNo: send all emails again")
+            if answer is None:
+                logger.info("Sending cancelled at the resume prompt")
+                self.close_outbox()
+                self.send_button.config(state=tk.NORMAL)
+                return
+            resume = answer
+        try:
+            self.outbox.record_csv(self.csv_file)
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Unable to record the CSV file in the outbox: {e}")
+
+        # The send job connects a pool of SMTP sessions and sends from background threads;
+        # the window only polls its progress
+        self.job = mailing.create_job(plan, outbox=self.outbox, resume=resume, on_result=self.log_delivery)
+        self.progress_bar.config(maximum=max(1, plan.message_count), value=0)
+        self.pause_button.config(text="Pause", state=tk.NORMAL)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.job.start()
+        self.master.after(PROGRESS_POLL_MS, self.poll_job)
+
+    def poll_job(self):
+        progress = self.job.channel.poll()
+        if progress is not None:
+            self.show_progress(progress)
+        if self.job.done:
+            self.finish_job()
+        else:
+            self.master.after(PROGRESS_POLL_MS, self.poll_job)
+
+    def close_outbox(self):
+        if self.outbox is not None:
+            self.outbox.close()
+            self.outbox = None
+
+    def show_progress(self, progress):
+        self.progress_bar.config(maximum=max(1, progress.total), value=progress.total - progress.remaining)
+        text = progress.summary()
+        if progress.state == PAUSED:
+            text = "Paused: " + text
+        elif progress.state == CANCELLING:
+            text = "Cancelling: " + text
+        self.progress_label.config(text=text)
+
+    def toggle_pause(self):
+        if self.job is None:
+            return
+        if self.job.state == PAUSED:
+            self.job.resume()
+            self.pause_button.config(text="Pause")
+        else:
+            self.job.pause()
+            self.pause_button.config(text="Resume")
+
+    def cancel_send(self):
+        if self.job is not None:
+            self.job.cancel()
+            self.pause_button.config(state=tk.DISABLED)
+            self.cancel_button.config(state=tk.DISABLED)
+
+    # Function to report how the send job ended and get the window ready for the next one
+    def finish_job(self):
+        job = self.job
+        self.job = None
+        self.close_outbox()
+        progress = job.progress()
+        self.show_progress(progress)
+        self.pause_button.config(text="Pause", state=tk.DISABLED)
+        self.cancel_button.config(state=tk.DISABLED)
+        self.send_button.config(state=tk.NORMAL)
+
+        if job.state == FAILED:
+            self.show_send_error(job.error, job.pool is not None)
+            return
+        if job.state == CANCELLED:
+            logger.info(f"Sending cancelled: {progress.summary()}")
+            messagebox.showinfo("Cancelled", f"Sending cancelled. {progress.sent} emails sent, {progress.failed} failed, "
+                                             f"{progress.cancelled} not sent. Send the same CSV again to resume.")
+            return
+        if progress.failed or progress.skipped:
+            messagebox.showwarning("Finished", f"{progress.sent} emails sent, {progress.failed + progress.skipped} failed. "
+                                               "Details are in the log.")
+        else:
+            messagebox.showinfo("Success", "Emails sent successfully")
+            logger.info("Success, Emails sent successfully")
         # Clear the text boxes
         self.sender_email_text.delete("1.0", "end")
         self.subject_text.delete("1.0", "end")
@@ -211,11 +273,41 @@ class EmailGUI:
         self.folder_label.config(text="No folder selected")
         self.csv_label.config(text="No csv selected")
 
+    # Error handling for a send job that could not connect or stopped unexpectedly
+    def show_send_error(self, e, connected):
+        if isinstance(e, smtplib.SMTPConnectError):
+            logger.error("An error occurred while connecting to the server", exc_info=e)
+            messagebox.showerror("Error", "An error occurred while connecting to the server")
+        elif isinstance(e, smtplib.SMTPAuthenticationError):
+            logger.error("Authentication error", exc_info=e)
+            messagebox.showerror("Error", "Authentication error")
+        elif isinstance(e, smtplib.SMTPHeloError):
+            logger.error("Error sending HELO message", exc_info=e)
+            messagebox.showerror("Error", "Error sending HELO message")
+        elif not connected:
+            logger.error("An error occurred while connecting to the server", exc_info=e)
+            messagebox.showerror("Error", f"An error occurred while connecting to the server: {e}")
+        else:
+            logger.error("An error occurred while sending", exc_info=e)
+            messagebox.showerror("Error", f"An error occurred while sending: {e}")
+
+    # Closing the window cancels a running send and waits for the emails already going out
+    def close(self):
+        if self.job is not None:
+            if not messagebox.askyesno("Sending", "Emails are still being sent. Cancel sending and quit?"):
+                return
+            self.job.cancel()
+            self.job.wait()
+            self.close_outbox()
+        self.master.destroy()
+
 def main():
+    engine.configure_logging()
     # Set up the GUI
     root = tk.Tk()
     root.title('.CSV emailer')
     app = EmailGUI(root)
+    root.protocol("WM_DELETE_WINDOW", app.close)
     root.mainloop()
 
 if __name__ == "__main__":
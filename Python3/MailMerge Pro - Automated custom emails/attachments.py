@@ -0,0 +1,116 @@
+import os
+import mmap
+import zipfile
+import binascii
+import tempfile
+
+# What to do with an email larger than the server accepts, decided before anything is sent:
+#   reject   - do not send it, the recipients are recorded as failed
+#   compress - attach the PDF zipped instead (PDFs are mostly compressed already, so this
+#              only helps some); rejected if still too large
+#   split    - send the PDF in numbered parts over several emails, to be joined again
+REJECT = 'reject'
+COMPRESS = 'compress'
+SPLIT = 'split'
+SIZE_POLICIES = (REJECT, COMPRESS, SPLIT)
+
+# Attachments up to this size are base64 encoded once and kept in memory for all of their
+# recipients; larger ones are encoded again for every email, straight from the file onto
+# the connection, so they never sit in memory whole
+DEFAULT_STREAM_BYTES = 4 * 1024 * 1024
+
+# Bytes per base64 line (76 characters) and lines encoded at a time when streaming
+LINE_BYTES = 57
+CHUNK_LINES = 1024
+
+# Pages of a streamed file given back to the system at a time
+RELEASE_BYTES = 1024 * 1024
+
+# Room left under the server's limit for the To header, which differs per recipient, and
+# when splitting also for the note on joining the parts
+TO_HEADER_ROOM = 1024
+SPLIT_MARGIN = 4096
+
+# An email over the size limit that the size policy could not make fit
+class MessageTooLarge(Exception):
+    def __init__(self, invoice_id, size, limit, detail=''):
+        super().__init__(f"email for invoice {invoice_id} is {size / 1024 / 1024:.1f} MB, "
+                         f"the server accepts {limit / 1024 / 1024:.1f} MB{detail}")
+        self.size = size
+        self.limit = limit
+
+# Function to give the length of data base64 encoded in 76 character lines ending in CRLF
+def encoded_length(length):
+    characters = (length + 2) // 3 * 4
+    return characters + (characters + 75) // 76 * 2
+
+# Function to base64 encode data (a multiple of 57 bytes, except at the end) into
+# 76 character lines ending in CRLF
+def encode_lines(data):
+    encoded = binascii.b2a_base64(data, newline=False)
+    return b'\r\n'.join([encoded[i:i + 76] for i in range(0, len(encoded), 76)]) + b'\r\n'
+
+# Function to yield the base64 lines of length bytes of a file from offset, CHUNK_LINES at
+# a time. The file is memory-mapped and each chunk encoded from a view of the mapping, so
+# the file is never read into memory as a whole. Where the system allows, the pages
+# already sent are handed back as it goes, so they do not stay resident.
+def iter_encoded(path, offset, length):
+    if length <= 0:
+        return
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        release = hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_DONTNEED')
+        if release:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        released = offset - offset % mmap.PAGESIZE
+        view = memoryview(mapped)
+        try:
+            step = LINE_BYTES * CHUNK_LINES
+            for start in range(offset, offset + length, step):
+                end = min(start + step, offset + length)
+                yield encode_lines(view[start:end])
+                if release and end - released >= RELEASE_BYTES:
+                    done = end - end % mmap.PAGESIZE
+                    mapped.madvise(mmap.MADV_DONTNEED, released, done - released)
+                    released = done
+        finally:
+            view.release()
+
+# The body of one attachment (or one part of it): length bytes of path from offset,
+# encoded once into memory, or streamed from the file when larger than stream_bytes.
+# size is the encoded length, memory what is held in memory.
+class AttachmentBody:
+    def __init__(self, path, offset, length, stream_bytes=DEFAULT_STREAM_BYTES):
+        self.path = path
+        self.offset = offset
+        self.length = length
+        self.size = encoded_length(length)
+        self.encoded = None
+        if length <= stream_bytes:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                self.encoded = encode_lines(f.read(length)) if length else b''
+        self.memory = len(self.encoded) if self.encoded is not None else 0
+
+    def chunks(self):
+        if self.encoded is not None:
+            return [self.encoded]
+        return iter_encoded(self.path, self.offset, self.length)
+
+# Function to zip a PDF into a new file in directory, returning its path
+def compress_file(path, arcname, directory=None):
+    handle, zip_path = tempfile.mkstemp(suffix='.zip', dir=directory)
+    os.close(handle)
+    try:
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as archive:
+            archive.write(path, arcname)
+    except BaseException:
+        os.remove(zip_path)
+        raise
+    return zip_path
+
+# Function to work out the part size (a whole number of base64 lines) that keeps emails
+# with overhead bytes besides the attachment under limit, or None if nothing fits
+def split_part_bytes(limit, overhead):
+    room = limit - overhead - SPLIT_MARGIN
+    lines = room // (76 + 2)
+    return lines * LINE_BYTES if lines > 0 else None
@@ -0,0 +1,121 @@
+# Benchmark for reading very large contact lists.
+#
+# Generates a CSV of --rows invoices with 1-3 addresses each, sprinkled with duplicate
+# addresses, invalid addresses, rows without an invoice ID and "Name <address>" cells, then
+# times:
+#   - the original loop: csv.reader, skip the header, take every column after the first
+#   - contacts.iter_contacts: validation, normalisation and de-duplication
+#   - merge_plan.build_send_plan on the same CSV, with a PDF for every invoice
+# and prints rows/s for each. --memory also reports the peak memory of each (tracemalloc,
+# which slows the runs down) and the duplicate set against a Python set of tuples.
+#
+# Usage:
+#   python bench_contacts.py                     # 1,000,000 rows
+#   python bench_contacts.py --rows 200000 --memory
+import os
+import sys
+import csv
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from contacts import iter_contacts, IngestStats, PairSet
+from merge_plan import build_send_plan
+
+# Function to write the CSV
+def build_csv(directory, rows):
+    csv_path = os.path.join(directory, 'contacts.csv')
+    rng = random.Random(42)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Company', 'email', '', ''])
+        for i in range(rows):
+            invoice_id = f'INV{i:07d}'
+            addresses = [f'user{i}.{n}@example{n}.com' for n in range(rng.randint(1, 3))]
+            roll = rng.random()
+            if roll < 0.02:
+                addresses.append(addresses[0].upper())                    # duplicate, other case
+            elif roll < 0.03:
+                addresses.append(f'user{i} at example.com')               # invalid
+            elif roll < 0.04:
+                addresses[0] = f'"User {i}" <{addresses[0]}>'             # display name
+            elif roll < 0.045:
+                invoice_id = ''                                           # missing invoice ID
+            writer.writerow([invoice_id] + addresses)
+    return csv_path
+
+# The loop as it was in EmailGUI.send_email, without the PDF lookup
+def legacy_read(csv_path):
+    recipients = 0
+    with open(csv_path, 'r') as csv_file:
+        reader = csv.reader(csv_file, delimiter=',')
+        next(reader)
+        for row in reader:
+            recipients += len(row[1:])
+    return recipients
+
+# Function to run func, returning (result, seconds, peak bytes or None)
+def measure(func, memory):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def report(label, rows, elapsed, peak):
+    line = f"{label:<18}: {elapsed:7.2f}s ({rows / elapsed:10,.0f} rows/s)"
+    if peak is not None:
+        line += f", peak {peak / 1024 / 1024:7.1f} MB"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MailMerge contact list ingestion')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='number of CSV rows')
+    parser.add_argument('--memory', action='store_true', help='also measure peak memory (slower)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='mailmerge-bench-')
+    try:
+        print(f"Generating {args.rows:,} rows under {directory} ...")
+        csv_path = build_csv(directory, args.rows)
+        print(f"CSV is {os.path.getsize(csv_path) / 1024 / 1024:.0f} MB")
+
+        _, elapsed, peak = measure(lambda: legacy_read(csv_path), args.memory)
+        report('original loop', args.rows, elapsed, peak)
+
+        stats = IngestStats()
+        _, elapsed, peak = measure(lambda: sum(1 for _ in iter_contacts(csv_path, stats=stats)), args.memory)
+        report('iter_contacts', args.rows, elapsed, peak)
+        print(f"  {stats.summary()}")
+
+        # Every invoice has a PDF, so the plan does a lookup per row like a real run
+        pdfs = {f'INV{i:07d}': f'INV{i:07d}.pdf' for i in range(args.rows)}
+        plan, elapsed, peak = measure(lambda: build_send_plan(csv_path, directory, pdfs=pdfs), args.memory)
+        report('build_send_plan', args.rows, elapsed, peak)
+        print(f"  {plan.summary()}")
+
+        if args.memory:
+            pairs = [(f'INV{i:07d}', f'user{i}.0@example0.com') for i in range(args.rows)]
+            _, _, peak = measure(lambda: set(pairs), True)
+            print(f"set of tuples     : {peak / 1024 / 1024:7.1f} MB for {args.rows:,} pairs, not counting the tuples and strings it holds")
+            def fill():
+                seen = PairSet()
+                for invoice_id, address in pairs:
+                    seen.add(invoice_id, address)
+                return seen
+            _, _, peak = measure(fill, True)
+            print(f"PairSet           : {peak / 1024 / 1024:7.1f} MB for {args.rows:,} pairs")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
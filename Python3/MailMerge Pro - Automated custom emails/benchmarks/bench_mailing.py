@@ -0,0 +1,231 @@
+# End-to-end benchmark and test harness for a whole mailing, without the real mail server.
+#
+# Generates a contact list of --invoices invoices with --recipients addresses each and a
+# PDF of --pdf-mb per invoice, starts an SMTP sink on localhost that accepts and counts
+# every email, then runs the mailing the way the GUI and the command
+# line do (engine.Mailing: send plan, then a SendJob) and reports:
+#   - end-to-end emails/s and the time to the first email the sink accepted
+#   - seconds per stage: plan (CSV and PDF folder), build (template and PDF), encode
+#     (MIME and base64) and send (SMTP), the last three summed over processes and connections
+#   - peak RSS of the run, and of the render processes (not available on Windows)
+# It exits with 1 if the sink did not receive every email or any failed, so it can be run
+# before a month-end mailing to catch regressions. --dry-run builds every email without
+# the sink (SendJob dry_run). The in-process sink shares the interpreter with the sending
+# threads and holds each email in memory while receiving it, which slows the sending and
+# counts towards the peak RSS; --sink-process runs it in a process of its own instead.
+#
+# Usage:
+#   python bench_mailing.py                                      # 1,000 invoices x 3 recipients x 200 KB
+#   python bench_mailing.py --invoices 10000 --recipients 3 --pdf-mb 2 --data /tmp/month-end
+#   python bench_mailing.py --connections 8 --render-workers 4 --latency 0.05 --sink-process
+#   python bench_mailing.py --dry-run --html
+import os
+import sys
+import csv
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import engine
+from smtp_pool import SmtpSettings
+from send_job import FINISHED
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+SUBJECT = "Invoice {{ invoice_id }} for {{ company }}"
+BODY = "Dear {{ contact | customer }},\n\nPlease find invoice {{ invoice_id }} for {{ company }} attached.\n"
+HTML_BODY = "<p>Dear {{ contact | customer }},</p><p>Please find invoice <b>{{ invoice_id }}</b> attached.</p>"
+
+# Minimal SMTP server that accepts every email and throws it away, counting emails and
+# bytes in shared values so the counts can be read when it runs in its own process. The
+# message data is read in bulk up to the closing "." line instead of line by line, so the
+# sink keeps up with the sending it measures.
+class SmtpSink:
+    def __init__(self, port, latency, received, received_bytes):
+        self.port = port
+        self.latency = latency
+        self.received = received
+        self.bytes = received_bytes
+
+    async def handle(self, reader, writer):
+        writer.write(b'220 localhost sink\r\n')
+        recipients = 0
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b'EHLO':
+                    writer.write(b'250-localhost\r\n250-8BITMIME\r\n250 SIZE 0\r\n')
+                elif command == b'RCPT':
+                    recipients += 1
+                    writer.write(b'250 OK\r\n')
+                elif command == b'DATA':
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                    await writer.drain()
+                    data = await reader.readuntil(b'\r\n.\r\n')
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    with self.received.get_lock():
+                        self.received.value += recipients
+                        self.bytes.value += len(data) * recipients
+                    recipients = 0
+                    writer.write(b'250 Message accepted for delivery\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    break
+                else:
+                    if command in (b'MAIL', b'RSET'):
+                        recipients = 0
+                    writer.write(b'250 OK\r\n')
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, ready, stop):
+        server = await asyncio.start_server(self.handle, '127.0.0.1', self.port, limit=1 << 30)
+        ready.set()
+        async with server:
+            while not stop.is_set():
+                await asyncio.sleep(0.1)
+
+    def run(self, ready, stop):
+        asyncio.run(self.serve(ready, stop))
+
+# Function to write the contact list and PDF folder into directory, unless a previous run
+# left the same data there. Returns (csv path, PDF folder).
+def build_data(directory, invoices, recipients, pdf_bytes):
+    csv_path = os.path.join(directory, 'contacts.csv')
+    folder = os.path.join(directory, 'pdfs')
+    marker = os.path.join(directory, 'generated.txt')
+    description = f"{invoices} {recipients} {pdf_bytes}"
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if f.read() == description:
+                print(f"Reusing the data in {directory}")
+                return csv_path, folder
+    print(f"Generating {invoices:,} invoices x {recipients} recipients x {pdf_bytes / 1024 / 1024:.1f} MB in {directory} ...")
+    os.makedirs(folder, exist_ok=True)
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Invoice', 'Company', 'Contact'] + ['Email'] * recipients)
+        for i in range(invoices):
+            writer.writerow([f'INV{i:07d}', f'Company {i}', f'Contact {i}' if i % 10 else '']
+                            + [f'user{i}.{n}@example{n}.com' for n in range(recipients)])
+    # Random bytes, so the attachments cost as much to encode as real (compressed) PDFs
+    block = os.urandom(1024 * 1024)
+    for i in range(invoices):
+        with open(os.path.join(folder, f'INV{i:07d}.pdf'), 'wb') as pdf:
+            pdf.write(b'%PDF-1.4\n' + str(i).encode())
+            remaining = pdf_bytes
+            while remaining > 0:
+                pdf.write(block[:remaining])
+                remaining -= len(block)
+    with open(marker, 'w') as f:
+        f.write(description)
+    return csv_path, folder
+
+# Function to return the peak resident memory in MB of this process and of its finished
+# child processes, or (None, None) where the resource module is missing (Windows)
+def peak_rss():
+    if resource is None:
+        return None, None
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+def run(args, csv_path, folder, settings):
+    mailing = engine.Mailing('billing@example.com', SUBJECT, BODY, settings, connections=args.connections,
+                             rate=args.rate, max_attempts=1, html_body=HTML_BODY if args.html else None,
+                             render_workers=args.render_workers)
+    started = time.perf_counter()
+    plan = mailing.plan(csv_path, folder)
+    plan_seconds = time.perf_counter() - started
+    job = mailing.create_job(plan, dry_run=args.dry_run)
+    job.run()
+    elapsed = time.perf_counter() - started
+    return plan, plan_seconds, job, elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a MailMerge mailing end to end against a local SMTP sink')
+    parser.add_argument('--invoices', type=int, default=1000, help='number of invoices (CSV rows and PDFs)')
+    parser.add_argument('--recipients', type=int, default=3, help='email addresses per invoice')
+    parser.add_argument('--pdf-mb', type=float, default=0.2, help='size of each PDF in MB')
+    parser.add_argument('--data', help='keep the generated data in this folder and reuse it next time')
+    parser.add_argument('--html', action='store_true', help='also send an HTML version of the message')
+    parser.add_argument('--connections', type=int, default=4, help='SMTP connections')
+    parser.add_argument('--render-workers', type=int, default=0, help='processes rendering and encoding the emails')
+    parser.add_argument('--rate', type=float, help='emails per second limit')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated server seconds per email')
+    parser.add_argument('--port', type=int, default=8025, help='port for the local SMTP sink')
+    parser.add_argument('--sink-process', action='store_true', help='run the SMTP sink in a process of its own')
+    parser.add_argument('--dry-run', action='store_true', help='build the emails without sending them to the sink')
+    args = parser.parse_args()
+
+    directory = args.data or tempfile.mkdtemp(prefix='mailmerge-bench-')
+    os.makedirs(directory, exist_ok=True)
+    sink = None
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    try:
+        csv_path, folder = build_data(directory, args.invoices, args.recipients, int(args.pdf_mb * 1024 * 1024))
+        rss_before, _ = peak_rss()
+
+        server = SmtpSink(args.port, args.latency, multiprocessing.Value('q', 0), multiprocessing.Value('q', 0))
+        if not args.dry_run:
+            if args.sink_process:
+                sink = multiprocessing.Process(target=server.run, args=(ready, stop), daemon=True)
+            else:
+                sink = threading.Thread(target=server.run, args=(ready, stop), daemon=True)
+            sink.start()
+            if not ready.wait(30):
+                sys.exit(f"The SMTP sink did not start on port {args.port}")
+
+        plan, plan_seconds, job, elapsed = run(args, csv_path, folder, SmtpSettings('127.0.0.1', args.port))
+        rss, rss_children = peak_rss()
+        progress = job.progress()
+
+        print(f"{'dry run' if args.dry_run else 'sink'}, {args.connections} connections, "
+              f"{args.render_workers} render workers{', HTML' if args.html else ''}")
+        print(f"plan              : {plan_seconds:8.2f}s  {plan.summary()}")
+        for stage in ('build', 'encode', 'send'):
+            print(f"{stage:<18}: {job.stage_seconds[stage]:8.2f}s")
+        first = job.time_to_first_send
+        if first is not None:
+            print(f"time to first send: {plan_seconds + first:8.2f}s  ({first:.2f}s after the plan)")
+        else:
+            print("time to first send:      n/a")
+        print(f"end to end        : {elapsed:8.2f}s  {progress.sent / elapsed:,.1f} emails/s ({progress.summary()})")
+        if rss is not None:
+            print(f"peak RSS          : {rss:8.1f} MB (before the run {rss_before:.1f} MB, render processes {rss_children:.1f} MB)")
+        if not args.dry_run:
+            print(f"sink received     : {server.received.value} emails, {server.bytes.value / 1024 / 1024:,.1f} MB")
+
+        expected = plan.message_count
+        if job.state != FINISHED or progress.failed or progress.sent != expected or (
+                not args.dry_run and server.received.value != expected):
+            print(f"FAILED: expected {expected} emails, {progress.sent} sent, {progress.failed} failed, "
+                  f"{server.received.value} received, job {job.state} {job.error or ''}")
+            return 1
+        return 0
+    finally:
+        if sink is not None:
+            stop.set()
+            sink.join(30)
+        if not args.data:
+            shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    sys.exit(main())
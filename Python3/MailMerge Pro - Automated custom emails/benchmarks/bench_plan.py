@@ -0,0 +1,85 @@
+# Benchmark for matching the contact CSV to the PDF folder.
+#
+# Generates a CSV of --rows invoices (3 recipients each) and a folder of empty PDFs,
+# one per invoice except every 50th, plus some PDFs no row refers to. Then times:
+#   - the original join: os.listdir of the folder for every row and a scan of every PDF
+#     name, timed on the first --legacy-rows rows and extrapolated to the full CSV
+#   - merge_plan.build_send_plan: one folder listing, a dict lookup per row
+#
+# Usage:
+#   python bench_plan.py                         # 100,000 rows
+#   python bench_plan.py --rows 20000 --legacy-rows 2000
+import os
+import sys
+import csv
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from merge_plan import build_send_plan
+
+# Function to write the CSV and the PDF folder
+def build_data(directory, rows):
+    folder = os.path.join(directory, 'pdfs')
+    os.makedirs(folder)
+    csv_path = os.path.join(directory, 'contacts.csv')
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Company', 'email', '', ''])
+        for i in range(rows):
+            invoice_id = f'INV{i:07d}'
+            writer.writerow([invoice_id, f'a{i}@example.com', f'b{i}@example.com', f'c{i}@example.com'])
+            if i % 50:
+                open(os.path.join(folder, f'{invoice_id}.pdf'), 'wb').close()
+    for i in range(rows // 100):
+        open(os.path.join(folder, f'ORPHAN{i:07d}.pdf'), 'wb').close()
+    return csv_path, folder
+
+# The join as it was in EmailGUI.send_email, without building or sending the emails.
+# Returns the number of (invoice, recipient) pairs found.
+def legacy_join(csv_path, folder, max_rows):
+    found = 0
+    with open(csv_path, 'r') as csv_file:
+        reader = csv.reader(csv_file, delimiter=',')
+        next(reader)
+        for row_index, row in enumerate(reader):
+            if row_index >= max_rows:
+                break
+            for pdf in [file for file in os.listdir(folder) if file.endswith('.pdf')]:
+                invoice_ID = pdf[0:-4]
+                if row[0] != invoice_ID:
+                    continue
+                found += len(row[1:])
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the MailMerge CSV/PDF join')
+    parser.add_argument('--rows', type=int, default=100_000, help='number of CSV rows')
+    parser.add_argument('--legacy-rows', type=int, default=200, help='rows to time the original join on (0 to skip)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='mailmerge-bench-')
+    try:
+        print(f"Generating {args.rows:,} rows and PDFs under {directory} ...")
+        csv_path, folder = build_data(directory, args.rows)
+
+        if args.legacy_rows:
+            rows = min(args.legacy_rows, args.rows)
+            start = time.perf_counter()
+            legacy_join(csv_path, folder, rows)
+            elapsed = time.perf_counter() - start
+            print(f"original join   : {elapsed:8.2f}s for {rows:,} rows, "
+                  f"~{elapsed / rows * args.rows:,.0f}s estimated for {args.rows:,} rows")
+
+        start = time.perf_counter()
+        plan = build_send_plan(csv_path, folder)
+        elapsed = time.perf_counter() - start
+        print(f"build_send_plan : {elapsed:8.2f}s for {args.rows:,} rows ({args.rows / elapsed:,.0f} rows/s)")
+        print(f"  {plan.summary()}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# Benchmark for the SMTP delivery pool against a local stand-in mail server.
+#
+# Starts an aiosmtpd server on localhost that accepts and counts every message, waiting
+# --latency seconds per message to stand in for a real server's processing time, then
+# sends --messages emails:
+#   - serially over one connection, like the original send_email loop
+#   - through smtp_pool.DeliveryPool with each requested number of connections
+# and prints messages/sec for each run. Needs aiosmtpd (pip install aiosmtpd).
+#
+# Usage:
+#   python bench_smtp.py
+#   python bench_smtp.py --messages 2000 --latency 0.02 --connections 1 2 4 8 16
+#   python bench_smtp.py --rate 50                    # check the throttle holds
+import os
+import sys
+import time
+import asyncio
+import smtplib
+import argparse
+import threading
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from email.mime.application import MIMEApplication
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from smtp_pool import DeliveryPool, SmtpSettings, OutgoingMessage
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    sys.exit("This benchmark needs aiosmtpd: pip install aiosmtpd")
+
+# aiosmtpd handler that accepts everything and counts what it received
+class CountingHandler:
+    def __init__(self, latency):
+        self.latency = latency
+        self.received = 0
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self.lock:
+            self.received += len(envelope.rcpt_tos)
+        return '250 Message accepted for delivery'
+
+# Function to build one test email with a small PDF-like attachment
+def build_message(index, attachment):
+    message = MIMEMultipart()
+    message["From"] = 'sender@example.com'
+    message["To"] = f'user{index}@example.com'
+    message["Subject"] = f'Invoice {index}'
+    message.attach(MIMEText('Please find your invoice attached.', 'plain'))
+    part = MIMEApplication(attachment, _subtype='pdf')
+    part.add_header('Content-Disposition', 'attachment', filename=f'INV{index}.pdf')
+    message.attach(part)
+    return message.as_string()
+
+# The original loop: one connection, one sendmail call after another
+def send_serial(settings, messages):
+    start = time.perf_counter()
+    server = smtplib.SMTP(settings.host, settings.port)
+    for index, message in enumerate(messages):
+        server.sendmail('sender@example.com', f'user{index}@example.com', message)
+    server.quit()
+    return len(messages) / (time.perf_counter() - start)
+
+def send_pooled(settings, messages, connections, rate):
+    pool = DeliveryPool(settings, connections=connections, rate=rate)
+    pool.start()
+    try:
+        for index, message in enumerate(messages):
+            pool.submit(OutgoingMessage(index, 'sender@example.com', f'user{index}@example.com', message))
+    finally:
+        pool.close()
+    if pool.failed:
+        print(f"  {pool.failed} messages failed")
+    return pool.messages_per_second()
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MailMerge SMTP throughput by connection count')
+    parser.add_argument('--messages', type=int, default=500, help='number of emails to send per run')
+    parser.add_argument('--attachment-kb', type=int, default=100, help='attachment size in KB')
+    parser.add_argument('--latency', type=float, default=0.01, help='simulated server seconds per message')
+    parser.add_argument('--connections', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--rate', type=float, help='messages/sec limit for the pooled runs')
+    parser.add_argument('--port', type=int, default=8025, help='port for the local SMTP server')
+    args = parser.parse_args()
+
+    handler = CountingHandler(args.latency)
+    controller = Controller(handler, hostname='127.0.0.1', port=args.port, data_size_limit=0)
+    controller.start()
+    try:
+        settings = SmtpSettings('127.0.0.1', args.port)
+        attachment = os.urandom(args.attachment_kb * 1024)
+        messages = [build_message(index, attachment) for index in range(args.messages)]
+
+        print(f"{args.messages} emails with a {args.attachment_kb} KB attachment, {args.latency * 1000:.0f}ms server latency")
+        print(f"serial (original)  : {send_serial(settings, messages):8.1f} messages/s")
+        for connections in args.connections:
+            rate = send_pooled(settings, messages, connections, args.rate)
+            print(f"pool {connections:2d} connections: {rate:8.1f} messages/s")
+        print(f"server received {handler.received} messages")
+    finally:
+        controller.stop()
+
+if __name__ == '__main__':
+    main()
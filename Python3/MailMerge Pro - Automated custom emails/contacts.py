@@ -0,0 +1,257 @@
+import re
+import csv
+import time
+import codecs
+from array import array
+from email.utils import getaddresses
+from templates import field_key
+
+# Rows handed on at a time. Together with the duplicate set this is all that is held in
+# memory, however long the CSV is.
+DEFAULT_CHUNK_ROWS = 10000
+
+# Problems kept for the report; beyond this they are only counted
+MAX_REPORTED_ISSUES = 1000
+
+# Bytes read to decide between UTF-8 and the Windows code page Excel saves CSVs in
+ENCODING_SAMPLE_BYTES = 1024 * 1024
+
+# Why a row, or part of one, was not used
+MISSING_INVOICE_ID = 'missing invoice ID'
+INVALID_ADDRESS = 'invalid email address'
+DUPLICATE_RECIPIENT = 'duplicate recipient'
+UNREADABLE_ROW = 'unreadable row'
+
+# A plausible address: a local part without spaces or separators (and no leading, trailing
+# or doubled dots), one @, and a domain of at least two labels of letters, digits and inner hyphens
+ADDRESS = re.compile(r"(?!\.)(?!.*\.\.)[^\s@<>()\[\],;:\"\\]{1,64}(?<!\.)@"
+                     r"(?:[^\W_](?:[\w-]{0,61}[^\W_])?\.)+[^\W_](?:[\w-]{0,61}[^\W_])?")
+# A cell holding nothing but one bare address (or garbage without any separators)
+SIMPLE_CELL = re.compile(r"[^\s<>()\[\],;:\"\\]+")
+
+# Function to check an address is plausible (see ADDRESS)
+def is_valid_address(address):
+    return len(address) <= 254 and ADDRESS.fullmatch(address) is not None
+
+# Function to split one CSV cell into normalised addresses. A cell may hold several
+# addresses separated by ';' or ',' and may use "Name <address>" or mailto: forms.
+# Returns (addresses, invalid parts).
+def parse_addresses(cell):
+    cell = cell.strip()
+    # Almost every cell is one bare, valid address; email.utils' parser is only needed for the rest
+    if is_valid_address(cell):
+        local, _, domain = cell.rpartition('@')
+        return [cell if domain.islower() else f"{local}@{domain.lower()}"], []
+    parts = [cell] if SIMPLE_CELL.fullmatch(cell) else [address for _, address in getaddresses([cell.replace(';', ',')])]
+    addresses = []
+    invalid = []
+    for address in parts:
+        address = address.strip()
+        if address[:7].lower() == 'mailto:':
+            address = address[7:]
+        if not address:
+            continue
+        local, _, domain = address.rpartition('@')
+        # Domains are case-insensitive, local parts are not (strictly), so only the domain is lowered
+        address = f"{local}@{domain.lower().rstrip('.')}" if local else address
+        if is_valid_address(address):
+            addresses.append(address)
+        else:
+            invalid.append(address)
+    return addresses, invalid
+
+# Function to guess the encoding of a CSV: UTF-8 (with or without a byte order mark) when
+# the start of the file decodes as UTF-8, otherwise the Windows code page Excel uses
+def detect_encoding(csv_path):
+    with open(csv_path, 'rb') as csv_file:
+        sample = csv_file.read(ENCODING_SAMPLE_BYTES)
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return 'cp1252'
+    return 'utf-8-sig'
+
+# Compact set of (invoice ID, recipient) pairs for finding duplicates in big contact lists.
+# Only a 64-bit hash of each pair is stored, in an open addressing table of 8 byte slots,
+# about a sixth of the memory of a Python set of tuples. Two different pairs with the same
+# hash would be taken for duplicates; with 64 bits that is vanishingly unlikely even for
+# millions of pairs.
+class PairSet:
+    def __init__(self, capacity=1 << 16):
+        self.slots = array('Q', bytes(8 * capacity))
+        self.mask = capacity - 1
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    # Function to add a pair, returning False if it was already there
+    def add(self, invoice_id, recipient):
+        key = hash((invoice_id, recipient)) & 0xFFFFFFFFFFFFFFFF or 1
+        slots, mask = self.slots, self.mask
+        index = key & mask
+        while True:
+            slot = slots[index]
+            if slot == 0:
+                break
+            if slot == key:
+                return False
+            index = (index + 1) & mask
+        slots[index] = key
+        self.count += 1
+        if self.count * 2 > mask:
+            self.grow()
+        return True
+
+    def grow(self):
+        old = self.slots
+        self.slots = array('Q', bytes(16 * len(old)))
+        self.mask = len(self.slots) - 1
+        slots, mask = self.slots, self.mask
+        for key in old:
+            if key:
+                index = key & mask
+                while slots[index]:
+                    index = (index + 1) & mask
+                slots[index] = key
+
+# Counters and problems found while reading a contact list
+class IngestStats:
+    def __init__(self):
+        self.rows = 0
+        self.contacts = 0
+        self.recipients = 0
+        self.duplicates = 0
+        self.invalid_addresses = 0
+        self.malformed_rows = 0
+        self.issues = []
+        self.issue_count = 0
+        self.encoding = None
+        self.header = None
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds > 0 else 0.0
+
+    # Function to note a problem with a row; only the first MAX_REPORTED_ISSUES are kept
+    def add_issue(self, row_number, reason, detail=''):
+        self.issue_count += 1
+        if len(self.issues) < MAX_REPORTED_ISSUES:
+            self.issues.append((row_number, reason, detail))
+
+    def summary(self):
+        return (f"{self.rows} rows read ({self.rows_per_second:,.0f} rows/s, {self.encoding}): "
+                f"{self.recipients} recipients, {self.duplicates} duplicates dropped, "
+                f"{self.invalid_addresses} invalid addresses, {self.malformed_rows} malformed rows")
+
+# Function to work out which columns hold email addresses from the first row. The first
+# row is a header unless one of its cells after the invoice ID is an address. With a
+# header, the address columns are those named like "email" and those left unnamed (extra
+# addresses), or every column after the invoice ID if none are; without a header, every
+# column after the invoice ID.
+def address_columns(first_row):
+    for cell in first_row[1:]:
+        if parse_addresses(cell)[0]:
+            return None, None
+    columns = [index for index, name in enumerate(first_row)
+               if index > 0 and (not name.strip() or 'mail' in name.lower())]
+    return first_row, columns or None
+
+# Function to name a row's cells for merge fields: the header's column names (normalised
+# with templates.field_key), or column1, column2, ... for unnamed columns and a CSV without a header
+def field_names(header, width):
+    header = header or []
+    return [(field_key(header[index]) if index < len(header) else '') or f"column{index + 1}"
+            for index in range(max(width, len(header)))]
+
+# Function to stream a contact CSV as lists of up to chunk_rows (row number, invoice ID,
+# recipients, fields) tuples. Addresses are validated and normalised and repeated (invoice
+# ID, recipient) pairs dropped. Malformed rows and bad addresses are counted and noted in
+# stats but never stop the read. encoding=None detects UTF-8 or Windows-1252.
+# With with_fields, fields is the row as {field name: cell} for the merge templates
+# (see field_names), plus invoice_id; otherwise it is None.
+def iter_contact_chunks(csv_path, chunk_rows=DEFAULT_CHUNK_ROWS, stats=None, encoding=None, with_fields=False):
+    stats = stats if stats is not None else IngestStats()
+    stats.encoding = encoding or detect_encoding(csv_path)
+    seen = PairSet()
+    columns = None
+    header = None
+    names = []
+    fields = None
+    chunk = []
+    started = time.perf_counter()
+    with open(csv_path, 'r', encoding=stats.encoding, errors='replace', newline='') as csv_file:
+        reader = csv.reader(csv_file, delimiter=',')
+        first = True
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                # A broken row (e.g. a NUL byte or an oversized field): report it, carry on
+                stats.rows += 1
+                stats.malformed_rows += 1
+                stats.add_issue(reader.line_num, UNREADABLE_ROW, str(e))
+                continue
+            if first:
+                first = False
+                header, columns = address_columns(row)
+                if header is not None:
+                    stats.header = header
+                    continue
+            stats.rows += 1
+            if not row:
+                continue
+            row_number = reader.line_num
+            invoice_id = row[0].strip()
+            if not invoice_id:
+                if not ''.join(row).strip():
+                    continue
+                stats.malformed_rows += 1
+                stats.add_issue(row_number, MISSING_INVOICE_ID)
+                continue
+            if '\n' in invoice_id or '\r' in invoice_id:
+                # An unbalanced quote runs the field on over the following lines
+                stats.malformed_rows += 1
+                stats.add_issue(row_number, UNREADABLE_ROW, 'unbalanced quote')
+                continue
+
+            recipients = []
+            cells = row[1:] if columns is None else [row[index] for index in columns if index < len(row)]
+            for cell in cells:
+                if not cell.strip():
+                    continue
+                addresses, invalid = parse_addresses(cell)
+                if invalid:
+                    stats.invalid_addresses += len(invalid)
+                    stats.add_issue(row_number, INVALID_ADDRESS, cell.strip())
+                for address in addresses:
+                    if seen.add(invoice_id, address.lower()):
+                        recipients.append(address)
+                    else:
+                        stats.duplicates += 1
+                        stats.add_issue(row_number, DUPLICATE_RECIPIENT, address)
+            if with_fields:
+                if len(row) > len(names):
+                    names = field_names(header, len(row))
+                fields = dict(zip(names, row))
+                fields['invoice_id'] = invoice_id
+            stats.contacts += 1
+            stats.recipients += len(recipients)
+            chunk.append((row_number, invoice_id, recipients, fields))
+            if len(chunk) >= chunk_rows:
+                stats.seconds = time.perf_counter() - started
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+    stats.seconds = time.perf_counter() - started
+
+# Function to stream a contact CSV row by row; see iter_contact_chunks
+def iter_contacts(csv_path, chunk_rows=DEFAULT_CHUNK_ROWS, stats=None, encoding=None, with_fields=False):
+    for chunk in iter_contact_chunks(csv_path, chunk_rows, stats, encoding, with_fields):
+        yield from chunk
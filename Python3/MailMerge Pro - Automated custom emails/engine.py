@@ -0,0 +1,189 @@
+# MailMerge engine: settings, logging, the send plan and send jobs, shared by the GUI
+# (MailMerge Pro.py) and the command line (mailmerge_cli.py). Nothing here imports Tk.
+import os
+import sys
+import json
+import hashlib
+import logging
+import pathlib
+from merge_plan import build_send_plan
+from smtp_pool import SmtpSettings, describe_smtp_error, DEFAULT_CONNECTIONS
+from send_job import SendJob, DEFAULT_MAX_ATTEMPTS, DEFAULT_RETRY_DELAY
+from outbox import Outbox
+from templates import MailTemplate
+from attachments import SIZE_POLICIES, REJECT
+
+logger = logging.getLogger(__name__)
+
+# Determine the directory where the script is being run
+SCRIPT_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Log file, shared by every run
+LOG_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, 'log')
+LOG_FILE = os.path.join(LOG_DIRECTORY, 'Csv_Email_Log.txt')
+
+# Every email's outcome is recorded in an outbox per CSV file (by its full path), so a
+# run that stopped can be resumed without sending anything twice
+OUTBOX_DIRECTORY = os.path.join(SCRIPT_DIRECTORY, 'outbox')
+
+# Settings file read by the GUI, and by the command line unless --config says otherwise
+CONFIG_FILE = os.path.join(SCRIPT_DIRECTORY, 'mailmerge.json')
+
+# SMTP SERVER and PORT, used when the settings file does not name one
+DEFAULT_SMTP_HOST = "SMTP-Sever"
+DEFAULT_SMTP_PORT = 25
+
+# Sending rate limit across all connections (emails per second), None for no limit
+SMTP_MESSAGES_PER_SECOND = None
+
+# Environment variable holding the SMTP password, so it need not be written in the settings file
+PASSWORD_VARIABLE = 'MAILMERGE_SMTP_PASSWORD'
+
+# Settings file keys holding paths; relative paths are taken from the settings file's folder
+PATH_KEYS = ('csv', 'pdf_folder', 'body_file', 'html_file', 'outbox')
+
+# Configure logging: the log file for every run, and the console when console_level is given.
+# Handlers go on the root logger so the sending modules log to the same file.
+def configure_logging(console_level=None, log_file=LOG_FILE):
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    root = logging.getLogger()
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    handler = logging.FileHandler(log_file)
+    handler.setFormatter(formatter)
+    root.addHandler(handler)
+    level = logging.INFO
+    if console_level is not None:
+        if isinstance(console_level, str):
+            console_level = logging.getLevelName(console_level)
+        console = logging.StreamHandler(sys.stderr)
+        console.setFormatter(formatter)
+        console.setLevel(console_level)
+        root.addHandler(console)
+        level = min(level, console_level)
+    root.setLevel(level)
+
+# Function to read the JSON settings file. A missing default file means no settings;
+# relative paths in it are resolved against the file's folder.
+def load_config(config_path=CONFIG_FILE):
+    if config_path == CONFIG_FILE and not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
+    base = os.path.dirname(os.path.abspath(config_path))
+    for key in PATH_KEYS:
+        if config.get(key):
+            config[key] = os.path.join(base, os.path.expanduser(config[key]))
+    return config
+
+# Function to build the SMTP settings from the "smtp" section of the settings file.
+# The password comes from the file or from the environment variable it names.
+def smtp_settings(config):
+    smtp = config.get('smtp', {})
+    password = smtp.get('password') or os.environ.get(smtp.get('password_env', PASSWORD_VARIABLE))
+    return SmtpSettings(smtp.get('host', DEFAULT_SMTP_HOST), int(smtp.get('port', DEFAULT_SMTP_PORT)),
+                        starttls=bool(smtp.get('starttls', False)), username=smtp.get('username'),
+                        password=password, timeout=smtp.get('timeout', 60))
+
+# Function to name the outbox of a CSV file: its name, to find it by, and a hash of its
+# resolved path, so two Contacts.csv in different folders each get an outbox of their own
+def outbox_path_for(csv_file):
+    digest = hashlib.blake2b(os.path.normcase(os.path.realpath(csv_file)).encode('utf-8'), digest_size=6).hexdigest()
+    return os.path.join(OUTBOX_DIRECTORY, f"{pathlib.Path(csv_file).stem}-{digest}.sqlite3")
+
+# Function to match the CSV to the PDF folder and log what will and will not be sent.
+# With the mailing's template, merge fields the CSV cannot fill are logged too.
+def plan_mailing(csv_file, pdf_folder, template=None):
+    plan = build_send_plan(csv_file, pdf_folder, template=template)
+    logger.info(f"Send plan: {plan.summary()}")
+    logger.info(f"Contact list: {plan.ingest.summary()}")
+    for name in plan.unknown_fields:
+        logger.error(f"Merge field {{{{ {name} }}}} is not a column of the CSV, it will be left empty")
+    for name, (count, rows) in sorted(plan.empty_fields.items()):
+        logger.warning(f"Merge field {{{{ {name} }}}} is empty in {count} rows (CSV rows {', '.join(map(str, rows[:10]))}"
+                       + (", ...)" if count > 10 else ")"))
+    for row_number, invoice_ID in plan.unmatched:
+        logger.error(f"PDF file not found for invoice ID {invoice_ID} (CSV row {row_number})")
+    for row_number, invoice_ID in plan.no_recipients:
+        logger.error(f"No email address for invoice ID {invoice_ID} (CSV row {row_number})")
+    for row_number, reason, detail in plan.ingest.issues:
+        logger.warning(f"CSV row {row_number}: {reason}" + (f" ({detail})" if detail else ""))
+    listed = len(plan.unmatched) + len(plan.no_recipients) + len(plan.ingest.issues)
+    total = plan.unmatched_count + plan.no_recipients_count + plan.ingest.issue_count
+    if total > listed:
+        logger.warning(f"... and {total - listed} more CSV rows with problems, not listed")
+    for invoice_ID, pdf_path in plan.orphans:
+        logger.warning(f"PDF file {pdf_path} has no row in the CSV")
+    return plan
+
+# Function to log the outcome of one email
+def log_delivery(result):
+    invoice_ID, recipient_email, subject, _ = result.job.key
+    if result.ok:
+        logger.info(f"Email {subject} sent {invoice_ID} document to {recipient_email}")
+    else:
+        logger.error(f"Failed to send {invoice_ID} to {recipient_email}: {describe_smtp_error(result.error)}")
+
+# One mailing: who it is from, what it says and how it is sent. The GUI fills it from its
+# fields, the command line from its arguments; both take the rest from the settings file.
+# subject, body and html_body are templates with {{ column }} merge fields (see templates.py),
+# compiled once here for the whole run.
+class Mailing:
+    def __init__(self, sender, subject, body, smtp, connections=DEFAULT_CONNECTIONS, rate=SMTP_MESSAGES_PER_SECOND,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY, html_body=None, render_workers=0,
+                 size_policy=REJECT, max_message_bytes=None):
+        self.sender = sender
+        self.template = MailTemplate(subject, body, html_body)
+        self.smtp = smtp
+        self.connections = connections
+        self.rate = rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.render_workers = render_workers
+        self.size_policy = size_policy
+        self.max_message_bytes = max_message_bytes
+
+    # Function to match the CSV to the PDF folder, checking the merge fields against the CSV
+    def plan(self, csv_file, pdf_folder):
+        return plan_mailing(csv_file, pdf_folder, self.template)
+
+    # Function to create the send job for a plan; call start() or run() on it. dry_run builds
+    # every email without sending any.
+    def create_job(self, plan, outbox=None, resume=False, retry_failed=False, on_result=None, on_progress=None,
+                   dry_run=False):
+        return SendJob(plan, self.sender, self.template, self.smtp, connections=self.connections,
+                       rate=self.rate, on_result=on_result, on_progress=on_progress, outbox=outbox, resume=resume,
+                       retry_failed=retry_failed, max_attempts=self.max_attempts, retry_delay=self.retry_delay,
+                       render_workers=self.render_workers, dry_run=dry_run, size_policy=self.size_policy,
+                       max_message_bytes=self.max_message_bytes)
+
+# Function to create a Mailing with the sending options of the settings file
+def mailing_from_config(config, sender, subject, body, html_body=None):
+    rate = config.get('rate', SMTP_MESSAGES_PER_SECOND)
+    size_policy = config.get('size_policy', REJECT)
+    if size_policy not in SIZE_POLICIES:
+        raise ValueError(f"size_policy must be one of {', '.join(SIZE_POLICIES)}, not {size_policy!r}")
+    max_message_mb = config.get('max_message_mb')
+    return Mailing(sender, subject, body, smtp_settings(config),
+                   connections=int(config.get('connections', DEFAULT_CONNECTIONS)),
+                   rate=float(rate) if rate else None,
+                   max_attempts=int(config.get('max_attempts', DEFAULT_MAX_ATTEMPTS)),
+                   retry_delay=float(config.get('retry_delay', DEFAULT_RETRY_DELAY)),
+                   html_body=html_body, render_workers=int(config.get('render_workers', 0)), size_policy=size_policy,
+                   max_message_bytes=int(float(max_message_mb) * 1024 * 1024) if max_message_mb else None)
+
+# Function to read the message texts named in the settings: body_file and html_file,
+# returned as (body, html body or None)
+def read_message_files(config):
+    body = config.get('body', '')
+    if config.get('body_file'):
+        with open(config['body_file'], 'r', encoding='utf-8') as body_file:
+            body = body_file.read()
+    html_body = None
+    if config.get('html_file'):
+        with open(config['html_file'], 'r', encoding='utf-8') as html_file:
+            html_body = html_file.read()
+    return body, html_body
+
+# Function to open the outbox of a CSV file (or the given path)
+def open_outbox(csv_file, outbox_path=None):
+    return Outbox(outbox_path or outbox_path_for(csv_file))
@@ -0,0 +1,278 @@
+# MailMerge command line, for scheduled and scripted invoice runs.
+#
+#   python mailmerge_cli.py send --config invoices.json
+#   python mailmerge_cli.py send --csv Contacts.csv --pdf-folder Emails --sender billing@example.com
+#                                --subject "Your invoice" --body-file body.txt --smtp-host mail.example.com
+#   python mailmerge_cli.py send --config invoices.json --resume
+#   python mailmerge_cli.py send --config invoices.json --dry-run
+#   python mailmerge_cli.py send --config invoices.json --subject "Invoice {{ invoice_id }} for {{ Company }}"
+#                                --html-file body.html --render-workers 4
+#   python mailmerge_cli.py plan --config invoices.json
+#   python mailmerge_cli.py report --csv Contacts.csv --state failed
+#   python mailmerge_cli.py gui
+#
+# Settings come from a JSON file (--config, default mailmerge.json next to this script) and
+# can be overridden by arguments. Results are written as JSON lines (one object per email
+# plus a final summary) to stdout or --output; log messages go to stderr and the log file.
+# Tk is only imported by the gui subcommand.
+import os
+import sys
+import csv
+import json
+import runpy
+import logging
+import argparse
+import threading
+
+from smtp_pool import describe_smtp_error
+from send_job import FINISHED
+import engine
+from attachments import SIZE_POLICIES
+
+# Script the gui subcommand runs
+GUI_SCRIPT = os.path.join(engine.SCRIPT_DIRECTORY, 'MailMerge Pro.py')
+
+# Writes one JSON object per line; results arrive from the SMTP connection threads too
+class JsonLinesWriter:
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+
+def add_mailing_arguments(parser):
+    parser.add_argument('--config', default=engine.CONFIG_FILE, help='JSON settings file')
+    parser.add_argument('--csv', help='CSV file of invoice IDs and email addresses')
+    parser.add_argument('--pdf-folder', help='folder with one <invoice ID>.pdf per invoice')
+
+# The message texts; plan checks their merge fields against the CSV, send renders them
+def add_message_arguments(parser):
+    parser.add_argument('--subject', help='email subject; {{ column }} inserts a CSV column')
+    body = parser.add_mutually_exclusive_group()
+    body.add_argument('--body', help='email message; {{ column }} inserts a CSV column')
+    body.add_argument('--body-file', help='file with the email message')
+    parser.add_argument('--html-file', help='file with an HTML version of the email message')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='mailmerge', description='Email invoice PDFs to the addresses in a CSV file.')
+    parser.add_argument('--output', help='write JSON lines here instead of stdout')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='console log level')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    send = subparsers.add_parser('send', help='send the invoices')
+    add_mailing_arguments(send)
+    add_message_arguments(send)
+    send.add_argument('--sender', help='sender email address')
+    send.add_argument('--smtp-host', help=f'SMTP server (default {engine.DEFAULT_SMTP_HOST})')
+    send.add_argument('--smtp-port', type=int, help=f'SMTP port (default {engine.DEFAULT_SMTP_PORT})')
+    send.add_argument('--starttls', action='store_true', default=None, help='use STARTTLS')
+    send.add_argument('--username', help=f'SMTP user name; the password is read from ${engine.PASSWORD_VARIABLE}')
+    send.add_argument('--connections', type=int, help='SMTP connections sending in parallel')
+    send.add_argument('--rate', type=float, help='emails per second limit across all connections')
+    send.add_argument('--max-attempts', type=int, help='tries per email for temporary errors')
+    send.add_argument('--size-policy', choices=SIZE_POLICIES,
+                      help='for emails larger than the server accepts: reject (default), compress or split them')
+    send.add_argument('--max-message-mb', type=float,
+                      help='largest email to send in MB, if lower than the server\'s limit')
+    send.add_argument('--render-workers', type=int,
+                      help='processes rendering and encoding the emails (default 0: on the sending thread)')
+    outbox = send.add_mutually_exclusive_group()
+    outbox.add_argument('--outbox', help='outbox file (default: one per CSV file in the outbox folder)')
+    outbox.add_argument('--no-outbox', action='store_true', help='do not record deliveries (resume is not possible)')
+    send.add_argument('--resume', action='store_true', help='only send the emails the outbox has not recorded as done')
+    send.add_argument('--retry-failed', action='store_true', help='with --resume, also retry emails that failed for good')
+    send.add_argument('--dry-run', action='store_true',
+                      help='build every email without connecting to the server or sending anything')
+    send.add_argument('--progress', type=float, metavar='SECONDS',
+                      help='also write a progress line at most every SECONDS')
+
+    plan = subparsers.add_parser('plan', help='match the CSV to the PDF folder and check the merge fields without sending')
+    add_mailing_arguments(plan)
+    add_message_arguments(plan)
+
+    report = subparsers.add_parser('report', help='report delivery states from the outbox')
+    add_mailing_arguments(report)
+    report.add_argument('--outbox', help='outbox file (default: the CSV file\'s outbox)')
+    report.add_argument('--state', help='only list deliveries in this state (e.g. failed)')
+    report.add_argument('--summary-only', action='store_true', help='only print the per-state counts')
+
+    subparsers.add_parser('gui', help='start the MailMerge window')
+    return parser
+
+# Function to merge the arguments given on the command line over the settings file
+def settings_from_args(args):
+    config = engine.load_config(args.config)
+    for key in ('csv', 'pdf_folder', 'sender', 'subject', 'body', 'body_file', 'html_file', 'connections', 'rate',
+                'max_attempts', 'render_workers', 'size_policy', 'max_message_mb', 'outbox'):
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    if getattr(args, 'body', None) is not None:
+        config.pop('body_file', None)
+    smtp = dict(config.get('smtp', {}))
+    for key, arg in (('host', 'smtp_host'), ('port', 'smtp_port'), ('starttls', 'starttls'), ('username', 'username')):
+        value = getattr(args, arg, None)
+        if value is not None:
+            smtp[key] = value
+    config['smtp'] = smtp
+    return config
+
+# Function to check the settings a subcommand needs are there
+def require(config, *keys):
+    missing = [key for key in keys if not config.get(key)]
+    if missing:
+        raise ValueError(f"missing settings: {', '.join(missing)} (use the arguments or the settings file)")
+
+# Function to read the message files and compile the mailing's templates
+def mailing_from_settings(config):
+    body, html_body = engine.read_message_files(config)
+    return engine.mailing_from_config(config, config.get('sender'), config.get('subject', ''), body, html_body)
+
+def run_plan(args, config, emit):
+    require(config, 'csv', 'pdf_folder')
+    mailing = mailing_from_settings(config)
+    plan = mailing.plan(config['csv'], config['pdf_folder'])
+    for invoice in plan.iter_matched():
+        emit({'event': 'matched', 'row': invoice.row_number, 'invoice_id': invoice.invoice_id,
+              'pdf': invoice.pdf_path, 'recipients': invoice.recipients})
+    for row_number, invoice_id in plan.unmatched:
+        emit({'event': 'unmatched', 'row': row_number, 'invoice_id': invoice_id})
+    for row_number, invoice_id in plan.no_recipients:
+        emit({'event': 'no_recipients', 'row': row_number, 'invoice_id': invoice_id})
+    for row_number, reason, detail in plan.ingest.issues:
+        emit({'event': 'row_issue', 'row': row_number, 'reason': reason, 'detail': detail})
+    for invoice_id, pdf_path in plan.orphans:
+        emit({'event': 'orphan', 'invoice_id': invoice_id, 'pdf': pdf_path})
+    for name in plan.unknown_fields:
+        emit({'event': 'missing_field', 'field': name, 'reason': 'not a CSV column'})
+    for name, (count, rows) in sorted(plan.empty_fields.items()):
+        emit({'event': 'missing_field', 'field': name, 'reason': 'empty', 'count': count, 'rows': rows})
+    ingest = plan.ingest
+    emit({'event': 'summary', 'rows': plan.rows, 'matched': plan.matched_count, 'emails': plan.message_count,
+          'unmatched': plan.unmatched_count, 'no_recipients': plan.no_recipients_count, 'orphans': len(plan.orphans),
+          'duplicates': ingest.duplicates, 'invalid_addresses': ingest.invalid_addresses,
+          'malformed_rows': ingest.malformed_rows, 'encoding': ingest.encoding,
+          'rows_per_second': round(ingest.rows_per_second), 'unknown_fields': plan.unknown_fields,
+          'empty_fields': {name: count for name, (count, _) in plan.empty_fields.items()}})
+    return 0
+
+def run_send(args, config, emit):
+    require(config, 'csv', 'pdf_folder', 'sender', 'subject')
+    mailing = mailing_from_settings(config)
+    plan = mailing.plan(config['csv'], config['pdf_folder'])
+
+    def on_result(result):
+        invoice_id, recipient, _, _ = result.job.key
+        if args.dry_run:
+            # Keep "sent" out of the log file for emails that were only built
+            status = 'built' if result.ok else 'failed'
+        else:
+            engine.log_delivery(result)
+            status = 'sent' if result.ok else 'failed'
+        event = {'event': 'delivery', 'invoice_id': invoice_id, 'recipient': recipient, 'status': status,
+                 'attempts': result.job.attempts, 'seconds': round(result.seconds, 3)}
+        if not result.ok:
+            event['error'] = f"{describe_smtp_error(result.error)}: {result.error}"
+        emit(event)
+
+    def on_progress(progress):
+        emit({'event': 'progress', 'state': progress.state, 'sent': progress.sent, 'failed': progress.failed,
+              'remaining': progress.remaining, 'retrying': progress.retrying,
+              'messages_per_second': round(progress.messages_per_second, 1)})
+
+    outbox = None if args.no_outbox or args.dry_run else engine.open_outbox(config['csv'], config.get('outbox'))
+    if outbox is not None:
+        mismatch = outbox.csv_mismatch(config['csv'])
+        if mismatch and args.resume:
+            logging.getLogger().warning(f"{mismatch} Resuming skips the invoices and recipients it has as done.")
+        outbox.record_csv(config['csv'])
+    try:
+        job = mailing.create_job(plan, outbox=outbox, resume=args.resume, retry_failed=args.retry_failed,
+                                 on_result=on_result, on_progress=on_progress if args.progress else None,
+                                 dry_run=args.dry_run)
+        if args.progress:
+            job.progress_interval = args.progress
+        job.start()
+        try:
+            while not job.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            # Ctrl+C (or the scheduler stopping the task): stop queueing and let the emails
+            # already being sent finish, so the outbox knows exactly what went out
+            logging.getLogger().warning("Interrupted, cancelling the send")
+            job.cancel()
+            job.wait()
+    finally:
+        if outbox is not None:
+            outbox.close()
+
+    progress = job.progress()
+    summary = {'event': 'summary', 'state': job.state, 'sent': progress.sent, 'failed': progress.failed,
+               'skipped': progress.skipped, 'cancelled': progress.cancelled,
+               'done_before': progress.finished_before, 'seconds': round(progress.elapsed, 1),
+               'messages_per_second': round(progress.messages_per_second, 1),
+               'first_send_seconds': round(job.time_to_first_send, 3) if job.time_to_first_send is not None else None,
+               'stage_seconds': {stage: round(seconds, 3) for stage, seconds in job.stage_seconds.items()}}
+    if args.dry_run:
+        summary['dry_run'] = True
+    if job.error is not None:
+        summary['error'] = f"{describe_smtp_error(job.error)}: {job.error}"
+    emit(summary)
+    return 0 if job.state == FINISHED and not progress.failed and not progress.skipped else 1
+
+def run_report(args, config, emit):
+    outbox_path = args.outbox or config.get('outbox')
+    if not outbox_path:
+        require(config, 'csv')
+        outbox_path = engine.outbox_path_for(config['csv'])
+    if not os.path.exists(outbox_path):
+        logging.getLogger().error(f"No outbox found at {outbox_path}")
+        return 1
+    with engine.open_outbox(None, outbox_path) as outbox:
+        if not args.summary_only:
+            for delivery in outbox.iter_deliveries(args.state):
+                emit(dict(event='delivery', **delivery))
+        emit({'event': 'summary', 'states': outbox.counts()})
+    return 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.command == 'gui':
+        # Only the GUI needs Tk
+        runpy.run_path(GUI_SCRIPT, run_name='__main__')
+        return 0
+
+    engine.configure_logging(console_level=args.log_level)
+    try:
+        config = settings_from_args(args)
+    except (OSError, ValueError) as e:
+        logging.getLogger().error(f"Unable to read the settings file {args.config}: {e}")
+        return 2
+
+    stream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        emit = JsonLinesWriter(stream)
+        if args.command == 'plan':
+            return run_plan(args, config, emit)
+        if args.command == 'send':
+            return run_send(args, config, emit)
+        return run_report(args, config, emit)
+    except ValueError as e:
+        logging.getLogger().error(str(e))
+        return 2
+    except (OSError, csv.Error) as e:
+        logging.getLogger().error(f"Unable to read the CSV file, PDF folder or message file: {e}")
+        return 2
+    finally:
+        if args.output:
+            stream.close()
+        else:
+            stream.flush()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+from contacts import iter_contacts, field_names, IngestStats, DEFAULT_CHUNK_ROWS
+
+# Rows without a PDF or without recipients listed in the plan; beyond this they are only counted
+MAX_LISTED_ROWS = 1000
+
+# One CSV row whose invoice ID has a PDF in the folder
+class PlannedInvoice:
+    __slots__ = ('row_number', 'invoice_id', 'pdf_path', 'recipients', 'fields')
+
+    def __init__(self, row_number, invoice_id, pdf_path, recipients, fields=None):
+        self.row_number = row_number
+        self.invoice_id = invoice_id
+        self.pdf_path = pdf_path
+        self.recipients = recipients
+        self.fields = fields
+
+# Outcome of joining the CSV with the PDF folder, worked out before anything is sent:
+#   matched_count / message_count - rows with a PDF and recipients, and their emails
+#   unmatched     - (row number, invoice ID) of rows without a PDF
+#   orphans       - PDFs no row refers to, sorted by invoice ID
+#   no_recipients - (row number, invoice ID) of rows with a PDF but no valid email address
+#   ingest        - contacts.IngestStats: rows/s, duplicates, invalid addresses, malformed rows
+#   unknown_fields - merge fields of the template that are not a column of the CSV
+#   empty_fields  - {field: (matched rows where it is empty and has no default, first such row numbers)}
+# Only counts and the first MAX_LISTED_ROWS problem rows are kept, so a plan of a million
+# rows is as small as one of ten. iter_matched() reads the CSV again to hand out the
+# matched rows in CSV order.
+class SendPlan:
+    def __init__(self, csv_path=None, pdfs=None, encoding=None):
+        self.csv_path = csv_path
+        self.pdfs = pdfs if pdfs is not None else {}
+        self.encoding = encoding
+        self.matched_count = 0
+        self.message_count = 0
+        self.unmatched = []
+        self.unmatched_count = 0
+        self.orphans = []
+        self.no_recipients = []
+        self.no_recipients_count = 0
+        self.ingest = IngestStats()
+        self.rows = 0
+        self.unknown_fields = []
+        self.empty_fields = {}
+
+    def summary(self):
+        text = (f"{self.rows} rows: {self.matched_count} matched ({self.message_count} emails), "
+                f"{self.unmatched_count} without a PDF, {self.no_recipients_count} without recipients, "
+                f"{len(self.orphans)} PDFs not in the CSV")
+        if self.ingest.duplicates or self.ingest.invalid_addresses or self.ingest.malformed_rows:
+            text += (f"; {self.ingest.duplicates} duplicate recipients dropped, "
+                     f"{self.ingest.invalid_addresses} invalid addresses, {self.ingest.malformed_rows} malformed rows")
+        if self.unknown_fields:
+            text += f"; unknown merge fields: {', '.join(self.unknown_fields)}"
+        if self.empty_fields:
+            text += "; empty merge fields: " + ', '.join(f"{name} ({count} rows)" for name, (count, _) in sorted(self.empty_fields.items()))
+        return text
+
+    # Function to stream the matched rows as PlannedInvoice objects, in CSV order. With
+    # with_fields each carries its row as merge fields.
+    def iter_matched(self, chunk_rows=DEFAULT_CHUNK_ROWS, with_fields=False):
+        for row_number, invoice_id, recipients, fields in iter_contacts(self.csv_path, chunk_rows, encoding=self.encoding,
+                                                                        with_fields=with_fields):
+            pdf_path = self.pdfs.get(invoice_id)
+            if pdf_path is not None and recipients:
+                yield PlannedInvoice(row_number, invoice_id, pdf_path, recipients, fields)
+
+# Function to list the PDF folder once, returning {invoice ID: path}.
+# The invoice ID is the file name without the .pdf suffix.
+def index_pdf_folder(folder):
+    pdfs = {}
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.lower().endswith('.pdf') and entry.is_file():
+                pdfs[entry.name[:-4]] = entry.path
+    return pdfs
+
+# Function to stream the CSV rows as (row number, invoice ID, recipients, fields). See
+# contacts.iter_contact_chunks for the header, validation and duplicate handling.
+def iter_rows(csv_path, stats=None, encoding=None, with_fields=False):
+    return iter_contacts(csv_path, stats=stats, encoding=encoding, with_fields=with_fields)
+
+# Function to join the CSV with the PDF folder: the folder is listed once into a dict and
+# the CSV is streamed through it, so the join costs one lookup per row. An index from
+# index_pdf_folder may be given instead of listing the folder again. With a
+# templates.MailTemplate the plan also reports the merge fields that are not in the CSV
+# and the matched rows that would leave a field empty.
+def build_send_plan(csv_path, folder, encoding=None, pdfs=None, template=None):
+    pdfs = index_pdf_folder(folder) if pdfs is None else pdfs
+    referenced = set()
+    plan = SendPlan(csv_path, pdfs)
+    check_fields = template is not None and template.personalised
+    width = 0
+    for row_number, invoice_id, recipients, fields in iter_rows(csv_path, plan.ingest, encoding, check_fields):
+        plan.rows += 1
+        pdf_path = pdfs.get(invoice_id)
+        if pdf_path is None:
+            plan.unmatched_count += 1
+            if len(plan.unmatched) < MAX_LISTED_ROWS:
+                plan.unmatched.append((row_number, invoice_id))
+            continue
+        referenced.add(invoice_id)
+        if not recipients:
+            plan.no_recipients_count += 1
+            if len(plan.no_recipients) < MAX_LISTED_ROWS:
+                plan.no_recipients.append((row_number, invoice_id))
+            continue
+        plan.matched_count += 1
+        plan.message_count += len(recipients)
+        if check_fields:
+            width = max(width, len(fields))
+            for name in template.missing(fields):
+                count, rows = plan.empty_fields.get(name, (0, []))
+                if len(rows) < MAX_LISTED_ROWS:
+                    rows.append(row_number)
+                plan.empty_fields[name] = (count + 1, rows)
+    # Later reads of the CSV must decode it the same way
+    plan.encoding = plan.ingest.encoding
+    if check_fields:
+        plan.unknown_fields = template.unknown_fields(field_names(plan.ingest.header, width))
+        for name in plan.unknown_fields:
+            plan.empty_fields.pop(name, None)
+    plan.orphans = sorted((invoice_id, path) for invoice_id, path in pdfs.items() if invoice_id not in referenced)
+    return plan
@@ -0,0 +1,241 @@
+import os
+import re
+import time
+import uuid
+import email.policy
+import functools
+import threading
+from email.message import EmailMessage
+
+from attachments import (AttachmentBody, MessageTooLarge, compress_file, encode_lines, split_part_bytes,
+                         REJECT, COMPRESS, SPLIT, DEFAULT_STREAM_BYTES, TO_HEADER_ROOM)
+from smtp_pool import StreamedMessage
+
+# Upper bound on the encoded invoices kept in memory at once
+DEFAULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Lines starting with "." get another one in SMTP DATA (RFC 5321 4.5.2)
+LEADING_DOT = re.compile(rb'(?m)^\.')
+
+# Added to the message of each email of a split invoice
+SPLIT_NOTE = ("\n\nThis invoice is larger than the mail server accepts, so it is sent in {count} emails. "
+              "Save the attachments of all {count} and join them in order to get {filename}, for example "
+              "on Windows: copy /b {parts} {filename}")
+
+# One email of an invoice, encoded up to the attachment: the headers, the message text
+# before the attachment's base64 lines and the closing boundary after them, each already
+# dot-stuffed for SMTP. The attachment itself is an attachments.AttachmentBody.
+class MessagePart:
+    def __init__(self, sender, subject, body, html_body, attachment, filename, maintype, subtype):
+        message = EmailMessage(policy=email.policy.SMTP)
+        message["From"] = sender
+        message["Subject"] = subject
+        message.set_content(body)
+        if html_body is not None:
+            message.add_alternative(html_body, subtype="html")
+        # The attachment is serialised with a marker as its content (30 bytes, one base64
+        # line), which is cut out and replaced by the encoded file when sending
+        marker = uuid.uuid4().hex.encode()[:30]
+        message.add_attachment(marker, maintype=maintype, subtype=subtype, filename=filename)
+
+        encoded = message.as_bytes()
+        header_end = encoded.index(b'\r\n\r\n') + 2
+        marker_line = encode_lines(marker)
+        marker_at = encoded.index(marker_line, header_end)
+        self.headers = encoded[:header_end]
+        self.before = LEADING_DOT.sub(b'..', encoded[header_end:marker_at])
+        self.after = LEADING_DOT.sub(b'..', encoded[marker_at + len(marker_line):])
+        self.attachment = attachment
+        self.size = len(self.headers) + len(self.before) + attachment.size + len(self.after)
+        self.memory = len(self.headers) + len(self.before) + len(self.after) + attachment.memory
+
+    # Function to give the email's pieces for one recipient, To header included
+    def chunks(self, to_header):
+        yield self.headers + to_header + self.before
+        yield from self.attachment.chunks()
+        yield self.after
+
+# One invoice email, built once for all of its recipients.
+# Every recipient's email is the same bytes with only the To header added, so nothing is
+# re-serialised. The PDF is base64 encoded once and kept when it is small; a large one is
+# encoded again for every email straight from the file to the connection (see
+# attachments.AttachmentBody), so it is never held in memory whole.
+# With html_body the text is sent as a multipart/alternative of the plain and HTML versions.
+# compress attaches the PDF zipped, from a file made in temp_directory; part_bytes splits
+# it into parts of that many bytes, each in an email of its own.
+# size is the largest email's length on the wire, memory what the message holds in memory.
+# build_seconds times putting the message together (reading the PDF included) and
+# encode_seconds the encoding of the attachments kept in memory.
+class InvoiceMessage:
+    def __init__(self, sender, subject, body, invoice_id, pdf_path, html_body=None, compress=False,
+                 part_bytes=None, stream_bytes=DEFAULT_STREAM_BYTES, temp_directory=None):
+        started = time.perf_counter()
+        self.subject = subject
+        self.temp_path = None
+        path = pdf_path
+        filename = f"{invoice_id}.pdf"
+        maintype, subtype = "application", "pdf"
+        if compress:
+            self.temp_path = path = compress_file(pdf_path, filename, temp_directory)
+            filename = f"{invoice_id}.zip"
+            subtype = "zip"
+        length = os.path.getsize(path)
+
+        ranges = [(0, length)]
+        if part_bytes and length > part_bytes:
+            ranges = [(offset, min(part_bytes, length - offset)) for offset in range(0, length, part_bytes)]
+        count = len(ranges)
+        names = [f"{filename}.{number:03d}" for number in range(1, count + 1)] if count > 1 else [filename]
+
+        self.parts = []
+        encode_seconds = 0.0
+        for number, ((offset, size), name) in enumerate(zip(ranges, names), 1):
+            part_subject, part_body, part_html = subject, body, html_body
+            if count > 1:
+                note = SPLIT_NOTE.format(count=count, filename=filename, parts='+'.join(names))
+                part_subject = f"{subject} (part {number} of {count})"
+                part_body = body + note
+                if html_body is not None:
+                    part_html = html_body + f"<p>{note.strip()}</p>"
+            encoding = time.perf_counter()
+            attachment = AttachmentBody(path, offset, size, stream_bytes)
+            encode_seconds += time.perf_counter() - encoding
+            self.parts.append(MessagePart(sender, part_subject, part_body, part_html, attachment, name,
+                                          maintype, subtype))
+        self.size = max(part.size for part in self.parts)
+        self.memory = sum(part.memory for part in self.parts)
+        self.encode_seconds = encode_seconds
+        self.build_seconds = time.perf_counter() - started - encode_seconds
+
+    # Function to give what to send to one recipient: a smtp_pool.StreamedMessage, or a
+    # list of them when the invoice is split
+    def for_recipient(self, recipient):
+        to_header = EmailMessage(policy=email.policy.SMTP)
+        to_header["To"] = recipient
+        # as_bytes() ends with the blank line that separates headers from the body; only
+        # the To header line is wanted
+        to_header = to_header.as_bytes()[:-2]
+        messages = [StreamedMessage(functools.partial(part.chunks, to_header), part.size + len(to_header))
+                    for part in self.parts]
+        return messages[0] if len(messages) == 1 else messages
+
+    # Function to remove the zipped copy of the PDF, once every email was sent
+    def close(self):
+        if self.temp_path is not None:
+            try:
+                os.remove(self.temp_path)
+            except OSError:
+                pass
+            self.temp_path = None
+
+# Renders a templates.MailTemplate for a CSV row and builds the row's email, applying the
+# size policy (see attachments.py) when it is larger than size_limit. It is picklable, so
+# the same builder can run in the worker processes of a render pool.
+class MessageBuilder:
+    def __init__(self, sender, template, size_limit=None, size_policy=REJECT, stream_bytes=DEFAULT_STREAM_BYTES,
+                 temp_directory=None):
+        self.sender = sender
+        self.template = template
+        self.size_limit = size_limit
+        self.size_policy = size_policy
+        self.stream_bytes = stream_bytes
+        self.temp_directory = temp_directory
+
+    # Function to name the cache entry of a row: a template without merge fields gives
+    # every row of an invoice the same email, so it is encoded once per invoice
+    def cache_key(self, invoice):
+        return invoice.row_number if self.template.personalised else invoice.invoice_id
+
+    def build(self, invoice_id, pdf_path, fields=None):
+        started = time.perf_counter()
+        subject, body, html_body = self.template.render(fields or {'invoice_id': invoice_id})
+        rendered = time.perf_counter()
+        build = functools.partial(InvoiceMessage, self.sender, subject, body, invoice_id, pdf_path, html_body,
+                                  stream_bytes=self.stream_bytes, temp_directory=self.temp_directory)
+        message = build()
+        limit = self.size_limit
+        if limit and message.size + TO_HEADER_ROOM > limit:
+            size = message.size
+            if self.size_policy == COMPRESS:
+                message = build(compress=True)
+                if message.size + TO_HEADER_ROOM > limit:
+                    message.close()
+                    raise MessageTooLarge(invoice_id, size, limit, f", {message.size / 1024 / 1024:.1f} MB zipped")
+            elif self.size_policy == SPLIT:
+                overhead = size - message.parts[0].attachment.size
+                part_bytes = split_part_bytes(limit, overhead)
+                if part_bytes is None:
+                    raise MessageTooLarge(invoice_id, size, limit, ", too small a limit to split it")
+                message = build(part_bytes=part_bytes)
+                if message.size + TO_HEADER_ROOM > limit:
+                    raise MessageTooLarge(invoice_id, size, limit, f", {message.size / 1024 / 1024:.1f} MB per part")
+            else:
+                raise MessageTooLarge(invoice_id, size, limit)
+        message.build_seconds += rendered - started
+        return message
+
+# The builder of a render pool's worker process, set once by init_render_worker so it is
+# not pickled again for every row
+worker_builder = None
+
+def init_render_worker(builder):
+    global worker_builder
+    worker_builder = builder
+
+# Function run in a render pool's worker process for one row
+def build_in_worker(invoice_id, pdf_path, fields):
+    return worker_builder.build(invoice_id, pdf_path, fields)
+
+# Bounded cache of InvoiceMessage objects, keyed by MessageBuilder.cache_key, holding up
+# to max_bytes of them in memory (streamed attachments do not count). take()
+# reuses a cached message (when the same invoice is queued again) and add() stores a new
+# one, both counting the emails it will be used for; done() is called after each of those
+# emails is sent or has failed, and the message is dropped once all of them are.
+# wait_for_room() blocks while the cache is over max_bytes, which holds the CSV loop back
+# until sent invoices have been evicted.
+class MessageCache:
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.remaining = {}
+        self.size = 0
+        self.condition = threading.Condition()
+
+    # Function to return the cached message for key with uses more emails, or None
+    def take(self, key, uses):
+        with self.condition:
+            if key not in self.entries:
+                return None
+            self.remaining[key] += uses
+            return self.entries[key]
+
+    def wait_for_room(self):
+        with self.condition:
+            # A single invoice larger than the whole cache is still let through on its own
+            while self.entries and self.size >= self.max_bytes:
+                self.condition.wait()
+
+    # Function to store a message built for key; if another was stored for it meanwhile,
+    # that one is kept and returned
+    def add(self, key, entry, uses):
+        with self.condition:
+            if key in self.entries:
+                self.remaining[key] += uses
+                return self.entries[key]
+            self.entries[key] = entry
+            self.remaining[key] = uses
+            self.size += entry.memory
+            return entry
+
+    def done(self, key):
+        with self.condition:
+            if key not in self.remaining:
+                return
+            self.remaining[key] -= 1
+            if self.remaining[key] <= 0:
+                del self.remaining[key]
+                entry = self.entries.pop(key, None)
+                if entry is not None:
+                    self.size -= entry.memory
+                    entry.close()
+                self.condition.notify_all()
@@ -0,0 +1,145 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Delivery states
+QUEUED = 'queued'      # Handed to the SMTP connections
+RETRY = 'retry'        # Failed with a temporary error, will be tried again
+SENT = 'sent'
+FAILED = 'failed'      # Failed for good (rejected address, message refused, out of retries)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS deliveries (
+    invoice_id TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (invoice_id, recipient)
+);
+CREATE TABLE IF NOT EXISTS mailing (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    csv_path TEXT NOT NULL,
+    csv_size INTEGER NOT NULL,
+    csv_mtime REAL NOT NULL,
+    recorded REAL NOT NULL
+);
+"""
+
+# Persistent record of every (invoice, recipient) email of a mailing, stored in SQLite.
+#
+# Each email moves queued -> sent, or queued -> retry -> ... -> sent / failed. Records are
+# buffered and committed in groups (like FileFlow's conversion journal) so the outbox costs
+# one SQLite transaction per group rather than per email. A run that stops part way can be
+# resumed from it: only emails not recorded as sent (or failed) are sent again. After a
+# crash, emails sent in the last uncommitted group are not known to be sent and would be
+# sent again; flush() after every email if that matters more than speed.
+class Outbox:
+    def __init__(self, outbox_path, group_size=200, group_interval=1.0):
+        os.makedirs(os.path.dirname(os.path.abspath(outbox_path)), exist_ok=True)
+        self.outbox_path = outbox_path
+        self.connection = sqlite3.connect(outbox_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.pending = []
+        self.group_size = group_size
+        self.group_interval = group_interval
+        self.last_commit = time.monotonic()
+        self.commits = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def record(self, invoice_id, recipient, state, attempts=0, error=None):
+        with self.lock:
+            self.pending.append((invoice_id, recipient, state, attempts, str(error) if error else None, time.time()))
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            with self.connection:
+                self.connection.executemany(
+                    """INSERT INTO deliveries (invoice_id, recipient, state, attempts, error, updated) VALUES (?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (invoice_id, recipient) DO UPDATE SET state = excluded.state,
+                       attempts = MAX(attempts, excluded.attempts), error = excluded.error, updated = excluded.updated""",
+                    self.pending)
+            self.pending = []
+            self.last_commit = time.monotonic()
+            self.commits += 1
+
+    # Function to tell the caller a group commit is due: enough records are buffered,
+    # or the oldest buffered record has waited long enough
+    def due(self):
+        if not self.pending:
+            return False
+        return len(self.pending) >= self.group_size or time.monotonic() - self.last_commit >= self.group_interval
+
+    # Function to commit the buffered records when a group commit is due
+    def flush_if_due(self):
+        if self.due():
+            self.flush()
+
+    # Function to remember which CSV file (resolved path, size and modified time) the
+    # outbox's deliveries are for; called when a run starts
+    def record_csv(self, csv_file):
+        stat = os.stat(csv_file)
+        with self.lock:
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO mailing VALUES (1, ?, ?, ?, ?)',
+                                        (os.path.realpath(csv_file), stat.st_size, stat.st_mtime, time.time()))
+
+    # Function to tell how csv_file differs from the CSV the outbox was last used with, as a
+    # sentence for the resume prompt, or None when it is the same file or nothing is recorded
+    def csv_mismatch(self, csv_file):
+        with self.lock:
+            row = self.connection.execute('SELECT csv_path, csv_size, csv_mtime, recorded FROM mailing').fetchone()
+        if row is None:
+            return None
+        path, size, mtime, recorded = row
+        if os.path.normcase(path) != os.path.normcase(os.path.realpath(csv_file)):
+            return f"The outbox was recorded for a different CSV file, {path}."
+        stat = os.stat(csv_file)
+        if stat.st_size != size or stat.st_mtime != mtime:
+            return (f"The CSV file has changed since the run of "
+                    f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(recorded))}.")
+        return None
+
+    # Function to load the (invoice ID, recipient) pairs a resumed run should not send again:
+    # those sent, and those failed for good unless retry_failed is set
+    def finished(self, retry_failed=False):
+        self.flush()
+        states = (SENT,) if retry_failed else (SENT, FAILED)
+        query = f"SELECT invoice_id, recipient FROM deliveries WHERE state IN ({', '.join('?' * len(states))})"
+        return set(self.connection.execute(query, states))
+
+    # Function to stream every delivery as a dict, optionally only those in one state
+    def iter_deliveries(self, state=None):
+        self.flush()
+        query = 'SELECT invoice_id, recipient, state, attempts, error, updated FROM deliveries'
+        params = ()
+        if state:
+            query += ' WHERE state = ?'
+            params = (state,)
+        for invoice_id, recipient, delivery_state, attempts, error, updated in self.connection.execute(
+                query + ' ORDER BY invoice_id, recipient', params):
+            yield {'invoice_id': invoice_id, 'recipient': recipient, 'state': delivery_state,
+                   'attempts': attempts, 'error': error, 'updated': updated}
+
+    # Function to count deliveries per state
+    def counts(self):
+        self.flush()
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM deliveries GROUP BY state').fetchall())
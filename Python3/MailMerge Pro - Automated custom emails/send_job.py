@@ -0,0 +1,506 @@
+import time
+import heapq
+import random
+import shutil
+import logging
+import tempfile
+import functools
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import outbox as deliveries
+from smtp_pool import (DeliveryPool, DeliveryResult, OutgoingMessage, DEFAULT_CONNECTIONS, describe_smtp_error,
+                       is_transient_error)
+from attachments import MessageTooLarge, REJECT, COMPRESS
+from message_cache import MessageCache, MessageBuilder, init_render_worker, build_in_worker
+
+logger = logging.getLogger(__name__)
+
+# States of a send job
+PENDING = 'pending'
+CONNECTING = 'connecting'
+SENDING = 'sending'
+PAUSED = 'paused'
+CANCELLING = 'cancelling'
+FINISHED = 'finished'
+CANCELLED = 'cancelled'
+FAILED = 'failed'      # Could not connect, or stopped by an unexpected error; see job.error
+
+DONE_STATES = (FINISHED, CANCELLED, FAILED)
+
+# Progress is published at most this often (seconds), plus on every change of state
+DEFAULT_PROGRESS_INTERVAL = 0.25
+
+# Tries per email before a temporary failure (4xx reply, dropped connection) counts as
+# failed, and the wait before the first retry (doubled for every further retry, up to
+# DEFAULT_MAX_RETRY_DELAY, with some jitter so retries do not all arrive at once)
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 5.0
+DEFAULT_MAX_RETRY_DELAY = 300.0
+
+# Rows rendered and encoded ahead of the sending per render process
+RENDER_AHEAD_PER_WORKER = 2
+
+# Snapshot of a send job's counters. skipped are emails whose PDF could not be read,
+# cancelled are the emails that were not sent because the job was cancelled, retrying are
+# waiting to be tried again and finished_before were sent or failed for good in an earlier
+# run when resuming (they are not part of total).
+class SendProgress:
+    def __init__(self, state, total, sent, failed, skipped, cancelled, elapsed, retrying=0, finished_before=0):
+        self.state = state
+        self.total = total
+        self.sent = sent
+        self.failed = failed
+        self.skipped = skipped
+        self.cancelled = cancelled
+        self.elapsed = elapsed
+        self.retrying = retrying
+        self.finished_before = finished_before
+
+    @property
+    def remaining(self):
+        return max(0, self.total - self.sent - self.failed - self.skipped - self.cancelled)
+
+    @property
+    def messages_per_second(self):
+        return (self.sent + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+    def summary(self):
+        text = f"{self.sent} sent, {self.failed} failed, {self.remaining} remaining"
+        if self.skipped:
+            text += f", {self.skipped} skipped"
+        if self.cancelled:
+            text += f", {self.cancelled} cancelled"
+        if self.retrying:
+            text += f", {self.retrying} waiting to retry"
+        if self.finished_before:
+            text += f", {self.finished_before} done in an earlier run"
+        return f"{text} ({self.messages_per_second:.1f} emails/s)"
+
+# Hands the latest progress from the job's threads to whoever displays it. publish() only
+# swaps the snapshot under a lock and poll() returns it once (None when nothing changed),
+# so a GUI polling on a timer redraws at most once per tick however fast emails go out.
+class ProgressChannel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = None
+        self.version = 0
+        self.seen = 0
+
+    def publish(self, progress):
+        with self.lock:
+            self.latest = progress
+            self.version += 1
+
+    def poll(self):
+        with self.lock:
+            if self.version == self.seen:
+                return None
+            self.seen = self.version
+            return self.latest
+
+# One run of sending a SendPlan, independent of any GUI. start() runs it on a background
+# thread (or call run() to send on the current one); pause(), resume() and cancel() may be
+# called from any thread. Progress arrives through job.channel, and through on_progress
+# (called on the job's threads) when given. on_result is passed the final DeliveryResult
+# of every email; temporary failures are retried with exponential backoff first.
+#
+# template is a templates.MailTemplate, rendered with each row's fields. With
+# render_workers the rendering and encoding run in that many processes, for big runs
+# where they would otherwise hold the sending back; 0 does them on the job's thread.
+#
+# With an Outbox every email's outcome is recorded as it happens. resume=True skips the
+# emails the outbox has as sent, or as failed for good unless retry_failed is set.
+#
+# Emails larger than the server accepts (its SIZE limit, or max_message_bytes if lower)
+# are rejected, compressed or split as size_policy says (see attachments.py) before any of
+# their bytes are sent. Large PDFs are streamed from the file to the connections.
+#
+# dry_run builds and encodes every email as for a real run but sends none of them (see
+# smtp_pool.DryRunConnection); the outbox is not used. Together with stage_seconds and
+# time_to_first_send this times a mailing without a mail server.
+class SendJob:
+    def __init__(self, plan, sender, template, settings, connections=DEFAULT_CONNECTIONS, rate=None,
+                 on_result=None, on_progress=None, progress_interval=DEFAULT_PROGRESS_INTERVAL,
+                 outbox=None, resume=False, retry_failed=False, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_delay=DEFAULT_RETRY_DELAY, max_retry_delay=DEFAULT_MAX_RETRY_DELAY, render_workers=0,
+                 dry_run=False, size_policy=REJECT, max_message_bytes=None):
+        self.plan = plan
+        self.sender = sender
+        self.template = template
+        self.settings = settings
+        self.connections = connections
+        self.rate = rate
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.dry_run = dry_run
+        self.outbox = None if dry_run else outbox
+        self.resume_outbox = resume
+        self.retry_failed = retry_failed
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.render_workers = render_workers
+        self.max_message_bytes = max_message_bytes
+        self.builder = MessageBuilder(sender, template, size_policy=size_policy)
+        self.channel = ProgressChannel()
+
+        self.state = PENDING
+        self.error = None
+        self.total = plan.message_count
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cancelled = 0
+        self.finished_before = 0
+        self.lock = threading.Lock()
+        # Emails queued but not sent or failed for good yet, and the retries waiting for
+        # their time as a heap of (due, sequence, message); both guarded by self.lock
+        self.settled = threading.Condition(self.lock)
+        self.unresolved = 0
+        self.retries = []
+        self.retry_sequence = 0
+        self.stopping = False
+        self.running = threading.Event()
+        self.running.set()
+        self.cancel_requested = threading.Event()
+        self.thread = None
+        self.pool = None
+        self.cache = None
+        self.started_at = None
+        self.finished_at = None
+        self.first_sent_at = None
+        # Seconds spent per stage, summed over the render processes and SMTP connections
+        # (so with several of them a stage can add up to more than the run took):
+        # building the emails (template and PDF), encoding them, and sending them
+        self.stage_seconds = {'build': 0.0, 'encode': 0.0, 'send': 0.0}
+        self.last_published = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='send-job')
+        self.thread.start()
+        return self
+
+    # Wait for the job to end; returns False if timeout ran out first
+    def wait(self, timeout=None):
+        if self.thread is not None:
+            self.thread.join(timeout)
+        return self.state in DONE_STATES
+
+    @property
+    def done(self):
+        return self.state in DONE_STATES
+
+    def pause(self):
+        with self.lock:
+            if self.state not in (CONNECTING, SENDING):
+                return
+            self.running.clear()
+            if self.pool is not None:
+                self.pool.pause()
+        self.set_state(PAUSED)
+
+    def resume(self):
+        with self.lock:
+            if self.state != PAUSED:
+                return
+            self.running.set()
+            if self.pool is not None:
+                self.pool.resume()
+        self.set_state(SENDING)
+
+    # Stop queueing emails and drop the queued ones; emails already being sent finish
+    def cancel(self):
+        with self.lock:
+            if self.state in DONE_STATES:
+                return
+            self.cancel_requested.set()
+            self.running.set()
+            if self.pool is not None:
+                self.pool.cancel()
+            dropped = [job for _, _, job in self.retries]
+            self.retries = []
+        for job in dropped:
+            self.resolve(job)
+        self.set_state(CANCELLING)
+
+    def progress(self):
+        with self.lock:
+            elapsed = ((self.finished_at or time.perf_counter()) - self.started_at) if self.started_at else 0.0
+            return SendProgress(self.state, self.total, self.sent, self.failed, self.skipped, self.cancelled, elapsed,
+                                len(self.retries), self.finished_before)
+
+    def set_state(self, state):
+        with self.lock:
+            if self.state in DONE_STATES:
+                return
+            self.state = state
+        self.publish(force=True)
+
+    def publish(self, force=False):
+        now = time.monotonic()
+        with self.lock:
+            if not force and now - self.last_published < self.progress_interval:
+                return
+            self.last_published = now
+        progress = self.progress()
+        self.channel.publish(progress)
+        if self.on_progress:
+            try:
+                self.on_progress(progress)
+            except Exception as e:
+                logger.error(f"Error reporting progress: {e}")
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        if self.cancel_requested.is_set():
+            self.finish(CANCELLED)
+            return
+        self.set_state(CONNECTING)
+        finished = set()
+        if self.outbox is not None and self.resume_outbox:
+            finished = self.outbox.finished(self.retry_failed)
+            with self.lock:
+                self.finished_before = sum(1 for invoice in self.plan.iter_matched() for recipient in invoice.recipients
+                                        if (invoice.invoice_id, recipient) in finished)
+                self.total -= self.finished_before
+            logger.info(f"Resuming: {self.finished_before} emails done in an earlier run, {self.total} to send")
+        self.cache = MessageCache()
+        if self.dry_run:
+            logger.info("Dry run: the emails are built but not sent")
+        pool = DeliveryPool(self.settings, connections=self.connections, rate=self.rate, on_result=self.record,
+                            dry_run=self.dry_run)
+        try:
+            pool.start()
+        except Exception as e:
+            self.error = e
+            self.finish(FAILED)
+            return
+
+        limits = [limit for limit in (pool.size_limit, self.max_message_bytes) if limit]
+        self.builder.size_limit = min(limits) if limits else None
+        if self.builder.size_limit:
+            logger.info(f"Emails over {self.builder.size_limit / 1024 / 1024:.1f} MB: {self.builder.size_policy}")
+        if self.builder.size_policy == COMPRESS:
+            self.builder.temp_directory = tempfile.mkdtemp(prefix='mailmerge-')
+
+        with self.lock:
+            self.pool = pool
+            # pause() or cancel() may have come in while connecting
+            if not self.running.is_set():
+                pool.pause()
+            if self.cancel_requested.is_set():
+                pool.cancel()
+        if self.state == CONNECTING:
+            self.set_state(SENDING)
+
+        retry_thread = threading.Thread(target=self.run_retries, args=(pool,), name='send-job-retries', daemon=True)
+        retry_thread.start()
+        try:
+            self.queue_messages(pool, finished)
+            # Wait until every email was sent or failed for good, retries included
+            with self.settled:
+                while self.unresolved > 0:
+                    self.settled.wait()
+        except Exception as e:
+            logger.exception("Sending stopped by an unexpected error")
+            self.error = e
+            pool.cancel()
+        finally:
+            with self.settled:
+                self.stopping = True
+                self.settled.notify_all()
+            retry_thread.join()
+            # Waits for the queued emails (or for the cancelled ones to be dropped)
+            pool.close()
+            if self.outbox is not None:
+                self.outbox.flush()
+            if self.builder.temp_directory is not None:
+                shutil.rmtree(self.builder.temp_directory, ignore_errors=True)
+        logger.info(f"{self.sent} emails sent, {self.failed} failed ({pool.messages_per_second():.1f} emails/s)")
+        if self.error is not None:
+            self.finish(FAILED)
+        else:
+            self.finish(CANCELLED if self.cancel_requested.is_set() else FINISHED)
+
+    # Function to queue every matched invoice for each of its recipients, holding back while
+    # paused and stopping when cancelled. Recipients in finished were sent by an earlier run.
+    def queue_messages(self, pool, finished):
+        for invoice, key, recipients, message in self.iter_prepared(finished):
+            if self.cancel_requested.is_set():
+                return
+            invoice_id = invoice.invoice_id
+            if isinstance(message, OSError):
+                logger.error(f"Unable to read PDF file for invoice ID {invoice_id}: {message}")
+                with self.lock:
+                    self.skipped += len(recipients)
+                self.publish()
+                continue
+            if isinstance(message, MessageTooLarge):
+                # Failed for good before anything was sent, recorded like any other failure
+                logger.error(f"Not sending invoice ID {invoice_id}: {message}")
+                for recipient in recipients:
+                    with self.lock:
+                        self.unresolved += 1
+                    job = OutgoingMessage((invoice_id, recipient, None, key), self.sender, recipient, None)
+                    self.record(DeliveryResult(job, message))
+                continue
+            for recipient in recipients:
+                logger.info(f"Email sending to {recipient}")
+                with self.lock:
+                    self.unresolved += 1
+                if self.outbox is not None:
+                    self.outbox.record(invoice_id, recipient, deliveries.QUEUED)
+                pool.submit(OutgoingMessage((invoice_id, recipient, message.subject, key), self.sender, recipient,
+                                            functools.partial(message.for_recipient, recipient)))
+
+    # Function to stream the matched rows still to send as (invoice, recipients)
+    def iter_pending(self, finished):
+        for invoice in self.plan.iter_matched(with_fields=self.template.personalised):
+            self.running.wait()
+            if self.cancel_requested.is_set():
+                return
+            recipients = [recipient for recipient in invoice.recipients
+                          if (invoice.invoice_id, recipient) not in finished]
+            if recipients:
+                yield invoice, recipients
+
+    # Function to stream (invoice, cache key, recipients, message) in CSV order, where message
+    # is the row's InvoiceMessage, or the OSError or MessageTooLarge that stopped it being built. Every
+    # recipient of a row gets the same encoded email; with render_workers the rows are
+    # rendered and encoded in a process pool, a few rows ahead of the sending.
+    def iter_prepared(self, finished):
+        builder = self.builder
+        if self.render_workers <= 0:
+            for invoice, recipients in self.iter_pending(finished):
+                key = builder.cache_key(invoice)
+                message = self.cache.take(key, len(recipients))
+                if message is None:
+                    self.cache.wait_for_room()
+                    try:
+                        message = builder.build(invoice.invoice_id, invoice.pdf_path, invoice.fields)
+                    except (OSError, MessageTooLarge) as e:
+                        yield invoice, key, recipients, e
+                        continue
+                    self.count_stages(message)
+                    message = self.cache.add(key, message, len(recipients))
+                yield invoice, key, recipients, message
+            return
+
+        executor = ProcessPoolExecutor(max_workers=self.render_workers, initializer=init_render_worker,
+                                       initargs=(builder,))
+        in_flight = deque()
+        try:
+            for invoice, recipients in self.iter_pending(finished):
+                key = builder.cache_key(invoice)
+                message = self.cache.take(key, len(recipients))
+                if message is None:
+                    self.cache.wait_for_room()
+                    message = executor.submit(build_in_worker, invoice.invoice_id, invoice.pdf_path, invoice.fields)
+                in_flight.append((invoice, key, recipients, message))
+                if len(in_flight) >= self.render_workers * RENDER_AHEAD_PER_WORKER:
+                    yield self.collect(*in_flight.popleft())
+            while in_flight:
+                yield self.collect(*in_flight.popleft())
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    # Function to wait for a row's email from the render pool and cache it
+    def collect(self, invoice, key, recipients, message):
+        if isinstance(message, Future):
+            try:
+                message = message.result()
+            except (OSError, MessageTooLarge) as e:
+                return invoice, key, recipients, e
+            self.count_stages(message)
+            message = self.cache.add(key, message, len(recipients))
+        return invoice, key, recipients, message
+
+    def count_stages(self, message):
+        with self.lock:
+            self.stage_seconds['build'] += message.build_seconds
+            self.stage_seconds['encode'] += message.encode_seconds
+
+    # Seconds from the start of the run to the first email accepted by the server, or None
+    @property
+    def time_to_first_send(self):
+        if self.first_sent_at is None or self.started_at is None:
+            return None
+        return self.first_sent_at - self.started_at
+
+    # Called by the pool's threads for every email
+    def record(self, result):
+        job = result.job
+        invoice_id, recipient = job.key[0], job.key[1]
+        if result.cancelled:
+            self.resolve(job)
+            return
+        with self.lock:
+            self.stage_seconds['send'] += result.seconds
+
+        retry_in = None
+        if (not result.ok and job.attempts < self.max_attempts and is_transient_error(result.error)
+                and not self.cancel_requested.is_set()):
+            retry_in = min(self.max_retry_delay, self.retry_delay * 2 ** (job.attempts - 1)) * random.uniform(0.5, 1.0)
+        if self.outbox is not None:
+            if result.ok:
+                state = deliveries.SENT
+            else:
+                state = deliveries.RETRY if retry_in is not None or is_transient_error(result.error) else deliveries.FAILED
+            error = f"{describe_smtp_error(result.error)}: {result.error}" if result.error else None
+            self.outbox.record(invoice_id, recipient, state, job.attempts, error)
+            self.outbox.flush_if_due()
+
+        if retry_in is not None:
+            logger.warning(f"Temporary failure sending {invoice_id} to {recipient} (attempt {job.attempts}), "
+                           f"retrying in {retry_in:.0f}s: {describe_smtp_error(result.error)}")
+            with self.settled:
+                self.retry_sequence += 1
+                heapq.heappush(self.retries, (time.monotonic() + retry_in, self.retry_sequence, job))
+                self.settled.notify_all()
+            self.publish()
+            return
+
+        with self.lock:
+            if result.ok:
+                self.sent += 1
+                if self.first_sent_at is None:
+                    self.first_sent_at = time.perf_counter()
+            else:
+                self.failed += 1
+        if self.on_result:
+            self.on_result(result)
+        self.resolve(job)
+        self.publish()
+
+    # Function to mark an email as done with: sent, failed for good or dropped
+    def resolve(self, job):
+        self.cache.done(job.key[3])
+        with self.settled:
+            self.unresolved -= 1
+            self.settled.notify_all()
+
+    # Runs on its own thread: hands each retry back to the pool once its wait is over
+    def run_retries(self, pool):
+        while True:
+            with self.settled:
+                while not self.stopping and not (self.retries and self.retries[0][0] <= time.monotonic()):
+                    self.settled.wait(self.retries[0][0] - time.monotonic() if self.retries else None)
+                if self.stopping:
+                    return
+                _, _, job = heapq.heappop(self.retries)
+            self.running.wait()
+            if self.cancel_requested.is_set():
+                self.resolve(job)
+                continue
+            pool.submit(job)
+
+    def finish(self, state):
+        with self.lock:
+            self.finished_at = time.perf_counter()
+            if state == CANCELLED:
+                self.cancelled = self.total - self.sent - self.failed - self.skipped
+            self.state = state
+        self.publish(force=True)
@@ -0,0 +1,402 @@
+import time
+import queue
+import smtplib
+import logging
+import threading
+
+from attachments import MessageTooLarge
+
+logger = logging.getLogger(__name__)
+
+# Default number of SMTP connections; mail servers often limit connections per client,
+# so keep this modest
+DEFAULT_CONNECTIONS = 4
+
+# Streamed messages are written to the connection in pieces of about this size
+STREAM_WRITE_BYTES = 256 * 1024
+
+# Messages sent over one connection before it is closed and opened again. Many servers
+# drop or slow down clients that send too much over a single session.
+DEFAULT_MESSAGES_PER_CONNECTION = 100
+
+# Where and how to connect
+class SmtpSettings:
+    def __init__(self, host, port=25, starttls=False, username=None, password=None, timeout=60):
+        self.host = host
+        self.port = port
+        self.starttls = starttls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+
+# An email given as pieces ready for the wire (CRLF line endings, lines starting with "."
+# already doubled), so a large one is never held in memory whole. chunks is a function
+# returning an iterable of bytes; size is their total length, announced to servers that
+# support the SIZE extension so an email that is too large is refused before it is sent.
+class StreamedMessage:
+    def __init__(self, chunks, size):
+        self.chunks = chunks
+        self.size = size
+
+# One email to deliver. key identifies it to the caller (e.g. (invoice ID, recipient)).
+# message is an email.message.Message, the already serialised bytes/str, a
+# StreamedMessage, a list of StreamedMessages (sent one after the other as separate
+# emails, e.g. an attachment split in parts), or a function returning one of those, which
+# is called on the sending thread just before the email goes out so the queue does not
+# hold every message's bytes. attempts counts the sends tried.
+class OutgoingMessage:
+    def __init__(self, key, sender, recipients, message):
+        self.key = key
+        self.sender = sender
+        self.recipients = [recipients] if isinstance(recipients, str) else list(recipients)
+        self.message = message
+        self.attempts = 0
+
+# Outcome of one delivery, passed to the pool's on_result callback. cancelled is set for
+# messages the pool dropped without sending because it was cancelled.
+class DeliveryResult:
+    def __init__(self, job, error=None, seconds=0.0, connection=None, cancelled=False):
+        self.job = job
+        self.error = error
+        self.seconds = seconds
+        self.connection = connection
+        self.cancelled = cancelled
+
+    @property
+    def ok(self):
+        return self.error is None and not self.cancelled
+
+# Function to describe an SMTP error the way send_email always reported them
+def describe_smtp_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return "invalid recipient address"
+    if isinstance(error, smtplib.SMTPDataError):
+        return "data error"
+    if isinstance(error, smtplib.SMTPHeloError):
+        return "invalid HELO/EHLO message"
+    if isinstance(error, smtplib.SMTPSenderRefused):
+        return "invalid sender address"
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return "authentication error"
+    if isinstance(error, smtplib.SMTPException):
+        return "general error"
+    if isinstance(error, MessageTooLarge):
+        return "message too large"
+    return str(error) or error.__class__.__name__
+
+# Function to tell whether sending again later may succeed: 4xx replies, dropped
+# connections and network errors are transient, 5xx replies (bad address, rejected
+# message, ...) are permanent
+def is_transient_error(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, OSError)
+
+# Token bucket shared by all connections, limiting the pool to rate messages per second
+# (with bursts of up to burst messages). rate=None means no limit.
+class RateLimiter:
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# A persistent SMTP session that reconnects after messages_per_connection messages, or
+# when the server has dropped it
+class SmtpConnection:
+    def __init__(self, settings, messages_per_connection=DEFAULT_MESSAGES_PER_CONNECTION):
+        self.settings = settings
+        self.messages_per_connection = messages_per_connection
+        self.server = None
+        self.sent = 0
+        self.size_limit = None
+
+    def connect(self):
+        settings = self.settings
+        server = smtplib.SMTP(settings.host, settings.port, timeout=settings.timeout)
+        try:
+            if settings.starttls:
+                import ssl
+                server.starttls(context=ssl.create_default_context())
+            if settings.username:
+                server.login(settings.username, settings.password or '')
+            server.ehlo_or_helo_if_needed()
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+        self.sent = 0
+        # Largest email the server accepts, if it says (SIZE extension; 0 means no limit)
+        size = server.esmtp_features.get('size', '').strip()
+        self.size_limit = int(size) if size.isdigit() and int(size) > 0 else None
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def send(self, job):
+        if self.server is not None and self.sent >= self.messages_per_connection:
+            self.close()
+        message = job.message() if callable(job.message) else job.message
+        for attempt in range(2):
+            if self.server is None:
+                self.connect()
+            try:
+                if isinstance(message, StreamedMessage):
+                    self.send_streamed(job.sender, job.recipients, message)
+                elif isinstance(message, list):
+                    # Parts already accepted are not sent again when the connection drops
+                    while message:
+                        self.send_streamed(job.sender, job.recipients, message[0])
+                        message = message[1:]
+                elif isinstance(message, (bytes, str)):
+                    self.server.sendmail(job.sender, job.recipients, message)
+                else:
+                    self.server.send_message(message, job.sender, job.recipients)
+                self.sent += 1
+                return
+            except smtplib.SMTPServerDisconnected:
+                # The server closed an idle or busy session: open a new one and try again once
+                self.server = None
+                if attempt:
+                    raise
+
+    # Function to send a StreamedMessage, writing its chunks to the socket as they come.
+    # The same transaction as smtplib's sendmail, which needs the whole message at once.
+    def send_streamed(self, sender, recipients, message):
+        server = self.server
+        options = [f"SIZE={message.size}"] if server.has_extn('size') else []
+        code, response = server.mail(sender, options)
+        if code != 250:
+            self.reset(code)
+            raise smtplib.SMTPSenderRefused(code, response, sender)
+        refused = {}
+        for recipient in recipients:
+            code, response = server.rcpt(recipient)
+            if code not in (250, 251):
+                refused[recipient] = (code, response)
+            if code == 421:
+                self.reset(code)
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(recipients):
+            self.reset(code)
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, response = server.docmd('DATA')
+        if code != 354:
+            self.reset(code)
+            raise smtplib.SMTPDataError(code, response)
+        # Small pieces are gathered into larger writes: many small writes followed by waiting
+        # for the reply would stall on delayed acknowledgements
+        pending = []
+        pending_bytes = 0
+        for chunk in message.chunks():
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            if pending_bytes >= STREAM_WRITE_BYTES:
+                server.send(b''.join(pending))
+                pending = []
+                pending_bytes = 0
+        pending.append(b'.\r\n')
+        server.send(b''.join(pending))
+        code, response = server.getreply()
+        if code != 250:
+            self.reset(code)
+            raise smtplib.SMTPDataError(code, response)
+
+    # Function to abandon a refused transaction; a 421 reply means the server is closing
+    def reset(self, code):
+        if code == 421:
+            self.server.close()
+            return
+        try:
+            self.server.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+# Stands in for an SmtpConnection in a dry run: each message's bytes are built as for a
+# real send and thrown away, so a mailing can be timed and checked without a mail server
+class DryRunConnection:
+    def __init__(self):
+        self.server = None
+        self.sent = 0
+        self.size_limit = None
+
+    def connect(self):
+        self.server = 'dry run'
+        self.size_limit = None
+
+    def send(self, job):
+        message = job.message() if callable(job.message) else job.message
+        if isinstance(message, StreamedMessage):
+            message = [message]
+        if isinstance(message, list):
+            for part in message:
+                for _ in part.chunks():
+                    pass
+        elif not isinstance(message, (bytes, str)):
+            message.as_bytes()
+        self.sent += 1
+
+    def close(self):
+        self.server = None
+
+# Pool of SMTP connections fed from a bounded queue, one worker thread per connection.
+# submit() blocks while the queue is full, so building messages never runs far ahead of
+# sending them. on_result(result) is called on the worker threads without the pool's lock
+# held, so several workers may be in it at once and a slow handler (an outbox commit,
+# logging to a share) only holds up its own connection.
+# pause() holds the workers before their next message; cancel() makes them drop whatever
+# is still queued (reported with result.cancelled) so close() returns quickly.
+# With dry_run the connections are DryRunConnections and nothing leaves the machine.
+class DeliveryPool:
+    def __init__(self, settings, connections=DEFAULT_CONNECTIONS, queue_size=None,
+                 messages_per_connection=DEFAULT_MESSAGES_PER_CONNECTION, rate=None, on_result=None, dry_run=False):
+        self.settings = settings
+        self.dry_run = dry_run
+        self.connections = max(1, connections)
+        self.queue = queue.Queue(maxsize=queue_size or self.connections * 4)
+        self.messages_per_connection = messages_per_connection
+        self.limiter = RateLimiter(rate, burst=self.connections)
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.running = threading.Event()
+        self.running.set()
+        self.cancelled = False
+        self.threads = []
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        # Largest email the server accepts (the smallest any connection reported), known after start()
+        self.size_limit = None
+        self.started_at = None
+        self.finished_at = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Open every connection up front, so a wrong host or password is reported before
+    # anything is queued. Raises the error if not even one connection could be opened.
+    def start(self):
+        sessions = []
+        error = None
+        for index in range(self.connections):
+            if self.dry_run:
+                connection = DryRunConnection()
+            else:
+                connection = SmtpConnection(self.settings, self.messages_per_connection)
+            try:
+                connection.connect()
+            except Exception as e:
+                logger.warning(f"SMTP connection {index} could not connect: {e}")
+                error = e
+            sessions.append(connection)
+        if all(connection.server is None for connection in sessions):
+            raise error
+        limits = [connection.size_limit for connection in sessions if connection.size_limit]
+        self.size_limit = min(limits) if limits else None
+
+        self.started_at = time.perf_counter()
+        for index, connection in enumerate(sessions):
+            thread = threading.Thread(target=self.run_worker, args=(index, connection), name=f'smtp-{index}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue a message, blocking while the queue is full
+    def submit(self, job):
+        self.queue.put(job)
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.running.set()
+
+    # Wait for every queued message to be sent and close the connections
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.finished_at = time.perf_counter()
+
+    def messages_per_second(self):
+        if self.started_at is None:
+            return 0.0
+        elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return (self.sent + self.failed) / elapsed if elapsed > 0 else 0.0
+
+    def record(self, result):
+        with self.lock:
+            if result.cancelled:
+                self.dropped += 1
+            elif result.ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+        if self.on_result:
+            try:
+                self.on_result(result)
+            except Exception as e:
+                logger.error("Error handling result for %s: %s", result.job.key, e)
+
+    def run_worker(self, index, connection):
+        try:
+            while True:
+                job = self.queue.get()
+                if job is None:
+                    break
+                self.running.wait()
+                if self.cancelled:
+                    self.record(DeliveryResult(job, connection=index, cancelled=True))
+                    continue
+                self.limiter.acquire()
+                job.attempts += 1
+                started = time.perf_counter()
+                try:
+                    connection.send(job)
+                    error = None
+                except Exception as e:
+                    error = e
+                    # Do not reuse a session in an unknown state after a connection error
+                    if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused,
+                                          smtplib.SMTPDataError)):
+                        connection.close()
+                self.record(DeliveryResult(job, error, time.perf_counter() - started, index))
+        finally:
+            connection.close()
@@ -0,0 +1,92 @@
+import re
+import html
+
+# A merge field: {{ column }}, or {{ column | text used when the cell is empty }}
+FIELD = re.compile(r"\{\{\s*([^{}|]+?)\s*(?:\|\s*([^{}]*?)\s*)?\}\}")
+
+# Fields every row has, whatever the CSV's columns
+BUILTIN_FIELDS = ('invoice_id',)
+
+# Function to normalise a column or field name, so {{ Company Name }} finds "company name"
+def field_key(name):
+    return ' '.join(name.split()).casefold()
+
+# One template (subject, text body or HTML body), compiled once into a str.format string
+# with positional fields, so rendering a row is a single C-level format call instead of
+# parsing the template again. escape is applied to the values (html.escape for HTML).
+class CompiledTemplate:
+    def __init__(self, text, escape=None):
+        self.text = text
+        self.escape = escape
+        self.fields = []
+        parts = []
+        position = 0
+        for match in FIELD.finditer(text):
+            parts.append(self.literal(text[position:match.start()]))
+            parts.append('{%d}' % len(self.fields))
+            self.fields.append((field_key(match.group(1)), match.group(2) or ''))
+            position = match.end()
+        parts.append(self.literal(text[position:]))
+        self.format = ''.join(parts)
+
+    @staticmethod
+    def literal(text):
+        return text.replace('{', '{{').replace('}', '}}')
+
+    @property
+    def names(self):
+        return {name for name, _ in self.fields}
+
+    # Function to fill the template from a row's {field key: value}
+    def render(self, values):
+        if not self.fields:
+            return self.format.format()
+        escape = self.escape
+        filled = []
+        for name, default in self.fields:
+            value = values.get(name) or default
+            filled.append(escape(value) if escape else value)
+        return self.format.format(*filled)
+
+    # Function to list the fields with no value (and no default) in a row
+    def missing(self, values):
+        return [name for name, default in self.fields if not default and not values.get(name)]
+
+# Subject, text body and optional HTML body of a mailing, compiled once up front
+class MailTemplate:
+    def __init__(self, subject, body, html_body=None):
+        self.subject = CompiledTemplate(subject)
+        self.body = CompiledTemplate(body)
+        self.html = CompiledTemplate(html_body, escape=html.escape) if html_body else None
+
+    @property
+    def parts(self):
+        return [part for part in (self.subject, self.body, self.html) if part is not None]
+
+    @property
+    def names(self):
+        return set().union(*(part.names for part in self.parts))
+
+    @property
+    def personalised(self):
+        return bool(self.names)
+
+    # Function to list the fields the template uses that are neither among the CSV's field
+    # names (see contacts.field_names) nor built in
+    def unknown_fields(self, known):
+        return sorted(self.names - set(known) - set(BUILTIN_FIELDS))
+
+    # Function to list the fields that would come out empty for a row, without a default
+    def missing(self, values):
+        missing = []
+        for part in self.parts:
+            for name in part.missing(values):
+                if name not in missing:
+                    missing.append(name)
+        return missing
+
+    # Function to render (subject, body, html body or None) for a row's field values.
+    # Line breaks in the subject are replaced, a header cannot span lines.
+    def render(self, values):
+        subject = ' '.join(self.subject.render(values).splitlines())
+        return subject, self.body.render(values), self.html.render(values) if self.html else None